@@ -0,0 +1 @@
+"""es-fieldusage benchmarks"""
@@ -0,0 +1,58 @@
+"""
+Benchmark the persistent mapping cache
+
+Serves a synthetic cluster from a local fake Elasticsearch with artificial latency, and times
+:py:attr:`~.es_fieldusage.main.FieldUsage.results_by_index` without the mapping cache, then with
+a cold and a warm cache, counting the requests and bytes each run sends for mappings.
+
+$ python -m benchmarks.bench_cache --indices 1000
+"""
+import os
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import click
+from es_fieldusage.main import FieldUsage
+from benchmarks.bench_workers import build_cluster, client_args
+from benchmarks.fake_es import FakeElasticsearch
+
+def mapping_traffic(cluster):
+    """Return the number of mapping and cluster state requests counted by ``cluster``, and bytes"""
+    paths = [
+        path for path in cluster.requests
+        if path.endswith('/_mapping') or path.startswith('/_cluster/state/metadata/')]
+    return sum(cluster.requests[path] for path in paths), sum(cluster.sent[path] for path in paths)
+
+@click.command()
+@click.option('--indices', default=1000, show_default=True, help='Number of indices')
+@click.option('--fields', default=1000, show_default=True, help='Leaf fields per mapping')
+@click.option('--distinct', default=20, show_default=True, help='Distinct mappings')
+@click.option('--latency', default=0.02, show_default=True, help='Seconds added per request')
+@click.option(
+    '--per-index-latency', default=0.001, show_default=True,
+    help='Seconds added per index in a response')
+def run(indices, fields, distinct, latency, per_index_latency):
+    """Time results_by_index without, then with a cold and a warm mapping cache"""
+    cluster = build_cluster(indices, fields, distinct, latency, per_index_latency)
+    expected = None
+    with TemporaryDirectory() as tmpdir, FakeElasticsearch(cluster) as url:
+        filename = os.path.join(tmpdir, 'mappings.json')
+        runs = [('no cache', None), ('cold cache', filename), ('warm cache', filename)]
+        for label, cache in runs:
+            cluster.requests.clear()
+            cluster.sent.clear()
+            start = perf_counter()
+            field_usage = FieldUsage(*client_args(url), 'index-*', mapping_cache=cache)
+            result = field_usage.results_by_index
+            elapsed = perf_counter() - start
+            if expected is None:
+                expected = result
+            elif list(result.items()) != list(expected.items()):
+                raise SystemExit(f'Result mismatch with {label}!')
+            requests, sent = mapping_traffic(cluster)
+            click.echo(
+                f'{label:>10}: {elapsed:8.3f} s  {requests:>3} mapping requests, '
+                f'{sent / 2**20:7.2f} MB')
+        click.echo(f'Cache file: {os.path.getsize(filename) / 2**20:.1f} MB')
+
+if __name__ == '__main__':
+    run()  # pylint: disable=no-value-for-parameter
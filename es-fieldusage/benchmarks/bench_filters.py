@@ -0,0 +1,50 @@
+"""
+Benchmark field filters
+
+Serves a synthetic cluster from a local fake Elasticsearch, and times the per-index results and
+summary report, with no filter, then with ``--include`` and ``--exclude`` patterns keeping fewer
+and fewer of the fields, with the time spent aggregating shard stats, and merging and sorting
+each index's fields. Fetching and flattening the mappings is the same for every filter.
+
+$ python -m benchmarks.bench_filters --indices 500 --fields 2000
+"""
+from time import perf_counter
+import click
+from es_fieldusage.main import FieldUsage
+from benchmarks.bench_workers import client_args
+from benchmarks.fake_es import FakeElasticsearch
+from benchmarks.generators import synthetic_cluster
+
+# (label, include, exclude). The synthetic fields are obj0_N.obj1_N.field_N, with 10 obj0_N
+FILTERS = [
+    ('none', [], []),
+    ('exclude *.keyword', [], ['*.keyword']),
+    ('include 3 of 10', ['obj0_[0-2].*'], []),
+    ('include 1 of 10', ['/obj0_0\\..*/'], ['*.keyword']),
+]
+
+@click.command()
+@click.option('--indices', default=500, show_default=True, help='Number of indices')
+@click.option('--shards', default=2, show_default=True, help='Shards per index')
+@click.option('--fields', default=2000, show_default=True, help='Leaf fields per mapping')
+def run(indices, shards, fields):
+    """Time the results and report with each filter"""
+    cluster = synthetic_cluster(indices, shards=shards, fields=fields, ratio=0.5)
+    with FakeElasticsearch(cluster) as url:
+        for label, include, exclude in FILTERS:
+            start = perf_counter()
+            field_usage = FieldUsage(
+                *client_args(url), 'index-*', include=include, exclude=exclude)
+            _ = field_usage.results_by_index
+            field_count = field_usage.report['field_count']
+            elapsed = perf_counter() - start
+            phases = field_usage.metrics.as_dict()['phases']
+            merging = sum(
+                phases[name]['seconds'] for name in ('filter_fields', 'merge', 'sort')
+                if name in phases)
+            click.echo(
+                f'{label:<18}: {elapsed:8.3f} s total, {phases["aggregate"]["seconds"]:7.3f} s '
+                f'aggregating, {merging:7.3f} s merging and sorting, {field_count:>6} fields')
+
+if __name__ == '__main__':
+    run()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,91 @@
+"""
+Benchmark output format throughput
+
+Writes the accessed and unaccessed fields of one large result in each output format, and times
+writing it, and reading it back as rows, as a downstream consumer would.
+
+$ python -m benchmarks.bench_formats --fields 1000000
+"""
+import csv
+import io
+import json
+import random
+from time import perf_counter
+from unittest.mock import patch
+import click
+from es_fieldusage.commands import write_file
+from es_fieldusage.helpers import formats
+from es_fieldusage.helpers.store import FieldCounts, FieldVocabulary
+
+def build_data(fields, ratio, seed=42):
+    """Return report data like ``FieldUsage.report``, for ``fields`` fields"""
+    rng = random.Random(seed)
+    counts = {
+        f'obj{num % 100}.field_{num}': rng.randint(1, 10000) if rng.random() < ratio else 0
+        for num in range(fields)
+    }
+    result = FieldCounts.from_items(
+        FieldVocabulary(), sorted(counts.items(), key=lambda item: item[1], reverse=True))
+    return {'all_indices': {'accessed': result.accessed(), 'unaccessed': result.unaccessed()}}
+
+def parse_text(data):
+    """Parse ``field,count`` text lines"""
+    return [line.rsplit(',', 1) for line in data.decode('utf-8').splitlines()]
+
+def parse_ndjson(data):
+    """Parse NDJSON rows"""
+    return [json.loads(line) for line in data.splitlines()]
+
+def parse_csv(data):
+    """Parse CSV rows"""
+    return list(csv.reader(io.StringIO(data.decode('utf-8'))))
+
+def parse_arrow(data):
+    """Read an Arrow IPC file into a table"""
+    return formats.pa.ipc.open_file(formats.pa.BufferReader(data)).read_all()
+
+def parse_columns(data):
+    """Read a packed columnar file"""
+    return formats.read_columns(io.BytesIO(data))
+
+def timed(func, *args):
+    """Return the result of ``func(*args)`` and the seconds it took"""
+    start = perf_counter()
+    result = func(*args)
+    return result, perf_counter() - start
+
+def write(output_format, data):
+    """Return the bytes written for ``data`` in ``output_format``"""
+    fdesc = io.BytesIO()
+    write_file(fdesc, output_format, data, 'all_indices', ['accessed', 'unaccessed'], True, ',')
+    return fdesc.getvalue()
+
+@click.command()
+@click.option('--fields', default=1000000, show_default=True, help='Rows to write')
+@click.option('--ratio', default=0.3, show_default=True, help='Ratio of fields accessed')
+def run(fields, ratio):
+    """Time writing and parsing each output format"""
+    data = build_data(fields, ratio)
+    cases = [
+        ('text', 'text', parse_text, None),
+        ('ndjson', 'ndjson', parse_ndjson, None),
+        ('csv', 'csv', parse_csv, None),
+        ('packed', 'columnar', parse_columns, patch('es_fieldusage.helpers.formats.pa', None)),
+    ]
+    if formats.pa is not None:
+        cases.append(('arrow', 'columnar', parse_arrow, None))
+    click.echo(f'{fields} rows')
+    for label, output_format, parse, context in cases:
+        if context is not None:
+            with context:
+                output, write_time = timed(write, output_format, data)
+        else:
+            output, write_time = timed(write, output_format, data)
+        _, parse_time = timed(parse, output)
+        click.echo(
+            f'{label:>7}: write {write_time:7.3f} s ({fields / write_time / 1e6:5.2f} M rows/s, '
+            f'{len(output) / write_time / 2**20:6.1f} MB/s)  {len(output) / 2**20:6.1f} MB  '
+            f'parse {parse_time:7.3f} s')
+
+if __name__ == '__main__':
+    run()  # pylint: disable=no-value-for-parameter
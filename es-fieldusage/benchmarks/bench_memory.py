@@ -0,0 +1,70 @@
+"""
+Benchmark memory use of field usage results
+
+Builds ``usage_stats``, ``results_by_index``, ``per_index_report`` and ``report`` for a synthetic
+cluster through an in-process fake client, and compares the memory they hold in the compact
+columnar store with the same data held as a dictionary per index, as it was before.
+
+$ python -m benchmarks.bench_memory --indices 2000 --fields 3000
+"""
+import tracemalloc
+from time import perf_counter
+from unittest.mock import MagicMock
+import click
+from es_fieldusage.helpers import utils
+from es_fieldusage.main import FieldUsage
+from benchmarks.fake_es import FakeClient, FakeCluster
+from benchmarks.generators import synthetic_mapping, synthetic_usage
+
+def as_dicts(field_usage):
+    """Return the same data as ``field_usage`` holds, as plain dictionaries"""
+    return {
+        'usage_stats': {
+            idx: dict(counts.items()) for idx, counts in field_usage.usage_stats.items()},
+        'per_index_data': {
+            idx: dict(counts.items()) for idx, counts in field_usage.results_by_index.items()},
+        'per_index_report_data': {
+            idx: {key: dict(view.items()) for key, view in value.items()}
+            for idx, value in field_usage.per_index_report.items()
+        },
+        'results_data': dict(field_usage.results.items()),
+    }
+
+def traced(func):
+    """Return the result of ``func()`` and the memory it allocated and still holds, in MB"""
+    tracemalloc.start()
+    result = func()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current / 1024**2
+
+@click.command()
+@click.option('--indices', default=500, show_default=True, help='Number of indices')
+@click.option('--fields', default=3000, show_default=True, help='Leaf fields per mapping')
+@click.option('--ratio', default=0.3, show_default=True, help='Ratio of fields accessed')
+def run(indices, fields, ratio):
+    """Measure the memory held by the compact store and the equivalent dictionaries"""
+    mapping = synthetic_mapping(fields)
+    leaves = list(utils.flatten_mapping(mapping).keys())
+    cluster = FakeCluster(
+        mappings={f'index-{num:05}': mapping for num in range(indices)},
+        usage={
+            f'index-{num:05}': synthetic_usage(leaves, ratio, seed=num) for num in range(indices)},
+    )
+
+    def build():
+        field_usage = FieldUsage(MagicMock(), MagicMock(), 'index-*', client=FakeClient(cluster))
+        _ = field_usage.per_index_report
+        _ = field_usage.report
+        return field_usage
+
+    start = perf_counter()
+    field_usage, store_mb = traced(build)
+    click.echo(f'{indices} indices x {fields} fields, built in {perf_counter() - start:.1f} s')
+    click.echo(f'{"compact store":>14}: {store_mb:9.1f} MB')
+    _, dict_mb = traced(lambda: as_dicts(field_usage))
+    click.echo(f'{"dictionaries":>14}: {dict_mb:9.1f} MB')
+    click.echo(f'{"reduction":>14}: {dict_mb / store_mb:9.1f}x')
+
+if __name__ == '__main__':
+    run()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,56 @@
+"""
+Benchmark merging field usage into an index mapping
+
+Compares the legacy nested dict-of-dicts merge (``convert_mapping``, tuple keys,
+``iterate_paths`` and ``reduce(getitem, ...)`` per leaf) with the single-pass flattened field
+index used by :py:meth:`~.es_fieldusage.main.FieldUsage.merge_results`.
+
+$ python -m benchmarks.bench_merge --fields 5000
+"""
+from timeit import repeat
+import click
+from es_fieldusage.helpers import utils
+from benchmarks.generators import synthetic_mapping, synthetic_usage
+
+def legacy_merge(mapping, usage):
+    """The original merge_results implementation"""
+    data = utils.convert_mapping(mapping)
+    for field in list(usage.keys()):
+        if '.' in field:
+            path = tuple(field.split('.'))
+        else:
+            path = field
+        data[path] = usage[field]
+    retval = {}
+    for path in utils.iterate_paths(data):
+        value = utils.get_value_from_path(data, path)
+        key = '.'.join(utils.detuple(path))
+        retval[key] = value
+    return retval
+
+def flattened_merge(mapping, usage):
+    """The flattened field index merge"""
+    data = utils.flatten_mapping(mapping)
+    data.update(usage)
+    return data
+
+@click.command()
+@click.option('--fields', default=5000, show_default=True, help='Leaf fields in the mapping')
+@click.option('--depth', default=4, show_default=True, help='Object nesting depth')
+@click.option('--rounds', default=20, show_default=True, help='Timed rounds per implementation')
+def run(fields, depth, rounds):
+    """Time the legacy and flattened merge implementations"""
+    mapping = synthetic_mapping(fields, depth=depth)
+    usage = synthetic_usage(list(utils.flatten_mapping(mapping).keys()))
+    legacy = utils.sort_by_value(legacy_merge(mapping, usage))
+    flattened = utils.sort_by_value(flattened_merge(mapping, usage))
+    if list(legacy.items()) != list(flattened.items()):
+        raise SystemExit('Result mismatch between legacy and flattened merge!')
+    timings = {}
+    for name, func in {'legacy': legacy_merge, 'flattened': flattened_merge}.items():
+        timings[name] = min(repeat(lambda f=func: f(mapping, usage), number=1, repeat=rounds))
+        click.echo(f'{name:>10}: {timings[name] * 1000:9.3f} ms per merge')
+    click.echo(f'{"speedup":>10}: {timings["legacy"] / timings["flattened"]:9.1f}x')
+
+if __name__ == '__main__':
+    run()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,57 @@
+"""
+Benchmark report computation
+
+Times each ``stdout`` report use case through an in-process fake client: the summary counts only,
+the accessed fields, and the unaccessed fields, computed on demand from the usage stats and
+distinct mappings, against the summary built from every index's full merged result, as it was.
+
+$ python -m benchmarks.bench_report --indices 100,1000,5000
+"""
+from time import perf_counter
+from unittest.mock import MagicMock
+import click
+from es_fieldusage.main import FieldUsage
+from benchmarks.bench_workers import build_cluster
+from benchmarks.fake_es import FakeClient
+
+def field_usage(cluster):
+    """Return a FieldUsage for every index in ``cluster``"""
+    return FieldUsage(MagicMock(), MagicMock(), 'index-*', client=FakeClient(cluster))
+
+def timed(cluster, func):
+    """Return the seconds ``func(field_usage)`` takes, not counting fetching the usage stats"""
+    obj = field_usage(cluster)
+    start = perf_counter()
+    func(obj)
+    return perf_counter() - start
+
+def summary(report):
+    """Return the summary counts from ``report``"""
+    return report['field_count'], report['accessed_count'], report['unaccessed_count']
+
+def full_results(obj):
+    """Return the summary counts from the full results of ``obj``, as it was"""
+    results = obj.results
+    return len(results), len(results.accessed()), len(results.unaccessed())
+
+@click.command()
+@click.option('--indices', default='100,1000,5000', show_default=True, help='Index counts')
+@click.option('--fields', default=1000, show_default=True, help='Leaf fields per mapping')
+@click.option('--distinct', default=5, show_default=True, help='Distinct mappings')
+def run(indices, fields, distinct):
+    """Time each report section at each index count"""
+    for count in [int(x) for x in indices.split(',')]:
+        cluster = build_cluster(count, fields, distinct, 0.0, 0.0)
+        if summary(field_usage(cluster).report) != full_results(field_usage(cluster)):
+            raise SystemExit('Summary mismatch!')
+        legacy = timed(cluster, full_results)
+        click.echo(f'{count:>6} indices: full results {legacy:8.3f} s')
+        for label, func in [
+                ('summary', lambda obj: summary(obj.report)),
+                ('accessed', lambda obj: obj.report['accessed']),
+                ('unaccessed', lambda obj: obj.report['unaccessed'])]:
+            elapsed = timed(cluster, func)
+            click.echo(f'{label:>26} {elapsed:8.3f} s  ({legacy / elapsed:6.1f}x)')
+
+if __name__ == '__main__':
+    run()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,68 @@
+"""
+Benchmark data stream rollups
+
+Serves a synthetic cluster of data streams, each with many backing indices, from a local fake
+Elasticsearch, and times the per-index results, and writing them as NDJSON, with and without
+``rollup``, with the number of entries and bytes of output each produces.
+
+$ python -m benchmarks.bench_rollup --streams 20 --backing 100
+"""
+import io
+from time import perf_counter
+import click
+from es_fieldusage.helpers import formats, utils
+from es_fieldusage.main import FieldUsage
+from benchmarks.bench_workers import client_args
+from benchmarks.fake_es import FakeCluster, FakeElasticsearch
+from benchmarks.generators import synthetic_mapping, synthetic_usage
+
+def build_cluster(streams, backing, fields):
+    """
+    Return a FakeCluster of ``streams`` data streams of ``backing`` backing indices each. The
+    mapping of each data stream gains a field every few backing indices, as dynamic mappings do.
+    """
+    cluster = FakeCluster()
+    for stream in range(streams):
+        name = f'logs-app{stream:03}-default'
+        cluster.data_streams[name] = []
+        for num in range(backing):
+            idx = f'.ds-{name}-2026.10.01-{num + 1:06}'
+            mapping = synthetic_mapping(fields + num // 10)
+            cluster.mappings[idx] = mapping
+            cluster.usage[idx] = synthetic_usage(
+                list(utils.flatten_mapping(mapping)), seed=stream * backing + num)
+            cluster.data_streams[name].append(idx)
+    return cluster
+
+def ndjson_size(field_usage):
+    """Return the bytes of NDJSON output of the per-index results of ``field_usage``"""
+    buffer = io.BytesIO()
+    for idx, data in field_usage.per_index_report.items():
+        formats.write_ndjson(buffer, idx, list(data.items()))
+    return buffer.tell()
+
+@click.command()
+@click.option('--streams', default=20, show_default=True, help='Number of data streams')
+@click.option('--backing', default=100, show_default=True, help='Backing indices per data stream')
+@click.option('--fields', default=500, show_default=True, help='Leaf fields per mapping')
+def run(streams, backing, fields):
+    """Time per-index results and output with and without rollup"""
+    cluster = build_cluster(streams, backing, fields)
+    with FakeElasticsearch(cluster) as url:
+        totals = {}
+        for rollup in (False, True):
+            start = perf_counter()
+            field_usage = FieldUsage(*client_args(url), 'logs-*', rollup=rollup)
+            entries = len(field_usage.results_by_index)
+            size = ndjson_size(field_usage)
+            elapsed = perf_counter() - start
+            totals[rollup] = list(field_usage.results.items())
+            merges = field_usage.metrics.as_dict()['phases']['merge']['calls']
+            click.echo(
+                f'rollup={str(rollup):<5}: {elapsed:8.3f} s  {entries:>6} entries, '
+                f'{merges:>6} merges, {size / 2**20:8.2f} MB of NDJSON')
+        if totals[False] != totals[True]:
+            raise SystemExit('Totals differ with rollup!')
+
+if __name__ == '__main__':
+    run()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,32 @@
+"""
+Benchmark saving, loading and diffing a ``--snapshot`` file
+
+$ python -m benchmarks.bench_snapshot --indices 2000 --fields 3000
+"""
+import os
+from tempfile import TemporaryDirectory
+import click
+from es_fieldusage.helpers.snapshot import diff, load_snapshot, save_snapshot
+from benchmarks.bench_sum import build_store, timed
+
+@click.command()
+@click.option('--indices', default=2000, show_default=True, help='Number of indices')
+@click.option('--fields', default=3000, show_default=True, help='Fields per index')
+@click.option('--ratio', default=0.3, show_default=True, help='Ratio of fields accessed')
+def run(indices, fields, ratio):
+    """Time a snapshot round trip and diff of generated usage counts"""
+    previous = build_store(indices, fields, ratio, seed=1)
+    current = build_store(indices, fields, ratio, seed=2)
+    with TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, 'snapshot')
+        _, save_time = timed(lambda: save_snapshot(filename, previous, 'now'))
+        size = os.path.getsize(filename)
+        (loaded, _, _), load_time = timed(lambda: load_snapshot(filename))
+    (_, resets), diff_time = timed(lambda: diff(current, loaded))
+    click.echo(f'{indices} indices x {fields} fields: {size / 2**20:.1f} MB snapshot')
+    click.echo(f'  save {save_time:8.3f} s')
+    click.echo(f'  load {load_time:8.3f} s')
+    click.echo(f'  diff {diff_time:8.3f} s  ({len(resets)} indices reset)')
+
+if __name__ == '__main__':
+    run()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,91 @@
+"""
+Benchmark CLI startup time
+
+Imports :py:mod:`es_fieldusage.cli` in fresh interpreters with ``python -X importtime``, and reports
+the best total import time, and the slowest modules it imports. Then times ``--help`` for the
+group and each command, end to end.
+
+Fails if the import takes longer than ``--max-ms``, or if any of the ``--forbid`` modules, which
+should only be imported when a command needs them, are imported at startup:
+
+$ python -m benchmarks.bench_startup --runs 10 --max-ms 500
+"""
+import re
+import subprocess
+import sys
+from time import perf_counter
+import click
+
+# "import time: self [us] | cumulative | imported package", indented by nesting level
+IMPORTTIME = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$')
+COMMANDS = [[], ['show-indices'], ['stdout'], ['file'], ['index']]
+
+def import_times():
+    """
+    Import ``es_fieldusage.cli`` in a new interpreter with ``-X importtime``
+
+    :returns: A list of ``(cumulative microseconds, nesting level, module)`` tuples, in the order
+        the imports completed
+    :rtype: list
+    """
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import es_fieldusage.cli'],
+        capture_output=True, text=True, check=True)
+    times = []
+    for line in proc.stderr.splitlines():
+        match = IMPORTTIME.match(line)
+        if match:
+            times.append((int(match.group(2)), len(match.group(3)) // 2, match.group(4)))
+    return times
+
+def help_time(args):
+    """Return the seconds taken to run ``es-fieldusage *args --help`` in a new interpreter"""
+    start = perf_counter()
+    subprocess.run(
+        [sys.executable, '-c', 'from es_fieldusage.cli import run; run()', *args, '--help'],
+        capture_output=True, check=True)
+    return perf_counter() - start
+
+@click.command()
+@click.option('--runs', default=5, show_default=True, help='Fresh interpreters to time; best kept')
+@click.option('--top', default=10, show_default=True, help='Slowest top-level imports to show')
+@click.option('--max-ms', type=float, help='Fail if importing the CLI takes longer than this')
+@click.option(
+    '--forbid',
+    default=(
+        'numpy,pyarrow,ecs_logging,es_client,elasticsearch8,elastic_transport,voluptuous,six,'
+        'es_fieldusage.commands,es_fieldusage.main'
+    ),
+    show_default=True, help='Comma-separated modules which must not be imported at startup')
+def run(runs, top, max_ms, forbid):
+    """Time importing es_fieldusage.cli, and --help of each command"""
+    best = None
+    for _ in range(runs):
+        times = import_times()
+        total = next(value for value, _, name in times if name == 'es_fieldusage.cli')
+        if best is None or total < best[0]:
+            best = (total, times)
+    total, times = best
+    click.echo(f'import es_fieldusage.cli: {total / 1000:8.1f} ms (best of {runs})')
+    click.echo('\nSlowest top-level imports:')
+    # The CLI's own imports are one level below it
+    toplevel = sorted(
+        (item for item in times if item[1] == 1), key=lambda item: -item[0])[:top]
+    for value, _, name in toplevel:
+        click.echo(f'{value / 1000:8.1f} ms  {name}')
+    click.echo('\n--help, end to end:')
+    for args in COMMANDS:
+        elapsed = min(help_time(args) for _ in range(runs))
+        click.echo(f'{elapsed * 1000:8.1f} ms  es-fieldusage {" ".join(args + ["--help"])}')
+    failures = []
+    imported = {name for _, _, name in times}
+    for name in [name for name in forbid.split(',') if name]:
+        if name in imported:
+            failures.append(f'{name} is imported at startup')
+    if max_ms is not None and total / 1000 > max_ms:
+        failures.append(f'import took {total / 1000:.1f} ms, more than {max_ms} ms')
+    if failures:
+        raise SystemExit('\n' + '\n'.join(failures))
+
+if __name__ == '__main__':
+    run()  # pylint: disable=no-value-for-parameter
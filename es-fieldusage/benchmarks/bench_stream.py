@@ -0,0 +1,61 @@
+"""
+Benchmark peak memory use of field usage stats aggregation
+
+Generates a multi-hundred-MB field_usage_stats response fixture, serves it from a local fake
+Elasticsearch, and measures the peak RSS and time of building ``FieldUsage.usage_stats`` with
+and without ``stream=True``. Each mode runs in a fresh interpreter, so peak RSS is not shared.
+
+$ python -m benchmarks.bench_stream run --indices 200 --shards 30 --fields 200
+"""
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+import click
+from es_fieldusage.main import FieldUsage
+from benchmarks.bench_workers import client_args
+from benchmarks.fake_es import FakeCluster, FakeElasticsearch
+from benchmarks.generators import write_field_usage_fixture
+
+def peak_rss_mb():
+    """Return the peak resident set size of this process in MB"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+@click.group()
+def cli():
+    """Field usage stats memory benchmark"""
+
+@cli.command()
+@click.option('--url', required=True)
+@click.option('--stream', is_flag=True)
+def measure(url, stream):
+    """Measure a single run against the fake Elasticsearch at URL"""
+    baseline = peak_rss_mb()
+    start = perf_counter()
+    field_usage = FieldUsage(*client_args(url), 'index-*', stream=stream)
+    elapsed = perf_counter() - start
+    click.echo(
+        f'{"stream" if stream else "legacy":>7}: {elapsed:7.2f} s  peak RSS {peak_rss_mb():8.1f} MB'
+        f'  (baseline {baseline:.1f} MB, {len(field_usage.usage_stats)} indices)')
+
+@cli.command()
+@click.option('--indices', default=200, show_default=True, help='Number of indices')
+@click.option('--shards', default=30, show_default=True, help='Shards per index')
+@click.option('--fields', default=200, show_default=True, help='Fields per shard')
+def run(indices, shards, fields):
+    """Generate the fixture, then measure both modes"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fixture = os.path.join(tmpdir, 'field_usage_stats.json')
+        size = write_field_usage_fixture(fixture, indices, shards, fields)
+        click.echo(f'Fixture: {size / 1024**2:.1f} MB, {indices * shards} shards')
+        cluster = FakeCluster()
+        cluster.files['/index-*/_field_usage_stats'] = fixture
+        with FakeElasticsearch(cluster, process=True) as url:
+            for flags in ([], ['--stream']):
+                cmd = [sys.executable, '-m', 'benchmarks.bench_stream', 'measure', '--url', url]
+                subprocess.run(cmd + flags, check=True)
+
+if __name__ == '__main__':
+    cli()
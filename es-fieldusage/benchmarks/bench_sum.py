@@ -0,0 +1,60 @@
+"""
+Benchmark summing field usage results across indices
+
+Compares the dictionary path (``utils.sum_dict_values`` with ``sort_by_name`` and
+``sort_by_value``) with :py:meth:`~.es_fieldusage.helpers.store.UsageStore.totals`, which is
+vectorized with NumPy when it is installed, at increasing index counts.
+
+$ python -m benchmarks.bench_sum --indices 100,1000,10000
+"""
+import random
+from array import array
+from time import perf_counter
+from unittest.mock import patch
+import click
+from es_fieldusage.helpers import utils
+from es_fieldusage.helpers.store import COUNT_TYPE, ID_TYPE, UsageStore, np
+
+def build_store(indices, fields, ratio, seed=42):
+    """Return a UsageStore of ``indices`` indices, each with ``fields`` fields"""
+    rng = random.Random(seed)
+    store = UsageStore()
+    for num in range(fields):
+        store.vocab.get_id(f'field_{num}')
+    for num in range(indices):
+        ids = array(ID_TYPE, rng.sample(range(fields), fields))
+        counts = array(
+            COUNT_TYPE, (rng.randint(1, 1000) if rng.random() < ratio else 0 for _ in ids))
+        store.columns[f'index-{num:05}'] = (ids, counts)
+    return store
+
+def timed(func):
+    """Return the result of ``func()`` and the seconds it took"""
+    start = perf_counter()
+    result = func()
+    return result, perf_counter() - start
+
+@click.command()
+@click.option('--indices', default='100,1000,10000', show_default=True, help='Index counts')
+@click.option('--fields', default=1000, show_default=True, help='Fields per index')
+@click.option('--ratio', default=0.3, show_default=True, help='Ratio of fields accessed')
+def run(indices, fields, ratio):
+    """Time the dictionary and array summing paths at each index count"""
+    click.echo(f'NumPy: {"version " + np.__version__ if np is not None else "not installed"}')
+    for count in [int(x) for x in indices.split(',')]:
+        store = build_store(count, fields, ratio)
+        legacy, legacy_time = timed(lambda s=store: utils.sort_by_value(utils.sum_dict_values(s)))
+        with patch('es_fieldusage.helpers.store.np', None):
+            plain, plain_time = timed(store.totals)
+        line = f'{count:>6} indices: dicts {legacy_time:8.3f} s  arrays {plain_time:8.3f} s'
+        if np is not None:
+            vectorized, vector_time = timed(store.totals)
+            if list(vectorized.items()) != list(legacy.items()):
+                raise SystemExit('Result mismatch for the vectorized path!')
+            line += f'  numpy {vector_time:8.3f} s  ({legacy_time / vector_time:5.1f}x)'
+        if list(plain.items()) != list(legacy.items()):
+            raise SystemExit('Result mismatch for the array path!')
+        click.echo(line)
+
+if __name__ == '__main__':
+    run()  # pylint: disable=no-value-for-parameter
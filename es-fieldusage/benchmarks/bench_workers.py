@@ -0,0 +1,64 @@
+"""
+Benchmark concurrent per-index result computation
+
+Serves a synthetic cluster from a local fake Elasticsearch with artificial latency, and times
+:py:attr:`~.es_fieldusage.main.FieldUsage.results_by_index` at increasing worker counts.
+
+$ python -m benchmarks.bench_workers --indices 400 --latency 0.05
+"""
+from time import perf_counter
+import click
+from es_client.builder import ClientArgs, OtherArgs
+from es_fieldusage.helpers import utils
+from es_fieldusage.main import FieldUsage
+from benchmarks.fake_es import FakeCluster, FakeElasticsearch
+from benchmarks.generators import synthetic_mapping, synthetic_usage
+
+def build_cluster(indices, fields, distinct, latency, per_index_latency):
+    """Return a FakeCluster of ``indices`` indices sharing ``distinct`` different mappings"""
+    mappings = {}
+    usage = {}
+    for num in range(indices):
+        mapping = synthetic_mapping(fields + num % distinct)
+        leaves = list(utils.flatten_mapping(mapping).keys())
+        mappings[f'index-{num:05}'] = mapping
+        usage[f'index-{num:05}'] = synthetic_usage(leaves, seed=num)
+    return FakeCluster(
+        mappings, usage, latency=latency, per_index_latency=per_index_latency)
+
+def client_args(url):
+    """Return ClientArgs, OtherArgs for connecting to ``url``"""
+    cargs = ClientArgs()
+    cargs.update_settings({'hosts': [url]})
+    return cargs, OtherArgs()
+
+@click.command()
+@click.option('--indices', default=400, show_default=True, help='Number of indices')
+@click.option('--fields', default=500, show_default=True, help='Leaf fields per mapping')
+@click.option('--distinct', default=5, show_default=True, help='Distinct mappings')
+@click.option('--latency', default=0.05, show_default=True, help='Seconds added per request')
+@click.option(
+    '--per-index-latency', default=0.01, show_default=True,
+    help='Seconds added per index in a response')
+@click.option(
+    '--workers', default='1,2,4,8,16', show_default=True, help='Comma-separated worker counts')
+def run(indices, fields, distinct, latency, per_index_latency, workers):
+    """Time results_by_index against a fake Elasticsearch at each worker count"""
+    cluster = build_cluster(indices, fields, distinct, latency, per_index_latency)
+    expected = None
+    with FakeElasticsearch(cluster, process=True) as url:
+        for count in [int(x) for x in workers.split(',')]:
+            field_usage = FieldUsage(*client_args(url), 'index-*', workers=count)
+            start = perf_counter()
+            result = field_usage.results_by_index
+            elapsed = perf_counter() - start
+            if expected is None:
+                expected = result
+                baseline = elapsed
+            elif list(result.items()) != list(expected.items()):
+                raise SystemExit(f'Result mismatch at {count} workers!')
+            click.echo(
+                f'{count:>3} worker(s): {elapsed:8.3f} s  ({baseline / elapsed:5.1f}x)')
+
+if __name__ == '__main__':
+    run()  # pylint: disable=no-value-for-parameter
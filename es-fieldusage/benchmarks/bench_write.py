@@ -0,0 +1,84 @@
+"""
+Benchmark writing one output file per index with the ``file`` command's writer
+
+Times writing the accessed and unaccessed fields of thousands of indices line by line, one file
+at a time (as the ``file`` command did), against
+:py:func:`~.es_fieldusage.helpers.writer.write_files` at increasing worker counts.
+
+$ python -m benchmarks.bench_write --indices 5000 --fields 300
+"""
+import os
+import random
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import click
+from es_fieldusage.commands import output_generator, write_file
+from es_fieldusage.helpers.store import FieldCounts, FieldVocabulary
+from es_fieldusage.helpers.writer import write_files
+
+def build_data(indices, fields, ratio, seed=42):
+    """Return per-index report data like ``FieldUsage.per_index_report``"""
+    rng = random.Random(seed)
+    vocab = FieldVocabulary()
+    names = [f'obj{num % 10}.field_{num}' for num in range(fields)]
+    data = {}
+    for num in range(indices):
+        counts = {name: rng.randint(1, 10000) if rng.random() < ratio else 0 for name in names}
+        result = FieldCounts.from_items(
+            vocab, sorted(counts.items(), key=lambda item: item[1], reverse=True))
+        data[f'index-{num:05}'] = {'accessed': result.accessed(), 'unaccessed': result.unaccessed()}
+    return data
+
+def serial(data, tmpdir):
+    """Write each file line by line, one at a time, as the ``file`` command did"""
+    for idx, value in data.items():
+        filename = os.path.join(tmpdir, f'es_fieldusage-{idx}.csv')
+        with open(filename, 'w', encoding='utf-8') as fdesc:
+            for key in ['accessed', 'unaccessed']:
+                fdesc.writelines(output_generator(value[key], True, ','))
+
+def buffered(data, tmpdir, workers):
+    """Write each file with one atomic, buffered write, in a pool of ``workers`` threads"""
+    jobs = [
+        (os.path.join(tmpdir, f'es_fieldusage-{idx}.csv'),
+         lambda fdesc, i=idx: write_file(
+             fdesc, 'text', data, i, ['accessed', 'unaccessed'], True, ','))
+        for idx in data
+    ]
+    write_files(jobs, workers=workers)
+
+def timed(func, repeat, dirname=None):
+    """
+    Return the fewest seconds ``func(tmpdir)`` takes in ``repeat`` runs, each in a new temporary
+    directory, after flushing earlier writes to disk so that they do not skew the timing
+    """
+    best = None
+    for _ in range(repeat):
+        with TemporaryDirectory(dir=dirname) as tmpdir:
+            os.sync()
+            start = perf_counter()
+            func(tmpdir)
+            elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+@click.command()
+@click.option('--indices', default=5000, show_default=True, help='Number of files')
+@click.option('--fields', default=300, show_default=True, help='Fields per file')
+@click.option('--ratio', default=0.3, show_default=True, help='Ratio of fields accessed')
+@click.option(
+    '--workers', default='1,2,4,8', show_default=True, help='Comma-separated worker counts')
+@click.option('--repeat', default=3, show_default=True, help='Runs of each, best time is shown')
+@click.option('--dir', 'dirname', help='Write to temporary directories here (default: system temp)')
+def run(indices, fields, ratio, workers, repeat, dirname):
+    """Time the serial writer, then the buffered writer at each worker count"""
+    data = build_data(indices, fields, ratio)
+    legacy = timed(lambda tmpdir: serial(data, tmpdir), repeat, dirname)
+    click.echo(f'{indices} files x {fields} fields')
+    click.echo(f'{"line by line":>15}: {legacy:8.3f} s')
+    for count in [int(x) for x in workers.split(',')]:
+        elapsed = timed(lambda tmpdir, c=count: buffered(data, tmpdir, c), repeat, dirname)
+        click.echo(f'{count:>4} worker(s): {elapsed:8.3f} s  ({legacy / elapsed:5.1f}x)')
+
+if __name__ == '__main__':
+    run()  # pylint: disable=no-value-for-parameter
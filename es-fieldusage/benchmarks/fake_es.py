@@ -0,0 +1,308 @@
+"""
+A local stand-in for Elasticsearch, serving synthetic field usage data over HTTP so that
+:py:func:`~.es_fieldusage.helpers.client.get_client` can connect to it.
+
+Only the handful of API endpoints es-fieldusage uses are implemented. An artificial ``latency``
+(seconds per request) and ``per_index_latency`` (seconds per index in the response) can be added to
+approximate a remote cluster.
+"""
+import json
+import os
+import shutil
+import time
+from fnmatch import fnmatch
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import get_context
+from threading import Thread
+from urllib.parse import unquote, urlsplit
+
+NODE_ID = 'fake-node-0'
+
+class FakeCluster:
+    """The data served by :py:class:`FakeElasticsearch`"""
+    def __init__(self, mappings=None, usage=None, shards=1, latency=0.0, per_index_latency=0.0):
+        #: Attribute. Index name -> mapping ``properties``
+        self.mappings = mappings if mappings else {}
+        #: Attribute. Index name -> field name -> usage count (summed over all shards)
+        self.usage = usage if usage else {}
+        #: Attribute. Number of shards each index's usage count is split across
+        self.shards = shards
+        self.latency = latency
+        self.per_index_latency = per_index_latency
+        #: Attribute. Path -> file whose contents are served as-is, streamed from disk
+        self.files = {}
+        #: Attribute. Path -> number of requests received
+        self.requests = {}
+        #: Attribute. Path -> response body bytes sent
+        self.sent = {}
+        #: Attribute. Index name -> document ``_id`` -> ``_source`` of documents indexed in bulk
+        self.documents = {}
+        #: Attribute. Data stream name -> backing index names
+        self.data_streams = {}
+        #: Attribute. Alias name -> index names
+        self.aliases = {}
+
+    def resolve(self, target):
+        """
+        Return the index names matching comma-separated ``target``, which may have wildcards, and
+        may name data streams and aliases, which resolve to their indices
+        """
+        if target in ('_all', '*'):
+            return list(self.mappings.keys())
+        patterns = target.split(',')
+        found = set()
+        for groups in (self.data_streams, self.aliases):
+            for name, members in groups.items():
+                if any(fnmatch(name, pat) for pat in patterns):
+                    found.update(members)
+        return [
+            idx for idx in self.mappings
+            if idx in found or any(fnmatch(idx, pat) for pat in patterns)
+        ]
+
+    def resolve_index(self, target):
+        """Return a resolve_index API response for ``target``"""
+        patterns = target.split(',')
+        def matches(name):
+            return target in ('_all', '*') or any(fnmatch(name, pat) for pat in patterns)
+        indices = []
+        for idx in self.mappings:
+            if not matches(idx):
+                continue
+            item = {'name': idx, 'attributes': ['open']}
+            aliases = sorted(name for name, members in self.aliases.items() if idx in members)
+            if aliases:
+                item['aliases'] = aliases
+            for name, members in self.data_streams.items():
+                if idx in members:
+                    item['data_stream'] = name
+            indices.append(item)
+        return {
+            'indices': indices,
+            'aliases': [
+                {'name': name, 'indices': sorted(members)}
+                for name, members in self.aliases.items() if matches(name)
+            ],
+            'data_streams': [
+                {'name': name, 'backing_indices': list(members), 'timestamp_field': '@timestamp'}
+                for name, members in self.data_streams.items() if matches(name)
+            ],
+        }, 0
+
+    def delay(self, index_count):
+        """Sleep for the configured latency"""
+        wait = self.latency + self.per_index_latency * index_count
+        if wait:
+            time.sleep(wait)
+
+    def field_usage_stats(self, target):
+        """Return a field_usage_stats API response for ``target``"""
+        indices = self.resolve(target)
+        response = {'_shards': {'total': len(indices) * self.shards, 'successful': 0, 'failed': 0}}
+        for idx in indices:
+            shards = []
+            for num in range(self.shards):
+                fields = {}
+                for field, count in self.usage.get(idx, {}).items():
+                    # Spread the count over all shards, with any remainder on shard 0
+                    value = count // self.shards + (count % self.shards if num == 0 else 0)
+                    fields[field] = {'any': value, 'inverted_index': {}, 'stored_fields': 0}
+                shards.append({
+                    'tracking_id': f'{idx}-{num}',
+                    'routing': {'state': 'STARTED', 'primary': True, 'node': NODE_ID},
+                    'stats': {'all_fields': {}, 'fields': fields},
+                })
+            response[idx] = {'shards': shards}
+        response['_shards']['successful'] = response['_shards']['total']
+        return response, len(indices)
+
+    def get_mapping(self, target):
+        """Return a get_mapping API response for ``target``"""
+        indices = self.resolve(target)
+        body = {idx: {'mappings': {'properties': self.mappings[idx]}} for idx in indices}
+        return body, len(indices)
+
+    def cluster_state(self, target):
+        """Return a cluster state API response with the mapping version of each ``target`` index"""
+        indices = self.resolve(target)
+        return {'metadata': {'indices': {
+            idx: {'mapping_version': 1, 'settings': {'index': {'uuid': f'{idx}-uuid'}}}
+            for idx in indices
+        }}}, 0
+
+    def bulk(self, body, default_index=None):
+        """Index the documents in NDJSON bulk request ``body``, and return the bulk response"""
+        lines = body.decode('utf-8').splitlines()
+        items = []
+        for action_line, source_line in zip(lines[::2], lines[1::2]):
+            (op_type, meta), = json.loads(action_line).items()
+            idx = meta.get('_index', default_index)
+            docs = self.documents.setdefault(idx, {})
+            doc_id = meta.get('_id', str(len(docs)))
+            result = 'updated' if doc_id in docs else 'created'
+            docs[doc_id] = json.loads(source_line)
+            items.append({op_type: {
+                '_index': idx, '_id': doc_id, 'result': result,
+                'status': 200 if result == 'updated' else 201}})
+        return {'took': 1, 'errors': False, 'items': items}
+
+    def route_write(self, path, body):
+        """Return the response body for a PUT or POST request to ``path`` with ``body``"""
+        parts = [unquote(part) for part in path.strip('/').split('/') if part]
+        if parts and parts[-1] == '_bulk':
+            return self.bulk(body, default_index=parts[0] if len(parts) == 2 else None)
+        if len(parts) == 1:
+            if parts[0] in self.documents:
+                return {'error': {'type': 'resource_already_exists_exception'}, 'status': 400}
+            self.documents[parts[0]] = {}
+            return {'acknowledged': True, 'shards_acknowledged': True, 'index': parts[0]}
+        return None
+
+    def route(self, path):
+        """Return the response body and index count for a GET request to ``path``"""
+        parts = [unquote(part) for part in path.strip('/').split('/') if part]
+        if not parts:
+            return {
+                'name': NODE_ID,
+                'cluster_name': 'fake-cluster',
+                'version': {'number': '8.10.0'},
+                'tagline': 'You Know, for Search',
+            }, 0
+        if parts == ['_nodes', '_local']:
+            return {'nodes': {NODE_ID: {'name': NODE_ID}}}, 0
+        if parts[:3] == ['_cluster', 'state', 'metadata'] and len(parts) == 4:
+            return self.cluster_state(parts[3])
+        if parts[:2] == ['_cluster', 'state']:
+            return {'cluster_name': 'fake-cluster', 'master_node': NODE_ID}, 0
+        if parts[:2] == ['_resolve', 'index'] and len(parts) == 3:
+            return self.resolve_index(parts[2])
+        if parts[:2] == ['_cat', 'indices']:
+            indices = self.resolve(parts[2] if len(parts) > 2 else '*')
+            return [{'index': idx} for idx in indices], 0
+        if len(parts) == 2 and parts[1] == '_field_usage_stats':
+            return self.field_usage_stats(parts[0])
+        if len(parts) == 2 and parts[1] == '_mapping':
+            return self.get_mapping(parts[0])
+        return None, 0
+
+class FakeHandler(BaseHTTPRequestHandler):
+    """Request handler for :py:class:`FakeElasticsearch`"""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Be silent"""
+
+    def send_json(self, status, body):
+        """Send ``body`` as a JSON response with the headers the Elasticsearch client expects"""
+        data = json.dumps(body).encode('utf-8')
+        path = urlsplit(self.path).path
+        self.server.cluster.sent[path] = self.server.cluster.sent.get(path, 0) + len(data)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('X-Elastic-Product', 'Elasticsearch')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_file(self, filename):
+        """Stream the contents of ``filename`` as a JSON response"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('X-Elastic-Product', 'Elasticsearch')
+        self.send_header('Content-Length', str(os.path.getsize(filename)))
+        self.end_headers()
+        with open(filename, 'rb') as fdesc:
+            shutil.copyfileobj(fdesc, self.wfile)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Handle GET requests"""
+        cluster = self.server.cluster
+        path = urlsplit(self.path).path
+        cluster.requests[path] = cluster.requests.get(path, 0) + 1
+        if unquote(path) in cluster.files:
+            self.send_file(cluster.files[unquote(path)])
+            return
+        body, index_count = cluster.route(path)
+        cluster.delay(index_count)
+        if body is None:
+            self.send_json(404, {'error': f'no handler found for {path}', 'status': 404})
+        else:
+            self.send_json(200, body)
+
+    do_HEAD = do_GET
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Handle bulk and index creation requests"""
+        cluster = self.server.cluster
+        path = urlsplit(self.path).path
+        cluster.requests[path] = cluster.requests.get(path, 0) + 1
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        response = cluster.route_write(path, body)
+        if response is None:
+            self.send_json(404, {'error': f'no handler found for {path}', 'status': 404})
+        else:
+            self.send_json(response.get('status', 200), response)
+
+    do_PUT = do_POST
+
+class FakeElasticsearch:
+    """
+    Run a :py:class:`FakeCluster` on a local port in a background thread. Use as a context
+    manager, which yields the URL to connect to:
+
+    .. code-block:: python
+
+        with FakeElasticsearch(FakeCluster(mappings, usage)) as url:
+            ...
+
+    If ``process`` is ``True``, the server runs in a forked child process instead, so that its
+    work does not compete with the code being benchmarked for the GIL. Request counts in
+    ``cluster.requests`` are then only tracked in the child.
+    """
+    def __init__(self, cluster, host='127.0.0.1', port=0, process=False):
+        self.cluster = cluster
+        self.server = ThreadingHTTPServer((host, port), FakeHandler)
+        self.server.daemon_threads = True
+        self.server.cluster = cluster
+        if process:
+            self.runner = get_context('fork').Process(target=self.server.serve_forever, daemon=True)
+        else:
+            self.runner = Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        """The URL of the running server"""
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def __enter__(self):
+        self.runner.start()
+        return self.url
+
+    def __exit__(self, *exc):
+        if isinstance(self.runner, Thread):
+            self.server.shutdown()
+        else:
+            self.runner.terminate()
+            self.runner.join()
+        self.server.server_close()
+
+class FakeNamespace:
+    """Expose ``methods`` as attributes, as the client API namespaces do"""
+    def __init__(self, **methods):
+        self.__dict__.update(methods)
+
+class FakeClient:
+    """
+    An in-process stand-in for an Elasticsearch client, answering from a :py:class:`FakeCluster`
+    with no HTTP, for benchmarks which measure memory rather than the network
+    """
+    def __init__(self, cluster):
+        self.cluster = cluster
+        self.indices = FakeNamespace(
+            field_usage_stats=lambda index: cluster.field_usage_stats(index)[0],
+            get_mapping=lambda index: cluster.get_mapping(index)[0],
+        )
+        self.cat = FakeNamespace(
+            indices=lambda index, **_: cluster.route(f'/_cat/indices/{index}')[0],
+        )
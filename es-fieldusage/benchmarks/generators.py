@@ -0,0 +1,103 @@
+"""Synthetic data generators for benchmarks"""
+import json
+import random
+from es_fieldusage.helpers.utils import flatten_mapping
+from benchmarks.fake_es import FakeCluster
+
+def synthetic_mapping(field_count, depth=3, fanout=10):
+    """
+    Return a synthetic index mapping ``properties`` dictionary with ``field_count`` leaf fields.
+
+    Leaves are spread across object fields nested up to ``depth`` levels deep, with up to
+    ``fanout`` children per object, approximating the shape of an ECS mapping.
+    """
+    root = {}
+    for num in range(field_count):
+        node = root
+        level = num
+        for depth_idx in range(depth - 1):
+            level, branch = divmod(level, fanout)
+            objname = f'obj{depth_idx}_{branch}'
+            node = node.setdefault(objname, {'properties': {}})['properties']
+        node[f'field_{num}'] = {'type': 'keyword'}
+    return root
+
+def synthetic_usage(leaves, ratio=0.3, seed=42):
+    """
+    Return a synthetic field usage dictionary for a random ``ratio`` of dotted ``leaves``, plus a
+    handful of multi-field names which are not in the mapping (e.g. ``field.keyword``)
+    """
+    rng = random.Random(seed)
+    usage = {}
+    for leaf in leaves:
+        if rng.random() < ratio:
+            usage[leaf] = rng.randint(1, 100000)
+    for leaf in rng.sample(list(leaves), min(10, len(leaves))):
+        usage[f'{leaf}.keyword'] = rng.randint(1, 1000)
+    return usage
+
+def synthetic_cluster(indices, shards=1, fields=1000, depth=3, distinct=5, ratio=0.3, **kwargs):
+    """
+    Return a :py:class:`~.benchmarks.fake_es.FakeCluster` of ``indices`` indices of ``shards``
+    shards each, sharing ``distinct`` different mappings of ``fields`` to ``fields + distinct - 1``
+    leaf fields nested ``depth`` levels deep, with usage for a random ``ratio`` of the leaves of
+    each index. Other keyword arguments (e.g. ``latency``) are passed to the FakeCluster.
+    """
+    mappings = {}
+    usage = {}
+    variants = []
+    for num in range(distinct):
+        mapping = synthetic_mapping(fields + num, depth=depth)
+        variants.append((mapping, list(flatten_mapping(mapping))))
+    for num in range(indices):
+        mapping, leaves = variants[num % distinct]
+        mappings[f'index-{num:05}'] = mapping
+        usage[f'index-{num:05}'] = synthetic_usage(leaves, ratio=ratio, seed=num)
+    return FakeCluster(mappings, usage, shards=shards, **kwargs)
+
+def field_usage_entry(count):
+    """Return a single field's stats, as in a field_usage_stats API shard"""
+    return {
+        'any': count,
+        'inverted_index': {
+            'terms': count, 'postings': count, 'proximity': 0, 'positions': 0,
+            'term_frequencies': count, 'offsets': 0, 'payloads': 0,
+        },
+        'stored_fields': 0,
+        'doc_values': count // 2,
+        'points': 0,
+        'norms': 0,
+        'term_vectors': 0,
+        'knn_vectors': 0,
+    }
+
+def write_field_usage_fixture(filename, indices, shards, fields, seed=42):
+    """
+    Write a field_usage_stats API response for ``indices`` indices of ``shards`` shards with
+    ``fields`` fields each to ``filename``, one shard at a time so it is never built in memory.
+    Return the number of bytes written.
+    """
+    rng = random.Random(seed)
+    with open(filename, 'w', encoding='utf-8') as fdesc:
+        total = indices * shards
+        header = {'_shards': {'total': total, 'successful': total, 'failed': 0}}
+        fdesc.write(json.dumps(header)[:-1])
+        for idx in range(indices):
+            fdesc.write(f', "index-{idx:05}": {{"shards": [')
+            for num in range(shards):
+                shard = {
+                    'tracking_id': f'{idx}-{num}',
+                    'tracking_started_at_millis': 1697000000000,
+                    'routing': {'state': 'STARTED', 'primary': num == 0, 'node': 'fake-node-0'},
+                    'stats': {
+                        'all_fields': field_usage_entry(0),
+                        'fields': {
+                            f'field_{fnum}': field_usage_entry(rng.randint(0, 1000))
+                            for fnum in range(fields)
+                        },
+                    },
+                }
+                fdesc.write(('' if num == 0 else ', ') + json.dumps(shard))
+            fdesc.write(']}')
+        fdesc.write('}')
+        return fdesc.tell()
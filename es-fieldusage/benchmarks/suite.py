@@ -0,0 +1,229 @@
+"""
+Benchmark suite: end-to-end and per-function timings at a chosen scale
+
+Generates a synthetic cluster of N indices x S shards x F fields x nesting depth, serves it from a
+local fake Elasticsearch, and times:
+
+* end-to-end runs of :py:class:`~.es_fieldusage.main.FieldUsage` against it, with the time spent in
+  each phase, from its metrics
+* the hot functions of :py:mod:`~.es_fieldusage.helpers.utils`, the shard stream parser and the
+  usage store, on the same data
+
+Each case is run ``--repeat`` times, and the best time kept. Fast functions are timed over enough
+calls in a row to take ``MIN_LOOP_TIME``. Save the results as a baseline, then compare a later run
+at the same scale against it. The comparison fails if any case is more than ``--threshold`` times
+slower than the baseline:
+
+$ python -m benchmarks.suite --scale medium --save baseline.json
+$ python -m benchmarks.suite --scale medium --compare baseline.json
+"""
+import json
+import platform
+import statistics
+from fnmatch import fnmatch
+from math import ceil
+from time import perf_counter
+import click
+from es_fieldusage.helpers import utils
+from es_fieldusage.helpers.stream import iter_shards
+from es_fieldusage.main import FieldUsage
+from benchmarks.bench_workers import client_args
+from benchmarks.fake_es import FakeElasticsearch
+from benchmarks.generators import synthetic_cluster
+
+RESULTS_VERSION = 1
+SCALES = {
+    'small': {'indices': 50, 'shards': 2, 'fields': 200, 'depth': 3},
+    'medium': {'indices': 500, 'shards': 3, 'fields': 1000, 'depth': 4},
+    'large': {'indices': 2000, 'shards': 5, 'fields': 2000, 'depth': 5},
+}
+# Bytes per chunk fed to the shard stream parser, as received from the network
+CHUNK_SIZE = 65536
+# Fast functions are called in a loop which takes at least this many seconds, to time them reliably
+MIN_LOOP_TIME = 0.2
+
+def end_to_end_cases(url):
+    """
+    Return the end-to-end cases, as name -> function. Each function runs es-fieldusage against
+    ``url`` and returns the :py:class:`~.es_fieldusage.helpers.metrics.Metrics` of the run.
+    """
+    def run(read, **kwargs):
+        def case():
+            field_usage = FieldUsage(*client_args(url), 'index-*', **kwargs)
+            read(field_usage)
+            return field_usage.metrics
+        return case
+
+    def report(field_usage):
+        _ = field_usage.report['accessed'], field_usage.report['unaccessed']
+
+    def results(field_usage):
+        _ = field_usage.results_by_index
+
+    return {
+        'e2e.report': run(report),
+        'e2e.report_stream': run(report, stream=True),
+        'e2e.results_by_index': run(results),
+        'e2e.results_by_index_workers': run(results, workers=4),
+    }
+
+def function_cases(cluster, field_usage):
+    """
+    Return the per-function cases, as name -> function, using the data of ``cluster``, and
+    ``field_usage`` (a FieldUsage object which has already read it)
+    """
+    response = cluster.field_usage_stats('*')[0]
+    indices = [idx for idx in response if idx != '_shards']
+    body = json.dumps(response).encode('utf-8')
+    chunks = [body[pos:pos + CHUNK_SIZE] for pos in range(0, len(body), CHUNK_SIZE)]
+    # The largest of the distinct mappings, and one index's merged result
+    mapping = max(cluster.mappings.values(), key=lambda value: len(utils.flatten_mapping(value)))
+    converted = utils.convert_mapping(mapping)
+    merged = field_usage.get_resultset(indices[0])
+
+    def sum_index_stats():
+        for idx in indices:
+            field_usage.sum_index_stats(response, idx)
+
+    def parse_shards():
+        for _ in iter_shards(chunks):
+            pass
+
+    return {
+        'utils.flatten_mapping': lambda: utils.flatten_mapping(mapping),
+        'utils.convert_mapping': lambda: utils.convert_mapping(mapping),
+        'utils.iterate_paths': lambda: list(utils.iterate_paths(converted)),
+        'utils.mapping_hash': lambda: utils.mapping_hash(mapping),
+        'utils.sort_by_value': lambda: utils.sort_by_value(merged),
+        'FieldUsage.sum_index_stats': sum_index_stats,
+        'stream.iter_shards': parse_shards,
+        'UsageStore.totals': field_usage.usage_stats.totals,
+    }
+
+def calibrate(func):
+    """Return how many calls of ``func`` in a row take at least ``MIN_LOOP_TIME`` seconds"""
+    number = 1
+    while True:
+        start = perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = perf_counter() - start
+        if elapsed >= MIN_LOOP_TIME:
+            return number
+        # Aim just past the target, but grow by no more than 10x per step in case of a slow start
+        number = ceil(number * min(10, 1.2 * MIN_LOOP_TIME / max(elapsed, 1e-9)))
+
+def measure(func, repeat, number=1):
+    """
+    Time ``repeat`` rounds of ``number`` calls of ``func``
+
+    :returns: The best and median seconds per call, and the return value of the fastest round
+    :rtype: tuple(float, float, object)
+    """
+    times = []
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        for _ in range(number):
+            value = func()
+        times.append((perf_counter() - start) / number)
+        if times[-1] == min(times):
+            best = value
+    return min(times), statistics.median(times), best
+
+def compare(results, baseline, threshold):
+    """
+    Echo each case of ``results`` next to ``baseline``
+
+    :returns: The names of the cases more than ``threshold`` times slower than the baseline
+    :rtype: list
+    """
+    regressions = []
+    click.echo(f'\n{"Case":<32} {"Baseline ms":>12} {"Now ms":>12} {"Ratio":>7}')
+    for name, value in results['cases'].items():
+        before = baseline['cases'].get(name)
+        if before is None:
+            click.echo(f'{name:<32} {"-":>12} {value["best"] * 1000:>12.3f}')
+            continue
+        ratio = value['best'] / before['best'] if before['best'] else 1.0
+        flag = ''
+        if ratio > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        click.echo(
+            f'{name:<32} {before["best"] * 1000:>12.3f} {value["best"] * 1000:>12.3f} '
+            f'{ratio:>7.2f}{flag}')
+    return regressions
+
+@click.command()
+@click.option(
+    '--scale', type=click.Choice(list(SCALES)), default='small', show_default=True,
+    help='Preset cluster size')
+@click.option('--indices', type=int, help='Number of indices  [default: from --scale]')
+@click.option('--shards', type=int, help='Shards per index  [default: from --scale]')
+@click.option('--fields', type=int, help='Leaf fields per mapping  [default: from --scale]')
+@click.option('--depth', type=int, help='Object nesting depth  [default: from --scale]')
+@click.option('--distinct', default=5, show_default=True, help='Distinct mappings')
+@click.option('--repeat', default=5, show_default=True, help='Runs of each case; the best is kept')
+@click.option('--cases', 'pattern', default='*', show_default=True, help='Only run cases matching')
+@click.option('--save', type=click.Path(dir_okay=False), help='Write the results to this file')
+@click.option(
+    '--compare', 'baseline_file', type=click.Path(exists=True, dir_okay=False),
+    help='Compare the results with a baseline saved by --save')
+@click.option(
+    '--threshold', default=1.25, show_default=True,
+    help='Fail the comparison if a case is slower than the baseline by more than this factor')
+# pylint: disable=too-many-arguments,too-many-locals
+def run(
+    scale, indices, shards, fields, depth, distinct, repeat, pattern, save, baseline_file,
+    threshold):
+    """Time es-fieldusage end to end and per function, and compare with a baseline"""
+    params = dict(SCALES[scale])
+    overrides = {'indices': indices, 'shards': shards, 'fields': fields, 'depth': depth}
+    params.update({key: value for key, value in overrides.items() if value is not None})
+    params['distinct'] = distinct
+    click.echo(
+        'Scale: {indices} indices x {shards} shards x {fields} fields x depth {depth}, '
+        '{distinct} distinct mappings'.format(**params))
+    cluster = synthetic_cluster(**params)
+    results = {
+        'version': RESULTS_VERSION,
+        'scale': params,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cases': {},
+    }
+    with FakeElasticsearch(cluster, process=True) as url:
+        cases = end_to_end_cases(url)
+        field_usage = FieldUsage(*client_args(url), 'index-*')
+        cases.update(function_cases(cluster, field_usage))
+        click.echo(f'\n{"Case":<32} {"Best ms":>12} {"Median ms":>12} {"Calls":>7}')
+        for name, func in cases.items():
+            if not fnmatch(name, pattern):
+                continue
+            number = 1 if name.startswith('e2e.') else calibrate(func)
+            best, median, value = measure(func, repeat, number=number)
+            results['cases'][name] = {'best': best, 'median': median, 'number': number}
+            click.echo(f'{name:<32} {best * 1000:>12.3f} {median * 1000:>12.3f} {number:>7}')
+            if name.startswith('e2e.'):
+                phases = value.as_dict()['phases']
+                results['cases'][name]['phases'] = phases
+                slowest = sorted(phases.items(), key=lambda item: -item[1]['seconds'])[:4]
+                click.echo('    ' + ', '.join(
+                    f'{phase} {data["seconds"] * 1000:.1f} ms' for phase, data in slowest))
+    if save:
+        with open(save, 'w', encoding='utf-8') as fdesc:
+            json.dump(results, fdesc, indent=2)
+        click.echo(f'\nResults saved to {save}')
+    if baseline_file:
+        with open(baseline_file, 'r', encoding='utf-8') as fdesc:
+            baseline = json.load(fdesc)
+        if baseline.get('scale') != params:
+            raise SystemExit(f'Baseline scale {baseline.get("scale")} differs from {params}')
+        regressions = compare(results, baseline, threshold)
+        if regressions:
+            raise SystemExit(f'\n{len(regressions)} case(s) regressed: {", ".join(regressions)}')
+        click.echo('\nNo regressions')
+
+if __name__ == '__main__':
+    run()  # pylint: disable=no-value-for-parameter
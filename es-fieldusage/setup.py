@@ -5,6 +5,8 @@ from cx_Freeze import setup, Executable
 base = "Win32GUI" if sys.platform == "win32" else None
 
 setup(
+  # The CLI imports its commands lazily, so cx_Freeze can't find them by following imports
+  options={"build_exe": {"packages": ["es_fieldusage"]}},
   executables=[
     Executable("run_script.py", base=base, target_name="es-fieldusage"),
   ]
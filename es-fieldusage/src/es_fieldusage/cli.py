@@ -1,37 +1,54 @@
 """Command-line interface"""
 import click
-from es_client.helpers import utils as escl
 from es_fieldusage.defaults import EPILOG, get_context_settings
-from es_fieldusage.helpers.utils import cli_opts
-from es_fieldusage.commands import file, show_indices, stdout
+from es_fieldusage.helpers.lazy import LazyGroup
+from es_fieldusage.helpers.utils import cli_opts, client_opts, option_wrapper
 from es_fieldusage.version import __version__
 
 ONOFF = {'on': '', 'off': 'no-'}
-click_opt_wrap = escl.option_wrapper()
+# The subcommands, which are only imported when run: name -> (import path, short help)
+COMMANDS = {
+    'file': (
+        'es_fieldusage.commands.file', 'Write field usage information to file for SEARCH_PATTERN'),
+    'index': (
+        'es_fieldusage.commands.index',
+        'Index field usage information for SEARCH_PATTERN into Elasticsearch'),
+    'serve': (
+        'es_fieldusage.commands.serve',
+        'Serve field usage information over HTTP until interrupted'),
+    'show-indices': (
+        'es_fieldusage.commands.show_indices',
+        'Show indices on the console matching SEARCH_PATTERN'),
+    'stdout': (
+        'es_fieldusage.commands.stdout',
+        'Display field usage information on the console for SEARCH_PATTERN'),
+}
+click_opt_wrap = option_wrapper()
 
 # pylint: disable=unused-argument, redefined-builtin
-@click.group(context_settings=get_context_settings(), epilog=EPILOG)
-@click_opt_wrap(*escl.cli_opts('config'))
-@click_opt_wrap(*escl.cli_opts('hosts'))
-@click_opt_wrap(*escl.cli_opts('cloud_id'))
-@click_opt_wrap(*escl.cli_opts('api_token'))
-@click_opt_wrap(*escl.cli_opts('id'))
-@click_opt_wrap(*escl.cli_opts('api_key'))
-@click_opt_wrap(*escl.cli_opts('username'))
-@click_opt_wrap(*escl.cli_opts('password'))
-@click_opt_wrap(*escl.cli_opts('bearer_auth'))
-@click_opt_wrap(*escl.cli_opts('opaque_id'))
-@click_opt_wrap(*escl.cli_opts('request_timeout'))
-@click_opt_wrap(*escl.cli_opts('http_compress', onoff=ONOFF))
-@click_opt_wrap(*escl.cli_opts('verify_certs', onoff=ONOFF))
-@click_opt_wrap(*escl.cli_opts('ca_certs'))
-@click_opt_wrap(*escl.cli_opts('client_cert'))
-@click_opt_wrap(*escl.cli_opts('client_key'))
-@click_opt_wrap(*escl.cli_opts('ssl_assert_hostname'))
-@click_opt_wrap(*escl.cli_opts('ssl_assert_fingerprint'))
-@click_opt_wrap(*escl.cli_opts('ssl_version'))
-@click_opt_wrap(*escl.cli_opts('master-only', onoff=ONOFF))
-@click_opt_wrap(*escl.cli_opts('skip_version_test', onoff=ONOFF))
+@click.group(
+    cls=LazyGroup, lazy_commands=COMMANDS, context_settings=get_context_settings(), epilog=EPILOG)
+@click_opt_wrap(*client_opts('config'))
+@click_opt_wrap(*client_opts('hosts'))
+@click_opt_wrap(*client_opts('cloud_id'))
+@click_opt_wrap(*client_opts('api_token'))
+@click_opt_wrap(*client_opts('id'))
+@click_opt_wrap(*client_opts('api_key'))
+@click_opt_wrap(*client_opts('username'))
+@click_opt_wrap(*client_opts('password'))
+@click_opt_wrap(*client_opts('bearer_auth'))
+@click_opt_wrap(*client_opts('opaque_id'))
+@click_opt_wrap(*client_opts('request_timeout'))
+@click_opt_wrap(*client_opts('http_compress', onoff=ONOFF))
+@click_opt_wrap(*client_opts('verify_certs', onoff=ONOFF))
+@click_opt_wrap(*client_opts('ca_certs'))
+@click_opt_wrap(*client_opts('client_cert'))
+@click_opt_wrap(*client_opts('client_key'))
+@click_opt_wrap(*client_opts('ssl_assert_hostname'))
+@click_opt_wrap(*client_opts('ssl_assert_fingerprint'))
+@click_opt_wrap(*client_opts('ssl_version'))
+@click_opt_wrap(*client_opts('master-only', onoff=ONOFF))
+@click_opt_wrap(*client_opts('skip_version_test', onoff=ONOFF))
 @click_opt_wrap(*cli_opts('loglevel'))
 @click_opt_wrap(*cli_opts('logfile'))
 @click_opt_wrap(*cli_opts('logformat'))
@@ -61,27 +78,27 @@ def run(
 # Here is the ``show-all-options`` command, which does nothing other than set ``show=True`` for
 # the hidden options in the top-level menu so they are exposed for the --help output.
 @run.command(context_settings=get_context_settings(), short_help='Show all configuration options')
-@click_opt_wrap(*escl.cli_opts('config'))
-@click_opt_wrap(*escl.cli_opts('hosts'))
-@click_opt_wrap(*escl.cli_opts('cloud_id'))
-@click_opt_wrap(*escl.cli_opts('api_token'))
-@click_opt_wrap(*escl.cli_opts('id'))
-@click_opt_wrap(*escl.cli_opts('api_key'))
-@click_opt_wrap(*escl.cli_opts('username'))
-@click_opt_wrap(*escl.cli_opts('password'))
-@click_opt_wrap(*escl.cli_opts('bearer_auth', show=True))
-@click_opt_wrap(*escl.cli_opts('opaque_id', show=True))
-@click_opt_wrap(*escl.cli_opts('request_timeout'))
-@click_opt_wrap(*escl.cli_opts('http_compress', onoff=ONOFF, show=True))
-@click_opt_wrap(*escl.cli_opts('verify_certs', onoff=ONOFF))
-@click_opt_wrap(*escl.cli_opts('ca_certs'))
-@click_opt_wrap(*escl.cli_opts('client_cert'))
-@click_opt_wrap(*escl.cli_opts('client_key'))
-@click_opt_wrap(*escl.cli_opts('ssl_assert_hostname', show=True))
-@click_opt_wrap(*escl.cli_opts('ssl_assert_fingerprint', show=True))
-@click_opt_wrap(*escl.cli_opts('ssl_version', show=True))
-@click_opt_wrap(*escl.cli_opts('master-only', onoff=ONOFF, show=True))
-@click_opt_wrap(*escl.cli_opts('skip_version_test', onoff=ONOFF, show=True))
+@click_opt_wrap(*client_opts('config'))
+@click_opt_wrap(*client_opts('hosts'))
+@click_opt_wrap(*client_opts('cloud_id'))
+@click_opt_wrap(*client_opts('api_token'))
+@click_opt_wrap(*client_opts('id'))
+@click_opt_wrap(*client_opts('api_key'))
+@click_opt_wrap(*client_opts('username'))
+@click_opt_wrap(*client_opts('password'))
+@click_opt_wrap(*client_opts('bearer_auth', show=True))
+@click_opt_wrap(*client_opts('opaque_id', show=True))
+@click_opt_wrap(*client_opts('request_timeout'))
+@click_opt_wrap(*client_opts('http_compress', onoff=ONOFF, show=True))
+@click_opt_wrap(*client_opts('verify_certs', onoff=ONOFF))
+@click_opt_wrap(*client_opts('ca_certs'))
+@click_opt_wrap(*client_opts('client_cert'))
+@click_opt_wrap(*client_opts('client_key'))
+@click_opt_wrap(*client_opts('ssl_assert_hostname', show=True))
+@click_opt_wrap(*client_opts('ssl_assert_fingerprint', show=True))
+@click_opt_wrap(*client_opts('ssl_version', show=True))
+@click_opt_wrap(*client_opts('master-only', onoff=ONOFF, show=True))
+@click_opt_wrap(*client_opts('skip_version_test', onoff=ONOFF, show=True))
 @click_opt_wrap(*cli_opts('loglevel'))
 @click_opt_wrap(*cli_opts('logfile'))
 @click_opt_wrap(*cli_opts('logformat'))
@@ -102,8 +119,3 @@ def show_all_options(
     ctx = click.get_current_context()
     click.echo(ctx.get_help())
     ctx.exit()
-
-# Add the subcommands
-run.add_command(show_indices)
-run.add_command(file)
-run.add_command(stdout)
@@ -1,17 +1,34 @@
 """Sub-commands for Click CLI"""
 import os
 import logging
+from datetime import datetime, timezone
+from functools import partial
+from itertools import chain, islice
 import click
 from es_client.helpers import utils as escl
-from es_fieldusage.defaults import FILEPATH_OVERRIDE, EPILOG, get_context_settings
+from es_fieldusage import server
+from es_fieldusage.defaults import (
+    FILEPATH_OVERRIDE, EPILOG, MAPPING_CACHE_FILE, MAPPING_CACHE_SAVE_INTERVAL,
+    get_context_settings)
 from es_fieldusage.exceptions import FatalException
-from es_fieldusage.helpers.client import get_args, get_client
-from es_fieldusage.helpers.utils import cli_opts, is_docker, output_report
+from es_fieldusage.helpers import bulk, formats
+from es_fieldusage.helpers.cache import MappingCache
+from es_fieldusage.helpers.client import get_args, get_client, get_clusters
+from es_fieldusage.helpers.logging import log_metrics
+from es_fieldusage.helpers.utils import cli_opts, is_docker, output_profile, output_report
+from es_fieldusage.helpers.writer import write_files
 from es_fieldusage.main import FieldUsage
+from es_fieldusage.multi import MultiFieldUsage
 
 LOGGER = logging.getLogger(__name__)
 
 ONOFF = {'on': 'show-', 'off': 'hide-'}
+ENABLE = {'on': '', 'off': 'no-'}
+# With per-index files, the workers write them too
+WORKERS_FILE_HELP = (
+    'Worker threads used to fetch mappings, merge per-index results and write files concurrently')
+# Lines printed to the console at a time
+PRINT_LINES = 1000
 click_opt_wrap = escl.option_wrapper()
 
 def get_per_index(field_usage, per_index):
@@ -23,12 +40,8 @@ def get_per_index(field_usage, per_index):
             LOGGER.critical('Unable to get per_index_report data: %s', exc)
             raise FatalException from exc
     else:
-        all_data = {
-            'all_indices': {
-                'accessed': field_usage.report['accessed'],
-                'unaccessed': field_usage.report['unaccessed'],
-            }
-        }
+        # The report only computes the accessed or unaccessed fields if they are read
+        all_data = {'all_indices': field_usage.report}
     return all_data
 
 def format_delimiter(value):
@@ -49,10 +62,17 @@ def header_msg(msg, show):
     return msg
 
 def printout(data, show_counts, raw_delimiter):
-    """Print output to stdout based on the provided values"""
-    for line in output_generator(data, show_counts, raw_delimiter):
+    """
+    Print output to stdout based on the provided values, as it is generated, a block of
+    ``PRINT_LINES`` lines at a time
+    """
+    generator = output_generator(data, show_counts, raw_delimiter)
+    while True:
+        block = ''.join(islice(generator, PRINT_LINES))
+        if not block:
+            break
         # Since the generator is adding newlines, we set nl=False here
-        click.secho(line, nl=False)
+        click.echo(block, nl=False)
 
 def output_generator(data, show_counts, raw_delimiter):
     """Generate output iterator based on the provided values"""
@@ -66,6 +86,50 @@ def output_generator(data, show_counts, raw_delimiter):
         # In order to write newlines to a file descriptor, they must be part of the line
         yield f'{line}\n'
 
+def file_content(all_data, idx, sections, show_counts, delimiter):
+    """Return the entire file contents for ``idx``: the lines of each of ``sections``, in order"""
+    return ''.join(chain.from_iterable(
+        output_generator(all_data[idx][key], show_counts, delimiter) for key in sections))
+
+def shown_sections(show_accessed, show_unaccessed):
+    """Return the names of the sections to show. Both go in the same file, accessed fields first."""
+    shown = {'accessed': show_accessed, 'unaccessed': show_unaccessed}
+    return [key for key, show in shown.items() if show]
+
+# pylint: disable=too-many-arguments
+def write_file(fdesc, output_format, all_data, idx, sections, show_counts, delimiter):
+    """
+    Write the fields in each of ``sections`` of ``all_data[idx]`` to binary file ``fdesc``, as
+    ``output_format`` text lines, or streamed straight from the results in a structured format.
+    """
+    if output_format == 'text':
+        fdesc.write(file_content(all_data, idx, sections, show_counts, delimiter).encode('utf-8'))
+    else:
+        formats.dump(output_format, fdesc, idx, [(key, all_data[idx][key]) for key in sections])
+
+def output_metrics(field_usage, profile, metrics):
+    """Output the run metrics of ``field_usage`` as a profile, and/or log them, if requested"""
+    if profile:
+        output_profile(field_usage.metrics)
+    if metrics:
+        log_metrics(LOGGER, field_usage.metrics)
+
+def get_field_usage(ctx, search_pattern, cluster, cluster_timeout, **kwargs):
+    """
+    Return a FieldUsage object for ``search_pattern``, or a MultiFieldUsage object for the named
+    clusters matching the ``cluster`` patterns, if any. ``kwargs`` are passed to either.
+    """
+    client_args, other_args = get_args(ctx.parent.params)
+    try:
+        if cluster:
+            return MultiFieldUsage(
+                get_clusters(ctx.parent.params, cluster), search_pattern, timeout=cluster_timeout,
+                client_args=client_args, other_args=other_args, **kwargs)
+        return FieldUsage(client_args, other_args, search_pattern, **kwargs)
+    except Exception as exc:
+        LOGGER.critical('Exception encountered: %s', exc)
+        raise FatalException from exc
+
 def override_filepath():
     """Override the default filepath if we're running Docker"""
     if is_docker():
@@ -79,11 +143,26 @@ def override_filepath():
 @click_opt_wrap(*cli_opts('unaccessed', onoff=ONOFF))
 @click_opt_wrap(*cli_opts('counts', onoff=ONOFF))
 @click_opt_wrap(*cli_opts('delimiter'))
+@click_opt_wrap(*cli_opts('output-format'))
+@click_opt_wrap(*cli_opts('stream'))
+@click_opt_wrap(*cli_opts('batch-size'))
+@click_opt_wrap(*cli_opts('concurrency'))
+@click_opt_wrap(*cli_opts('retries'))
+@click_opt_wrap(*cli_opts('snapshot'))
+@click_opt_wrap(*cli_opts('cache', onoff=ENABLE))
+@click_opt_wrap(*cli_opts('rollup'))
+@click_opt_wrap(*cli_opts('include'))
+@click_opt_wrap(*cli_opts('exclude'))
+@click_opt_wrap(*cli_opts('profile'))
+@click_opt_wrap(*cli_opts('metrics'))
+@click_opt_wrap(*cli_opts('cluster'))
+@click_opt_wrap(*cli_opts('cluster-timeout'))
 @click.argument('search_pattern', type=str, nargs=1)
 @click.pass_context
 def stdout(
     ctx, show_report, show_headers, show_accessed, show_unaccessed, show_counts, delimiter,
-    search_pattern):
+    output_format, stream, batch_size, concurrency, retries, snapshot, cache, rollup, include,
+    exclude, profile, metrics, cluster, cluster_timeout, search_pattern):
     """
     Display field usage information on the console for SEARCH_PATTERN
 
@@ -93,23 +172,34 @@ def stdout(
     patterns:
 
     $ es-fieldusage stdout --hide-report --hide-headers --show-unaccessed 'index-*' | grep process
+
+    With an --output-format other than text, only the shown fields are written, with no report or
+    headers, so the output can be piped straight into another program.
     """
-    client_args, other_args = get_args(ctx.parent.params)
-    try:
-        field_usage = FieldUsage(client_args, other_args, search_pattern)
-    except Exception as exc:
-        LOGGER.critical('Exception encountered: %s', exc)
-        raise FatalException from exc
-    if show_report:
-        output_report(search_pattern, field_usage.report)
-    if show_accessed:
-        msg = header_msg('\nAccessed Fields (in descending frequency):', show_headers)
-        click.secho(msg, overline=show_headers, underline=show_headers, bold=True)
-        printout(field_usage.report['accessed'], show_counts, delimiter)
-    if show_unaccessed:
-        msg = header_msg('\nUnaccessed Fields', show_headers)
-        click.secho(msg, overline=show_headers, underline=show_headers, bold=True)
-        printout(field_usage.report['unaccessed'], show_counts, delimiter)
+    # The summary report needs no per-index results, so no workers to merge them
+    field_usage = get_field_usage(
+        ctx, search_pattern, cluster, cluster_timeout, stream=stream, batch_size=batch_size,
+        concurrency=concurrency, retries=retries, snapshot=snapshot,
+        mapping_cache=MAPPING_CACHE_FILE if cache else None, rollup=rollup, include=include,
+        exclude=exclude)
+    with field_usage.metrics.timer('output'):
+        if output_format != 'text':
+            write_file(
+                click.get_binary_stream('stdout'), output_format,
+                {'all_indices': field_usage.report}, 'all_indices',
+                shown_sections(show_accessed, show_unaccessed), show_counts, delimiter)
+        else:
+            if show_report:
+                output_report(search_pattern, field_usage.report)
+            if show_accessed:
+                msg = header_msg('\nAccessed Fields (in descending frequency):', show_headers)
+                click.secho(msg, overline=show_headers, underline=show_headers, bold=True)
+                printout(field_usage.report['accessed'], show_counts, delimiter)
+            if show_unaccessed:
+                msg = header_msg('\nUnaccessed Fields', show_headers)
+                click.secho(msg, overline=show_headers, underline=show_headers, bold=True)
+                printout(field_usage.report['unaccessed'], show_counts, delimiter)
+    output_metrics(field_usage, profile, metrics)
 
 @click.command(context_settings=get_context_settings(), epilog=EPILOG)
 @click_opt_wrap(*cli_opts('report', onoff=ONOFF))
@@ -121,11 +211,28 @@ def stdout(
 @click_opt_wrap(*cli_opts('prefix'))
 @click_opt_wrap(*cli_opts('suffix'))
 @click_opt_wrap(*cli_opts('delimiter'))
+@click_opt_wrap(*cli_opts('output-format'))
+@click_opt_wrap(*cli_opts('workers', override={'help': WORKERS_FILE_HELP}))
+@click_opt_wrap(*cli_opts('stream'))
+@click_opt_wrap(*cli_opts('batch-size'))
+@click_opt_wrap(*cli_opts('concurrency'))
+@click_opt_wrap(*cli_opts('retries'))
+@click_opt_wrap(*cli_opts('snapshot'))
+@click_opt_wrap(*cli_opts('cache', onoff=ENABLE))
+@click_opt_wrap(*cli_opts('rollup'))
+@click_opt_wrap(*cli_opts('include'))
+@click_opt_wrap(*cli_opts('exclude'))
+@click_opt_wrap(*cli_opts('profile'))
+@click_opt_wrap(*cli_opts('metrics'))
+@click_opt_wrap(*cli_opts('cluster'))
+@click_opt_wrap(*cli_opts('cluster-timeout'))
 @click.argument('search_pattern', type=str, nargs=1)
 @click.pass_context
 def file(
     ctx, show_report, show_accessed, show_unaccessed, show_counts, per_index, filepath, prefix,
-    suffix, delimiter, search_pattern):
+    suffix, delimiter, output_format, workers, stream, batch_size, concurrency, retries, snapshot,
+    cache, rollup, include, exclude, profile, metrics, cluster, cluster_timeout,
+    search_pattern):
     """
     Write field usage information to file for SEARCH_PATTERN
 
@@ -136,28 +243,32 @@ def file(
 
     This allows you to write to one file per index automatically, should that be your desire.
     """
-    client_args, other_args = get_args(ctx.parent.params)
-    try:
-        field_usage = FieldUsage(client_args, other_args, search_pattern)
-    except Exception as exc:
-        LOGGER.critical('Exception encountered: %s', exc)
-        raise FatalException from exc
+    field_usage = get_field_usage(
+        ctx, search_pattern, cluster, cluster_timeout, workers=workers, stream=stream,
+        batch_size=batch_size, concurrency=concurrency, retries=retries, snapshot=snapshot,
+        mapping_cache=MAPPING_CACHE_FILE if cache else None, rollup=rollup, include=include,
+        exclude=exclude)
     if show_report:
-        output_report(search_pattern, field_usage.report)
+        with field_usage.metrics.timer('output'):
+            output_report(search_pattern, field_usage.report)
         click.secho()
 
     all_data = get_per_index(field_usage, per_index)
 
-    files_written = []
-    for idx in list(all_data.keys()):
-        fname = f'{prefix}-{idx}.{suffix}'
-        filename = os.path.join(filepath, fname)
-        files_written.append(fname)
-        for key, boolval in {'accessed': show_accessed, 'unaccessed': show_unaccessed}.items():
-            if boolval:
-                generator = output_generator(all_data[idx][key], show_counts, delimiter)
-                with open(filename, 'w', encoding='utf-8') as fdesc:
-                    fdesc.writelines(generator)
+    sections = shown_sections(show_accessed, show_unaccessed)
+    if suffix is None:
+        suffix = formats.suffix(output_format)
+    jobs = [
+        (os.path.join(filepath, f'{prefix}-{idx}.{suffix}'),
+         partial(
+             write_file, output_format=output_format, all_data=all_data, idx=idx,
+             sections=sections, show_counts=show_counts, delimiter=delimiter))
+        for idx in all_data
+    ]
+    with field_usage.metrics.timer('output'):
+        files_written = [
+            os.path.basename(filename) for filename in write_files(jobs, workers=workers)]
+    field_usage.metrics.count('files_written', len(files_written))
     click.secho('Number of files written: ', nl=False)
     click.secho(len(files_written), bold=True)
     click.secho('Filenames: ', nl=False)
@@ -166,6 +277,132 @@ def file(
         click.secho(' ... (too many to show)')
     else:
         click.secho(files_written, bold=True)
+    output_metrics(field_usage, profile, metrics)
+
+@click.command(context_settings=get_context_settings(), epilog=EPILOG)
+@click_opt_wrap(*cli_opts('report', onoff=ONOFF))
+@click_opt_wrap(*cli_opts('target'))
+@click_opt_wrap(*cli_opts('chunk-size'))
+@click_opt_wrap(*cli_opts('threads'))
+@click_opt_wrap(*cli_opts('timestamp'))
+@click_opt_wrap(*cli_opts('workers'))
+@click_opt_wrap(*cli_opts('stream'))
+@click_opt_wrap(*cli_opts('batch-size'))
+@click_opt_wrap(*cli_opts('concurrency'))
+@click_opt_wrap(*cli_opts('retries'))
+@click_opt_wrap(*cli_opts('snapshot'))
+@click_opt_wrap(*cli_opts('cache', onoff=ENABLE))
+@click_opt_wrap(*cli_opts('rollup'))
+@click_opt_wrap(*cli_opts('include'))
+@click_opt_wrap(*cli_opts('exclude'))
+@click_opt_wrap(*cli_opts('profile'))
+@click_opt_wrap(*cli_opts('metrics'))
+@click_opt_wrap(*cli_opts('cluster'))
+@click_opt_wrap(*cli_opts('cluster-timeout'))
+@click.argument('search_pattern', type=str, nargs=1)
+@click.pass_context
+def index(
+    ctx, show_report, target, chunk_size, threads, timestamp, workers, stream, batch_size,
+    concurrency, retries, snapshot, cache, rollup, include, exclude, profile, metrics, cluster,
+    cluster_timeout, search_pattern):
+    """
+    Index field usage information for SEARCH_PATTERN into Elasticsearch
+
+    $ es-fieldusage index [OPTIONS] SEARCH_PATTERN
+
+    One document is indexed into the --target index for every field of every index found, with
+    the index name, field name, access count and @timestamp, for charting in Kibana. With
+    --timestamp, indexing again overwrites the documents indexed for that timestamp.
+    """
+    field_usage = get_field_usage(
+        ctx, search_pattern, cluster, cluster_timeout, workers=workers, stream=stream,
+        batch_size=batch_size, concurrency=concurrency, retries=retries, snapshot=snapshot,
+        mapping_cache=MAPPING_CACHE_FILE if cache else None, rollup=rollup, include=include,
+        exclude=exclude)
+    if show_report:
+        with field_usage.metrics.timer('output'):
+            output_report(search_pattern, field_usage.report)
+        click.secho()
+    # Only results indexed for a given --timestamp can be indexed again in place. Each run without
+    # one is a new point in time, with new documents.
+    ids = timestamp is not None
+    if timestamp is None:
+        timestamp = datetime.now(timezone.utc)
+    stamp = timestamp.replace(tzinfo=timezone.utc).isoformat()
+    try:
+        with field_usage.metrics.timer('bulk'):
+            bulk.create_index(field_usage.client, target)
+            actions = bulk.usage_actions(field_usage.results_by_index, target, stamp, ids=ids)
+            successes, failures = bulk.send(
+                field_usage.client, actions, chunk_size=chunk_size, threads=threads)
+    except Exception as exc:
+        LOGGER.critical('Unable to index field usage: %s', exc)
+        raise FatalException from exc
+    field_usage.metrics.count('documents_indexed', successes)
+    field_usage.metrics.count('documents_failed', failures)
+    click.secho('Documents indexed: ', nl=False)
+    click.secho(successes, bold=True)
+    output_metrics(field_usage, profile, metrics)
+    if failures:
+        LOGGER.critical('%s documents failed to index', failures)
+        raise FatalException(f'{failures} documents failed to index')
+
+@click.command(context_settings=get_context_settings(), epilog=EPILOG)
+@click_opt_wrap(*cli_opts('listen'))
+@click_opt_wrap(*cli_opts('unix-socket'))
+@click_opt_wrap(*cli_opts('workers'))
+@click_opt_wrap(*cli_opts('stream'))
+@click_opt_wrap(*cli_opts('batch-size'))
+@click_opt_wrap(*cli_opts('concurrency'))
+@click_opt_wrap(*cli_opts('retries'))
+@click_opt_wrap(*cli_opts('cache', onoff=ENABLE))
+@click_opt_wrap(*cli_opts('rollup'))
+@click_opt_wrap(*cli_opts('include'))
+@click_opt_wrap(*cli_opts('exclude'))
+@click.pass_context
+def serve(
+    ctx, listen, unix_socket, workers, stream, batch_size, concurrency, retries, cache,
+    rollup, include, exclude):
+    """
+    Serve field usage information over HTTP until interrupted
+
+    $ es-fieldusage serve [OPTIONS]
+
+    Connects once, and keeps the connections and the index mappings read in memory between
+    queries, so that repeated queries only fetch the field usage stats:
+
+    $ curl 'http://127.0.0.1:9280/report/index-*'
+
+    GET /report/SEARCH_PATTERN returns the summary report as JSON, and /results/SEARCH_PATTERN the
+    fields of each index. Add ?sections=accessed or ?sections=unaccessed to return only those
+    fields, and ?format=ndjson (or csv or columnar, for reports) for another output format.
+    /_health and /_metrics return the server status, and the requests made to each API.
+
+    Index mappings are cached in memory, and, with --cache, saved to the mapping cache file at most
+    once a minute.
+    """
+    client_args, other_args = get_args(ctx.parent.params)
+    try:
+        client = get_client(configdict={
+            'elasticsearch': {
+                'client': escl.prune_nones(client_args.asdict()),
+                'other_settings': escl.prune_nones(other_args.asdict())
+            }
+        })
+        mapping_cache = MappingCache(
+            MAPPING_CACHE_FILE if cache else None, save_interval=MAPPING_CACHE_SAVE_INTERVAL)
+        app = server.UsageServer(
+            client, mapping_cache=mapping_cache, workers=workers, stream=stream,
+            batch_size=batch_size, concurrency=concurrency, retries=retries, rollup=rollup,
+            include=include, exclude=exclude)
+        httpd = server.make_server(app, listen=listen, unix_socket=unix_socket)
+    except Exception as exc:
+        LOGGER.critical('Exception encountered: %s', exc)
+        raise FatalException from exc
+    address = unix_socket if unix_socket else f'http://{listen}'
+    click.secho('Serving field usage on ', nl=False)
+    click.secho(address, bold=True)
+    server.serve(httpd)
 
 @click.command(context_settings=get_context_settings(), epilog=EPILOG)
 @click.argument('search_pattern', type=str, nargs=1)
@@ -2,8 +2,6 @@
 import os
 from shutil import get_terminal_size
 import click
-from six import string_types
-from voluptuous import All, Any, Coerce, Optional, Schema
 
 # pylint: disable=E1120
 
@@ -13,8 +11,78 @@ FILEPATH_OVERRIDE = '/fileoutput'
 
 EPILOG = 'Learn more at https://github.com/untergeek/elastic-grab-bag/es-fieldusage'
 
+# Keep comma-separated index names in a request path below the Elasticsearch default
+# http.max_initial_line_length of 4kb
+MAX_BATCH_LENGTH = 3072
+
+# Bytes read at a time when streaming an API response
+STREAM_CHUNK_SIZE = 65536
+
+# Where flattened index mappings are cached between runs, and how many index mappings to keep
+MAPPING_CACHE_FILE = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')),
+    'es-fieldusage', 'mappings.json')
+MAPPING_CACHE_SIZE = 10000
+# Seconds between saves of the mapping cache file by the serve command
+MAPPING_CACHE_SAVE_INTERVAL = 60
+
 HELP_OPTIONS = {'help_option_names': ['-h', '--help']}
 
+# The Elasticsearch client options of es_client.defaults.CLICK_OPTIONS, kept here so the CLI can be
+# built without importing es_client and the Elasticsearch client
+CLIENT_OPTIONS = {
+    'config': {'help': 'Path to configuration file.', 'type': click.Path(exists=True)},
+    'hosts': {'help': 'Elasticsearch URL to connect to.', 'multiple': True},
+    'cloud_id': {'help': 'Elastic Cloud instance id'},
+    'api_token': {'help': 'The base64 encoded API Key token', 'type': str},
+    'id': {'help': 'API Key "id" value', 'type': str},
+    'api_key': {'help': 'API Key "api_key" value', 'type': str},
+    'username': {'help': 'Elasticsearch username', 'type': str},
+    'password': {'help': 'Elasticsearch password', 'type': str},
+    'bearer_auth': {'help': 'Bearer authentication token', 'type': str, 'hidden': True},
+    'opaque_id': {'help': 'X-Opaque-Id HTTP header value', 'type': str, 'hidden': True},
+    'request_timeout': {'help': 'Request timeout in seconds', 'type': float},
+    'http_compress': {
+        'help': 'Enable HTTP compression',
+        'default': False,
+        'show_default': True,
+        'hidden': True,
+    },
+    'verify_certs': {
+        'help': 'Verify SSL/TLS certificate(s)', 'default': True, 'show_default': True},
+    'ca_certs': {'help': 'Path to CA certificate file or directory', 'type': str},
+    'client_cert': {'help': 'Path to client certificate file', 'type': str},
+    'client_key': {'help': 'Path to client key file', 'type': str},
+    'ssl_assert_hostname': {
+        'help': "Hostname or IP address to verify on the node's certificate.",
+        'type': str,
+        'hidden': True
+    },
+    'ssl_assert_fingerprint': {
+        'help': (
+            "SHA-256 fingerprint of the node's certificate. If this value is given then "
+            "root-of-trust verification isn't done and only the node's certificate fingerprint "
+            "is verified."
+            ),
+        'type': str,
+        'hidden': True
+    },
+    'ssl_version': {'help': 'Minimum acceptable TLS/SSL version', 'type': str, 'hidden': True},
+    'master-only': {
+        'help': 'Only run if the single host provided is the elected master',
+        'default': False,
+        'show_default': True,
+        'hidden': True
+    },
+    'skip_version_test': {
+        'help': 'Elasticsearch version compatibility check',
+        'default': False,
+        'show_default': True,
+        'hidden': True
+    }
+}
+
+
 CLI_OPTIONS = {
     'loglevel': {
         'help': 'Log level',
@@ -72,10 +140,150 @@ CLI_OPTIONS = {
         'show_default': True,
     },
     'suffix':{
-        'help': 'Filename suffix',
-        'default': 'csv',
+        'help': 'Filename suffix  [default: csv, ndjson, arrow or columns, by output format]',
+        'default': None,
+    },
+    'output-format':{
+        'help': (
+            'Text lines, or rows of index, section, field and count as NDJSON, CSV or columnar '
+            '(Arrow IPC if pyarrow is installed, else packed arrays)'
+        ),
+        'type': click.Choice(['text', 'ndjson', 'csv', 'columnar']),
+        'default': 'text',
+        'show_default': True,
+    },
+    'workers':{
+        'help': 'Worker threads used to fetch mappings and merge per-index results concurrently',
+        'type': click.IntRange(min=1),
+        'default': 1,
+        'show_default': True,
+    },
+    'stream':{
+        'help': 'Aggregate field usage stats shard by shard as the response is received',
+        'is_flag': True,
+        'default': False,
+        'show_default': True,
+    },
+    'batch-size':{
+        'help': 'Fetch field usage stats for at most this many indices per request',
+        'type': click.IntRange(min=1),
+        'default': None,
+    },
+    'concurrency':{
+        'help': 'Field usage stats batch requests in flight at once (with --batch-size)',
+        'type': click.IntRange(min=1),
+        'default': 1,
+        'show_default': True,
+    },
+    'retries':{
+        'help': 'Times to retry a failed field usage stats batch request (with --batch-size)',
+        'type': click.IntRange(min=0),
+        'default': 2,
+        'show_default': True,
+    },
+    'snapshot': {
+        'help': (
+            'Report only the usage since the snapshot in this file, if it exists, then save the '
+            'current usage to it'
+        ),
+        'type': click.Path(dir_okay=False),
+        'default': None,
+    },
+    'target': {
+        'help': 'Index to write field usage documents to',
+        'type': str,
+        'default': 'es-fieldusage',
+        'show_default': True,
+    },
+    'chunk-size': {
+        'help': 'Documents per bulk request',
+        'type': click.IntRange(min=1),
+        'default': 500,
+        'show_default': True,
+    },
+    'threads': {
+        'help': 'Threads sending bulk requests (more than 1 uses parallel_bulk)',
+        'type': click.IntRange(min=1),
+        'default': 1,
         'show_default': True,
     },
+    'timestamp': {
+        'help': (
+            'The @timestamp of the documents, in UTC. Indexing again with the same timestamp '
+            'overwrites the same documents  [default: now, adding new documents every run]'
+        ),
+        'type': click.DateTime(formats=['%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M:%SZ', '%Y-%m-%d']),
+        'default': None,
+    },
+    'cache': {
+        'help': (
+            'Cache index mappings between runs, and fetch only those which have changed since, '
+            'after reading every mapping version from the cluster state'
+        ),
+        'default': False,
+        'show_default': True,
+    },
+    'profile': {
+        'help': 'Print the time spent in each phase, and the requests made to each API, to stderr',
+        'is_flag': True,
+        'default': False,
+    },
+    'metrics': {
+        'help': 'Log the run metrics in one message (as ECS JSON fields with --logformat ecs)',
+        'is_flag': True,
+        'default': False,
+    },
+    'listen': {
+        'help': 'Address and port to serve HTTP on',
+        'type': str,
+        'default': '127.0.0.1:9280',
+        'show_default': True,
+    },
+    'unix-socket': {
+        'help': 'Serve HTTP on this Unix socket, instead of --listen',
+        'type': click.Path(dir_okay=False),
+        'default': None,
+    },
+    'rollup': {
+        'help': (
+            'Sum the usage of backing indices into their data stream, and of other indices into '
+            'their alias, and report on those instead'
+        ),
+        'is_flag': True,
+        'default': False,
+    },
+    'include': {
+        'help': (
+            'Only count and report fields matching this glob, e.g. host.*, or /regular '
+            'expression/ (repeatable)'
+        ),
+        'type': str,
+        'multiple': True,
+    },
+    'exclude': {
+        'help': (
+            'Do not count or report fields matching this glob, e.g. *.keyword, or /regular '
+            'expression/ (repeatable)'
+        ),
+        'type': str,
+        'multiple': True,
+    },
+    'cluster': {
+        'help': (
+            'Report on the named clusters in the configuration file matching this pattern, all at '
+            'once, instead of one cluster (repeatable)'
+        ),
+        'type': str,
+        'multiple': True,
+    },
+    'cluster-timeout': {
+        'help': (
+            'Seconds to wait for the results of each cluster (with --cluster), unless the cluster '
+            'has its own timeout'
+        ),
+        'type': click.FloatRange(min=0.1),
+        'default': None,
+    },
     'show_hidden': {'help': 'Show all options', 'is_flag': True, 'default': False}
 }
 
@@ -100,6 +308,9 @@ def config_logging():
         the default values set.
     :rtype: :py:class:`~.voluptuous.schema_builder.Schema`
     """
+    # pylint: disable=import-outside-toplevel
+    from six import string_types
+    from voluptuous import All, Any, Coerce, Optional, Schema
     return Schema(
         {
             Optional('loglevel', default='INFO'):
@@ -113,6 +324,42 @@ def config_logging():
         }
     )
 
+# Configuration file: named clusters
+def config_clusters():
+    """
+    Named clusters schema, for reporting on several clusters at once with ``--cluster``:
+
+    .. code-block:: yaml
+
+        clusters:
+          prod-east:
+            client:
+              hosts: https://prod-east.example.com:9200
+            other_settings:
+              username: fieldusage
+              password: ${PROD_PASSWORD}
+            timeout: 120
+
+    Each cluster takes the same ``client`` and ``other_settings`` as the ``elasticsearch``
+    section, and an optional ``timeout``, the seconds to wait for all of its results.
+
+    :returns: A valid :py:class:`~.voluptuous.schema_builder.Schema` of all acceptable values with
+        the default values set.
+    :rtype: :py:class:`~.voluptuous.schema_builder.Schema`
+    """
+    # pylint: disable=import-outside-toplevel
+    from voluptuous import All, Any, Coerce, Optional, Range, Schema
+    return Schema(
+        {
+            str: {
+                Optional('client', default={}): Any(None, dict),
+                Optional('other_settings', default={}): Any(None, dict),
+                Optional('timeout', default=None):
+                    Any(None, All(Coerce(float), Range(min=0.1, max=86400.0))),
+            }
+        }
+    )
+
 def get_context_settings():
     """Return Click context settings dictionary"""
     return {**get_width(), **HELP_OPTIONS}
@@ -0,0 +1,51 @@
+"""Concurrent batch request helper functions"""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from es_fieldusage.exceptions import ConfigurationException, ResultNotExpected
+
+LOGGER = logging.getLogger(__name__)
+
+async def fetch_batch(func, batch, semaphore, executor, retries, backoff):
+    """
+    Await ``func(','.join(batch))`` in ``executor`` once ``semaphore`` allows it. Retry up to
+    ``retries`` more times on failure, sleeping ``backoff`` seconds, doubling with each attempt.
+    """
+    loop = asyncio.get_running_loop()
+    target = ','.join(batch)
+    async with semaphore:
+        for attempt in range(retries + 1):
+            try:
+                return await loop.run_in_executor(executor, func, target)
+            except ConfigurationException:
+                raise
+            except Exception as exc:  # pylint: disable=broad-exception-caught
+                if attempt == retries:
+                    msg = f'Batch of {len(batch)} indices failed after {attempt + 1} attempt(s)'
+                    raise ResultNotExpected(f'{msg}: {exc}') from exc
+                wait = backoff * 2 ** attempt
+                LOGGER.warning(
+                    'Batch of %s indices failed (attempt %s of %s), retrying in %ss: %s',
+                    len(batch), attempt + 1, retries + 1, wait, exc)
+                await asyncio.sleep(wait)
+
+async def gather_batches(func, batches, concurrency, retries, backoff):
+    """Run :py:func:`fetch_batch` for every batch, with at most ``concurrency`` in flight"""
+    semaphore = asyncio.Semaphore(concurrency)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return await asyncio.gather(
+            *(fetch_batch(func, batch, semaphore, executor, retries, backoff) for batch in batches))
+
+def fetch_batches(func, batches, concurrency=1, retries=2, backoff=1.0):
+    """
+    Call ``func`` with the comma-separated index names of each list in ``batches``, with up to
+    ``concurrency`` calls in flight at once, and retry each failed batch up to ``retries`` times.
+
+    The blocking ``func`` (e.g. an Elasticsearch client API method) runs in a thread pool driven by
+    an asyncio event loop, which bounds concurrency and schedules retries without holding a
+    worker.
+
+    :returns: The return value of ``func`` for each batch, in the same order as ``batches``
+    :rtype: list
+    """
+    return asyncio.run(gather_batches(func, batches, concurrency, retries, backoff))
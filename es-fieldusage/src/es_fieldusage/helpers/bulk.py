@@ -0,0 +1,83 @@
+"""Bulk indexing helper functions"""
+import logging
+from hashlib import sha1
+from elasticsearch8.helpers import parallel_bulk, streaming_bulk
+
+LOGGER = logging.getLogger(__name__)
+
+MAPPINGS = {
+    'properties': {
+        '@timestamp': {'type': 'date'},
+        'cluster': {'type': 'keyword'},
+        'index': {'type': 'keyword'},
+        'field': {'type': 'keyword'},
+        'count': {'type': 'long'},
+        'accessed': {'type': 'boolean'},
+    }
+}
+
+def create_index(client, index, shards=1):
+    """Create ``index`` for field usage documents, unless it already exists"""
+    client.options(ignore_status=400, request_timeout=30).indices.create(
+        index=index, settings={'number_of_shards': shards}, mappings=MAPPINGS,
+        wait_for_active_shards=shards)
+
+def doc_id(timestamp, idx, field):
+    """
+    Return a document ``_id`` which is the same every time the usage of ``field`` in index ``idx``
+    is indexed for ``timestamp``, so that indexing the same results again overwrites them
+    """
+    return sha1(f'{timestamp}\0{idx}\0{field}'.encode('utf-8')).hexdigest()
+
+def usage_actions(results, target, timestamp, ids=True):
+    """
+    Lazily yield a bulk index action for every field of every index in ``results`` (e.g.
+    :py:attr:`~.es_fieldusage.main.FieldUsage.results_by_index`), for the ``target`` index.
+    Index names from several clusters (``cluster:index``) are split into a cluster and an index.
+
+    If ``ids`` is set, each action has the ``_id`` from :py:func:`doc_id`, so indexing the
+    results for the same ``timestamp`` again overwrites them. Otherwise Elasticsearch generates
+    one, for a ``timestamp`` which is only the time of this run.
+    """
+    for idx, counts in results.items():
+        # Index names cannot contain a colon, so any colon follows the cluster name
+        cluster, _, name = idx.rpartition(':')
+        for field, count in counts.items():
+            source = {
+                '@timestamp': timestamp,
+                'index': name,
+                'field': field,
+                'count': count,
+                'accessed': count > 0,
+            }
+            if cluster:
+                source['cluster'] = cluster
+            action = {'_op_type': 'index', '_index': target, '_source': source}
+            if ids:
+                action['_id'] = doc_id(timestamp, idx, field)
+            yield action
+
+def send(client, actions, chunk_size=500, threads=1):
+    """
+    Send ``actions`` to Elasticsearch in bulk requests of ``chunk_size`` actions, with
+    :py:func:`~.elasticsearch8.helpers.streaming_bulk`, or with
+    :py:func:`~.elasticsearch8.helpers.parallel_bulk` in ``threads`` threads, if more than one.
+    Failed actions are logged rather than raised, so the rest are still sent.
+
+    :returns: The number of actions which succeeded, and the number which failed
+    :rtype: tuple(int, int)
+    """
+    kwargs = {'chunk_size': chunk_size, 'raise_on_error': False}
+    if threads > 1:
+        responses = parallel_bulk(client, actions, thread_count=threads, **kwargs)
+    else:
+        responses = streaming_bulk(client, actions, **kwargs)
+    successes = failures = 0
+    for success, item in responses:
+        if success:
+            successes += 1
+        else:
+            failures += 1
+            if failures <= 10:
+                LOGGER.error('Failed to index document: %s', item)
+    return successes, failures
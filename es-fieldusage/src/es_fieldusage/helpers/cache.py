@@ -0,0 +1,130 @@
+"""Persistent mapping cache"""
+import json
+import logging
+import os
+import tempfile
+import time
+from threading import Lock
+from es_fieldusage.defaults import MAPPING_CACHE_SIZE
+
+LOGGER = logging.getLogger(__name__)
+CACHE_VERSION = 1
+
+class MappingCache:
+    """
+    An on-disk cache of flattened mapping leaf fields, so unchanged mappings need not be fetched
+    and flattened again on every run.
+
+    Each entry maps a key for an index mapping version (see
+    :py:meth:`~.es_fieldusage.main.FieldUsage.get_mapping_versions`) to the hash of that mapping
+    (see :py:func:`~.es_fieldusage.helpers.utils.mapping_hash`). The leaf fields are stored once
+    per distinct hash, so indices which share a mapping share an entry. Entries are kept in least
+    recently used order, and only the ``max_entries`` most recently used are saved. Reading an
+    entry only reorders them in memory: the file is only written if an entry was added, so a run
+    which finds every mapping in the cache writes nothing, and the order is saved with the next
+    change.
+
+    If ``filename`` is None, the cache is only kept in memory. A long-running process can set
+    ``save_interval`` to save the cache at most once in that many seconds, unless forced.
+    """
+    def __init__(self, filename, max_entries=MAPPING_CACHE_SIZE, save_interval=0):
+        self.filename = filename
+        self.max_entries = max_entries
+        self.save_interval = save_interval
+        self.saved_at = None
+        #: Attribute. Index mapping version key -> mapping hash, least recently used first
+        self.entries = {}
+        #: Attribute. Mapping hash -> list of leaf field names
+        self.leaves = {}
+        self.loaded = False
+        self.changed = False
+        self.lock = Lock()
+
+    def load(self):
+        """Read the cache file, if it exists. A missing or unreadable file is an empty cache."""
+        self.loaded = True
+        if self.filename is None:
+            return
+        try:
+            with open(self.filename, 'r', encoding='utf-8') as fdesc:
+                data = json.load(fdesc)
+            if data.get('version') != CACHE_VERSION:
+                raise ValueError(f'unsupported cache version {data.get("version")}')
+            self.entries = data['entries']
+            self.leaves = data['leaves']
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, KeyError, AttributeError) as exc:
+            LOGGER.warning('Ignoring unreadable mapping cache %s: %s', self.filename, exc)
+            self.entries, self.leaves = {}, {}
+        LOGGER.debug('Loaded %s cached index mappings from %s', len(self.entries), self.filename)
+
+    def get(self, key):
+        """
+        Return a ``(hash, leaf_names)`` tuple for index mapping version ``key``, or None if it is
+        not cached, and mark it as most recently used
+        """
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            digest = self.entries.pop(key, None)
+            if digest is None or digest not in self.leaves:
+                return None
+            # Most recently used last. Not a change to save on its own
+            self.entries[key] = digest
+            return digest, self.leaves[digest]
+
+    def put(self, key, digest, leaves):
+        """Cache ``leaves`` (field names) with ``digest``, for index mapping version ``key``"""
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            self.entries.pop(key, None)
+            self.entries[key] = digest
+            if digest not in self.leaves:
+                self.leaves[digest] = list(leaves)
+            self.changed = True
+
+    def evict(self):
+        """Drop the least recently used entries beyond ``max_entries``, and any orphaned leaves"""
+        excess = len(self.entries) - self.max_entries
+        if excess > 0:
+            for key in list(self.entries)[:excess]:
+                del self.entries[key]
+        used = set(self.entries.values())
+        self.leaves = {digest: value for digest, value in self.leaves.items() if digest in used}
+
+    def save(self, force=False):
+        """
+        Write the cache file atomically, if anything changed, and it was not saved in the last
+        ``save_interval`` seconds (unless ``force`` is True). Failure only logs a warning.
+        """
+        with self.lock:
+            if not self.changed:
+                return
+            if self.filename is None:
+                # Nothing to write, but keep the cache within its size limit
+                self.evict()
+                return
+            if not force and self.saved_at is not None:
+                if time.monotonic() - self.saved_at < self.save_interval:
+                    return
+            self.evict()
+            data = {'version': CACHE_VERSION, 'entries': self.entries, 'leaves': self.leaves}
+            dirname = os.path.dirname(os.path.abspath(self.filename))
+            try:
+                os.makedirs(dirname, exist_ok=True)
+                fdesc, tmpname = tempfile.mkstemp(prefix='.mappings-', dir=dirname)
+                try:
+                    with os.fdopen(fdesc, 'w', encoding='utf-8') as tmpfile:
+                        json.dump(data, tmpfile, separators=(',', ':'))
+                    os.replace(tmpname, self.filename)
+                except BaseException:
+                    os.unlink(tmpname)
+                    raise
+            except OSError as exc:
+                LOGGER.warning('Unable to save mapping cache %s: %s', self.filename, exc)
+                return
+            self.changed = False
+            self.saved_at = time.monotonic()
+            LOGGER.debug('Saved %s cached index mappings to %s', len(self.entries), self.filename)
@@ -1,10 +1,16 @@
 """Client builder helper functions"""
 import logging
+import time
+from fnmatch import fnmatch
+from functools import wraps
+from elastic_transport.client_utils import DEFAULT
 from es_client.builder import Builder, ClientArgs, OtherArgs
 from es_client.defaults import CLIENT_SETTINGS, VERSION_MAX, VERSION_MIN
 from es_client.exceptions import ConfigurationError
 from es_client.helpers import utils as escl
-from es_fieldusage.exceptions import ClientException, ConfigurationException
+from es_client.helpers.schemacheck import SchemaCheck
+from es_fieldusage.defaults import config_clusters
+from es_fieldusage.exceptions import ClientException, ConfigurationException, TimeoutException
 from es_fieldusage.helpers.logging import check_logging_config, set_logging
 
 def cloud_id_override(args, params, client_args):
@@ -104,6 +110,64 @@ def get_client(
 
     return builder.client
 
+class Deadline:
+    """
+    A time limit of ``seconds`` from now on the requests a client makes (see :py:meth:`limit`),
+    until it is lifted
+    """
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self):
+        """Return the seconds left, which may be negative, or None once lifted"""
+        expires = self.expires
+        return None if expires is None else expires - time.monotonic()
+
+    def lift(self):
+        """Stop limiting requests"""
+        self.expires = None
+
+    def request_timeout(self, timeout=None):
+        """
+        Return the request ``timeout`` in seconds (None for none), or the time left, if less.
+        Raise :py:exc:`~.es_fieldusage.exceptions.TimeoutException` once there is none.
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        if remaining <= 0:
+            raise TimeoutException(f'No time left within {self.seconds} seconds')
+        return remaining if timeout is None or timeout > remaining else timeout
+
+    def limited_request(self, node):
+        """
+        Wrap ``node``'s ``perform_request`` method to give each request no more than the time left,
+        and to raise :py:exc:`~.es_fieldusage.exceptions.TimeoutException` instead of making one
+        once there is none (see :py:meth:`request_timeout`)
+        """
+        perform_request = node.perform_request
+
+        @wraps(perform_request)
+        def wrapper(method, target, *args, request_timeout=DEFAULT, **kwargs):
+            if self.expires is not None:
+                request_timeout = self.request_timeout(
+                    node.config.request_timeout if request_timeout is DEFAULT else request_timeout)
+            return perform_request(
+                method, target, *args, request_timeout=request_timeout, **kwargs)
+        return wrapper
+
+    def limit(self, client):
+        """
+        Limit every request made by ``client``, or any copy of it from ``client.options()``, to the
+        time left
+
+        :returns: ``client``
+        """
+        for node in client.transport.node_pool.all():
+            node.perform_request = self.limited_request(node)
+        return client
+
 def get_config(params):
     """If params['config'] is a valid path, return the validated dictionary from the YAML"""
     config = {'config':{}} # Set a default empty value
@@ -187,3 +251,34 @@ def get_args(params):
     override_other_args(params, client_args)
 
     return client_args, other_args
+
+def get_clusters(params, patterns):
+    """
+    Return the named clusters in the ``clusters`` section of the configuration file (see
+    :py:func:`~.es_fieldusage.defaults.config_clusters`) whose names match any of ``patterns``,
+    which may have wildcards. Command-line client options only apply to the ``elasticsearch``
+    section, not to named clusters.
+
+    :returns: Cluster name -> ``(client_args, other_args, timeout)``
+    :rtype: dict
+    """
+    config = get_config(params)
+    try:
+        clusters = SchemaCheck(
+            config.get('clusters') or {}, config_clusters(), 'Named clusters', 'clusters'
+        ).result()
+    except ConfigurationError as exc:
+        raise ConfigurationException(f'Invalid clusters configuration: {exc}') from exc
+    selected = {}
+    for name, settings in clusters.items():
+        if not any(fnmatch(name, pattern) for pattern in patterns):
+            continue
+        client_args, other_args = get_arg_objects({'elasticsearch': {
+            'client': settings['client'] or {},
+            'other_settings': settings['other_settings'] or {},
+        }})
+        selected[name] = (client_args, other_args, settings['timeout'])
+    if not selected:
+        raise ConfigurationException(
+            f'No clusters in the configuration file match {", ".join(patterns)}')
+    return selected
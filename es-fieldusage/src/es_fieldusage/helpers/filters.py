@@ -0,0 +1,61 @@
+"""Field name filters"""
+import re
+from fnmatch import translate
+from es_fieldusage.exceptions import ConfigurationException
+
+# Reported by the field usage API, but these can be used by runtime queries, so are never counted
+ALWAYS_EXCLUDE = ['_id', '_source']
+
+def compile_patterns(patterns):
+    """
+    Compile ``patterns`` into one regular expression, which matches a whole field name if any of
+    them does. Each pattern is a glob, e.g. ``host.*``, or a regular expression between slashes,
+    e.g. ``/host\\.(name|ip)/``, which must match the whole field name, as in Elasticsearch.
+
+    :rtype: :py:class:`re.Pattern`
+    """
+    parts = []
+    for pattern in patterns:
+        if len(pattern) > 1 and pattern.startswith('/') and pattern.endswith('/'):
+            parts.append(f'(?:{pattern[1:-1]})')
+        else:
+            parts.append(translate(pattern))
+    try:
+        return re.compile('|'.join(parts))
+    except re.error as exc:
+        raise ConfigurationException(f'Invalid field pattern in {list(patterns)}: {exc}') from exc
+
+class FieldFilter:
+    """
+    Decide which fields to count and report. A field is kept if it matches any of the ``include``
+    patterns, or there are none, and matches none of the ``exclude`` patterns (see
+    :py:func:`compile_patterns`). ``_id`` and ``_source`` are always excluded.
+
+    Each decision is remembered in ``self.decisions``, so each distinct field name is only
+    matched once, however many shards and indices it is found in.
+    """
+    def __init__(self, include=None, exclude=None):
+        self.include = compile_patterns(include) if include else None
+        self.exclude = compile_patterns([*ALWAYS_EXCLUDE, *(exclude if exclude else [])])
+        #: Attribute. The include and exclude patterns, as saved with a snapshot
+        self.patterns = {'include': list(include or []), 'exclude': list(exclude or [])}
+        #: Attribute. True if any field in an index mapping can be filtered out
+        self.active = bool(include or exclude)
+        #: Attribute. Field name -> whether it is kept
+        self.decisions = {}
+
+    def __call__(self, field):
+        try:
+            return self.decisions[field]
+        except KeyError:
+            keep = (
+                (self.include is None or self.include.fullmatch(field) is not None)
+                and self.exclude.fullmatch(field) is None)
+            self.decisions[field] = keep
+            return keep
+
+    def leaves(self, leaves):
+        """Return the flattened mapping ``leaves`` (field -> 0) which are kept"""
+        if not self.active:
+            return leaves
+        return {field: value for field, value in leaves.items() if self(field)}
@@ -0,0 +1,159 @@
+"""Machine-readable output formats"""
+import csv
+import io
+import json
+import re
+import sys
+from array import array
+from itertools import chain, repeat
+from json.encoder import encode_basestring_ascii
+from es_fieldusage.exceptions import ConfigurationException
+from es_fieldusage.helpers.lazy import lazy_import
+from es_fieldusage.helpers.store import COUNT_TYPE
+# PyArrow is imported on first use, only when writing columnar output
+pa = lazy_import('pyarrow')
+
+#: The structured formats. Every row is an index, section, field and count.
+FORMATS = ['ndjson', 'csv', 'columnar']
+CSV_HEADER = ['index', 'section', 'field', 'count']
+COLUMNS_MAGIC = b'ES-FIELDUSAGE-COLUMNS 1\n'
+SECTIONS = ['accessed', 'unaccessed']
+# Characters which make csv.writer quote a value
+CSV_SPECIAL = re.compile(r'[",\r\n]')
+
+def suffix(output_format):
+    """Return the default filename suffix for ``output_format``"""
+    if output_format == 'columnar':
+        return 'arrow' if pa is not None else 'columns'
+    if output_format == 'ndjson':
+        return 'ndjson'
+    return 'csv'
+
+def ndjson_rows(index, sections):
+    """
+    Yield one JSON object per line for each field of each ``(section, FieldCounts)`` tuple in
+    ``sections``. The index and section part of each line is only encoded once per section.
+    """
+    for section, data in sections:
+        prefix = json.dumps({'index': index, 'section': section}, separators=(',', ':'))[:-1]
+        for field, count in data.items():
+            yield f'{prefix},"field":{encode_basestring_ascii(field)},"count":{count}}}\n'
+
+def write_ndjson(fdesc, index, sections):
+    """Write ``sections`` (see :py:func:`ndjson_rows`) to binary file ``fdesc`` as NDJSON"""
+    wrapper = io.TextIOWrapper(fdesc, encoding='utf-8', newline='')
+    wrapper.writelines(ndjson_rows(index, sections))
+    wrapper.detach()
+
+def csv_line(values):
+    """Return ``values`` as a line of CSV, quoted as :py:func:`csv.writer` does"""
+    line = io.StringIO()
+    csv.writer(line).writerow(values)
+    return line.getvalue()
+
+def csv_rows(index, sections):
+    """
+    Yield the CSV header line, then a line for each field of each ``(section, FieldCounts)`` tuple
+    in ``sections``, exactly as :py:func:`csv.writer` would. The index and section part of each
+    line is only quoted once per section, and a field name only if it needs to be.
+    """
+    yield csv_line(CSV_HEADER)
+    for section, data in sections:
+        prefix = csv_line([index, section])[:-2]
+        for field, count in data.items():
+            if CSV_SPECIAL.search(field):
+                field = '"' + field.replace('"', '""') + '"'
+            yield f'{prefix},{field},{count}\r\n'
+
+def write_csv(fdesc, index, sections):
+    """Write ``sections`` (see :py:func:`csv_rows`) to binary file ``fdesc`` as CSV"""
+    wrapper = io.TextIOWrapper(fdesc, encoding='utf-8', newline='')
+    wrapper.writelines(csv_rows(index, sections))
+    wrapper.detach()
+
+def count_buffer(data):
+    """Return a zero-copy view of the counts of FieldCounts ``data``"""
+    return memoryview(data.counts)[data.start:data.stop]
+
+def arrow_table(index, sections):
+    """
+    Return an Arrow table of ``sections`` (see :py:func:`ndjson_rows`). The index and section
+    columns are dictionary encoded, and the counts are copied straight from their arrays.
+    """
+    total = sum(len(data) for _, data in sections)
+    codes = array('b')
+    for section, data in sections:
+        codes.extend(repeat(SECTIONS.index(section), len(data)))
+    counts = b''.join(count_buffer(data) for _, data in sections)
+    return pa.table({
+        'index': pa.DictionaryArray.from_arrays(
+            pa.Array.from_buffers(pa.int8(), total, [None, pa.py_buffer(bytes(total))]),
+            pa.array([index])),
+        'section': pa.DictionaryArray.from_arrays(
+            pa.Array.from_buffers(pa.int8(), total, [None, pa.py_buffer(codes)]),
+            pa.array(SECTIONS)),
+        'field': pa.array(list(chain.from_iterable(data for _, data in sections)), pa.string()),
+        'count': pa.Array.from_buffers(pa.int64(), total, [None, pa.py_buffer(counts)]),
+    })
+
+def write_arrow(fdesc, index, sections):
+    """Write ``sections`` (see :py:func:`ndjson_rows`) to binary file ``fdesc`` as Arrow IPC"""
+    table = arrow_table(index, sections)
+    with pa.ipc.new_file(fdesc, table.schema) as writer:
+        writer.write_table(table)
+
+def write_columns(fdesc, index, sections):
+    """
+    Write ``sections`` (see :py:func:`ndjson_rows`) to binary file ``fdesc`` in the packed columnar
+    format used when PyArrow is not installed: the ``COLUMNS_MAGIC`` line, a single line JSON
+    header with the index name, the name and row count of each section and the field names of
+    every row, then the counts of every row, as raw 8-byte integers.
+    """
+    header = {
+        'index': index,
+        'byteorder': sys.byteorder,
+        'sections': [[section, len(data)] for section, data in sections],
+        'fields': list(chain.from_iterable(data for _, data in sections)),
+    }
+    fdesc.write(COLUMNS_MAGIC)
+    fdesc.write(json.dumps(header, separators=(',', ':')).encode('utf-8') + b'\n')
+    for _, data in sections:
+        fdesc.write(count_buffer(data))
+
+def read_columns(fdesc):
+    """
+    Read a file written by :py:func:`write_columns` from binary file ``fdesc``
+
+    :returns: The index name, and a list of ``(section, field, count)`` rows
+    :rtype: tuple(str, list)
+    """
+    if fdesc.readline() != COLUMNS_MAGIC:
+        raise ConfigurationException('Not an es-fieldusage columnar file')
+    header = json.loads(fdesc.readline())
+    counts = array(COUNT_TYPE)
+    counts.frombytes(fdesc.read())
+    if header['byteorder'] != sys.byteorder:
+        counts.byteswap()
+    sections = chain.from_iterable(
+        repeat(section, length) for section, length in header['sections'])
+    return header['index'], list(zip(sections, header['fields'], counts))
+
+def write_columnar(fdesc, index, sections):
+    """Write an Arrow IPC file if PyArrow is installed, otherwise the packed columnar format"""
+    if pa is not None:
+        write_arrow(fdesc, index, sections)
+    else:
+        write_columns(fdesc, index, sections)
+
+WRITERS = {'ndjson': write_ndjson, 'csv': write_csv, 'columnar': write_columnar}
+
+def dump(output_format, fdesc, index, sections):
+    """
+    Write the fields of each ``(section, FieldCounts)`` tuple in ``sections``, for ``index``, to
+    binary file ``fdesc`` in ``output_format``, one of ``FORMATS``
+    """
+    try:
+        writer = WRITERS[output_format]
+    except KeyError as exc:
+        raise ConfigurationException(f'Unknown output format: {output_format}') from exc
+    writer(fdesc, index, sections)
@@ -0,0 +1,62 @@
+"""Lazy loading helpers, which keep CLI startup fast"""
+import importlib
+import importlib.util
+import sys
+import click
+
+def lazy_import(name):
+    """
+    Return module ``name``, which is only actually imported when one of its attributes is first
+    used, or None if it is not installed. This replaces ``try: import name`` for optional
+    dependencies which are slow to import, and only needed by some commands.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        return None
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+class LazyGroup(click.Group):
+    """
+    A click group whose subcommands are only imported when they are run, so that ``--help``, or
+    running one command, does not import the modules every other command needs.
+
+    ``lazy_commands`` maps each command name to a tuple of the import path of the command object
+    (``module.attribute``) and its short help, which is shown in the group's ``--help`` without
+    importing the command.
+    """
+    def __init__(self, *args, lazy_commands=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_commands = lazy_commands if lazy_commands else {}
+
+    def list_commands(self, ctx):
+        return sorted([*super().list_commands(ctx), *self.lazy_commands])
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name in self.lazy_commands:
+            return self.load_command(cmd_name)
+        return super().get_command(ctx, cmd_name)
+
+    def load_command(self, cmd_name):
+        """Import and return the command ``cmd_name``"""
+        modname, attr = self.lazy_commands[cmd_name][0].rsplit('.', 1)
+        return getattr(importlib.import_module(modname), attr)
+
+    def format_commands(self, ctx, formatter):
+        """Write the commands and their short help to ``formatter``, without importing any"""
+        limit = formatter.width - 6 - max(len(name) for name in self.list_commands(ctx))
+        rows = []
+        for name in self.list_commands(ctx):
+            if name in self.lazy_commands:
+                rows.append((name, self.lazy_commands[name][1]))
+            elif not self.commands[name].hidden:
+                rows.append((name, self.commands[name].get_short_help_str(limit)))
+        if rows:
+            with formatter.section('Commands'):
+                formatter.write_dl(rows)
@@ -2,12 +2,15 @@
 import sys
 import logging
 import click
-import ecs_logging
 from es_client.helpers.schemacheck import SchemaCheck
 from es_client.helpers.utils import ensure_list, prune_nones
 from es_fieldusage.defaults import config_logging
+from es_fieldusage.helpers.lazy import lazy_import
 from es_fieldusage.helpers.utils import is_docker
 
+# Only needed with logformat: ecs
+ecs_logging = lazy_import('ecs_logging')
+
 class Whitelist(logging.Filter):
     """How to whitelist logs"""
     # pylint: disable=super-init-not-called
@@ -112,3 +115,29 @@ def set_logging(log_opts):
         for bl_entry in ensure_list(log_opts['blacklist']):
             for handler in logging.root.handlers:
                 handler.addFilter(Blacklist(bl_entry))
+
+def log_metrics(logger, metrics):
+    """Log ``metrics`` as a single INFO message
+
+    The metrics are also passed as extra fields, so with ``logformat: ecs`` they are output as ECS
+    JSON: the elapsed time as ``event.duration`` (in nanoseconds), and the phase timers, counters
+    and requests per API under ``es_fieldusage``.
+
+    :param logger: The logger to log with
+    :param metrics: The run metrics
+
+    :type logger: :py:class:`~.logging.Logger`
+    :type metrics: :py:class:`~.es_fieldusage.helpers.metrics.Metrics`
+
+    :rtype: None
+    """
+    data = metrics.as_dict()
+    elapsed = data.pop('elapsed')
+    logger.info(
+        'Run metrics: %.3fs elapsed, %s requests, %s bytes received', elapsed,
+        sum(api['requests'] for api in data['apis'].values()),
+        sum(api['bytes'] for api in data['apis'].values()),
+        extra={
+            'event': {'kind': 'metric', 'duration': int(elapsed * 1e9)},
+            'es_fieldusage': data,
+        })
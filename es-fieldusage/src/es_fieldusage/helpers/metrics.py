@@ -0,0 +1,151 @@
+"""Run time instrumentation"""
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# Path segments which only name an API together with the segment after them
+API_GROUPS = ['_cat', '_cluster', '_nodes', '_resolve']
+
+def api_name(target):
+    """
+    Return the name of the API requested at ``target`` (a request path), e.g. ``_mapping``
+    for ``/index-*/_mapping``, or ``_cat/indices`` for ``/_cat/indices?format=json``
+    """
+    segments = target.split('?', 1)[0].strip('/').split('/')
+    for pos, segment in enumerate(segments):
+        if segment.startswith('_'):
+            if segment in API_GROUPS and pos + 1 < len(segments):
+                return f'{segment}/{segments[pos + 1]}'
+            return segment
+    return '{index}' if segments[0] else '/'
+
+class Metrics:
+    """
+    Thread-safe timers and counters for each phase of a run, and the requests made to each API.
+
+    Phase timers nest: while a phase is timed inside another in the same thread, the outer phase
+    is paused, so each phase has only its own time. In one thread the phase times add up to no
+    more than the elapsed time. With worker threads, they are summed across all threads.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        #: Attribute. Phase name -> ``[calls, seconds]``
+        self.phases = {}
+        #: Attribute. Counter name -> value
+        self.counters = {}
+        #: Attribute. API name -> ``[requests, response bytes, seconds]``
+        self.apis = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    @contextmanager
+    def timer(self, phase):
+        """Time the enclosed block as ``phase``, excluding any phases timed inside it"""
+        stack = self.local.__dict__.setdefault('stack', [])
+        # The time spent in phases nested inside this one
+        nested = [0.0]
+        stack.append(nested)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            if stack:
+                stack[-1][0] += elapsed
+            with self.lock:
+                value = self.phases.setdefault(phase, [0, 0.0])
+                value[0] += 1
+                value[1] += elapsed - nested[0]
+
+    def count(self, name, value=1):
+        """Add ``value`` to counter ``name``"""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_request(self, api, nbytes, seconds):
+        """Record a request to ``api`` which took ``seconds``, and received ``nbytes``"""
+        with self.lock:
+            value = self.apis.setdefault(api, [0, 0, 0.0])
+            value[0] += 1
+            value[1] += nbytes
+            value[2] += seconds
+
+    def merge(self, other):
+        """Add the phase times, counters and requests of Metrics ``other`` to this one"""
+        data = other.as_dict()
+        with self.lock:
+            for name, value in data['phases'].items():
+                phase = self.phases.setdefault(name, [0, 0.0])
+                phase[0] += value['calls']
+                phase[1] += value['seconds']
+            for name, value in data['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for name, value in data['apis'].items():
+                api = self.apis.setdefault(name, [0, 0, 0.0])
+                api[0] += value['requests']
+                api[1] += value['bytes']
+                api[2] += value['seconds']
+
+    def reset(self):
+        """Clear the phase times, counters and requests, and return a Metrics object with them"""
+        taken = Metrics()
+        with self.lock:
+            taken.phases, self.phases = self.phases, {}
+            taken.counters, self.counters = self.counters, {}
+            taken.apis, self.apis = self.apis, {}
+        return taken
+
+    def elapsed(self):
+        """Return the seconds since this object was created"""
+        return time.perf_counter() - self.started
+
+    def as_dict(self):
+        """
+        Return all metrics: the ``elapsed`` seconds, and the ``phases``, ``counters`` and ``apis``,
+        each as a dictionary with a dictionary of values per name
+
+        :rtype: dict
+        """
+        with self.lock:
+            return {
+                'elapsed': round(self.elapsed(), 6),
+                'phases': {
+                    name: {'calls': calls, 'seconds': round(seconds, 6)}
+                    for name, (calls, seconds) in self.phases.items()
+                },
+                'counters': dict(self.counters),
+                'apis': {
+                    name: {'requests': requests, 'bytes': nbytes, 'seconds': round(seconds, 6)}
+                    for name, (requests, nbytes, seconds) in self.apis.items()
+                },
+            }
+
+def timed_request(perform_request, metrics):
+    """
+    Wrap a node's ``perform_request`` method to record every request in ``metrics``, with the
+    size of the raw response body, before it is deserialized
+    """
+    @wraps(perform_request)
+    def wrapper(method, target, *args, **kwargs):
+        nbytes = 0
+        start = time.perf_counter()
+        try:
+            response = perform_request(method, target, *args, **kwargs)
+            nbytes = len(response.body)
+            return response
+        finally:
+            metrics.add_request(api_name(target), nbytes, time.perf_counter() - start)
+    return wrapper
+
+def instrument(client, metrics):
+    """
+    Record every request made by ``client``, or any copy of it from ``client.options()``, in
+    ``metrics``, per API
+
+    :returns: ``client``
+    """
+    for node in client.transport.node_pool.all():
+        node.perform_request = timed_request(node.perform_request, metrics)
+    return client
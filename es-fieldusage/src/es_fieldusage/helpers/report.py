@@ -0,0 +1,75 @@
+"""Lazily computed report data"""
+from collections.abc import Mapping
+from threading import RLock
+
+class LazyReport(Mapping):
+    """
+    A read-only, dictionary-like report whose values are computed the first time they are read.
+
+    Each key maps to a function which takes no arguments and returns the value, so a report
+    section which is never shown is never computed.
+    """
+    def __init__(self, sections):
+        #: Attribute. Key -> function returning the value
+        self.sections = sections
+        self.values = {}
+        self.lock = RLock()
+
+    def __getitem__(self, key):
+        try:
+            return self.values[key]
+        except KeyError:
+            func = self.sections[key]
+            with self.lock:
+                if key not in self.values:
+                    self.values[key] = func()
+                return self.values[key]
+
+    def __iter__(self):
+        return iter(self.sections)
+
+    def __len__(self):
+        return len(self.sections)
+
+    def __repr__(self):
+        computed = {key: self.values[key] for key in self.sections if key in self.values}
+        return f'{type(self).__name__}({computed}, pending={len(self) - len(computed)})'
+
+def summary_report(source, **extra):
+    """
+    Return the summary report of ``source``, a :py:class:`~.es_fieldusage.main.FieldUsage` or
+    :py:class:`~.es_fieldusage.multi.MultiFieldUsage` object, as a :py:class:`LazyReport`:
+
+    * ``indices``: ``source.indices``
+    * ``field_count`` and ``accessed_count``: ``source.field_count()`` and
+      ``source.accessed_count()``
+    * ``unaccessed_count``: the difference, found without sorting
+    * ``accessed`` and ``unaccessed``: ``source.accessed_fields()`` and
+      ``source.unaccessed_fields()``
+
+    ``extra`` maps the names of any other sections to functions returning them.
+    """
+    sections = {
+        'indices': lambda: source.indices,
+        'field_count': source.field_count,
+        'accessed_count': source.accessed_count,
+        'unaccessed_count': lambda: report['field_count'] - report['accessed_count'],
+        'accessed': source.accessed_fields,
+        'unaccessed': source.unaccessed_fields,
+    }
+    sections.update(extra)
+    report = LazyReport(sections)
+    return report
+
+def per_index_summary(results_by_index):
+    """
+    Return the accessed and unaccessed fields of each index in ``results_by_index``, as views over
+    its results, not copies
+
+    :returns: Index name -> ``{'accessed': ..., 'unaccessed': ...}``
+    :rtype: dict
+    """
+    return {
+        idx: {'accessed': result.accessed(), 'unaccessed': result.unaccessed()}
+        for idx, result in results_by_index.items()
+    }
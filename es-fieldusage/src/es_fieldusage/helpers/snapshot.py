@@ -0,0 +1,144 @@
+"""Field usage snapshot helper functions"""
+import json
+import logging
+import os
+import sys
+import tempfile
+from array import array
+from es_fieldusage.exceptions import ConfigurationException
+from es_fieldusage.helpers.store import COUNT_TYPE, ID_TYPE, UsageStore, np
+
+LOGGER = logging.getLogger(__name__)
+MAGIC = b'ES-FIELDUSAGE-SNAPSHOT 1\n'
+
+def save_snapshot(filename, store, timestamp, filters=None):
+    """
+    Write the per-index, per-field counts in UsageStore ``store`` to ``filename``, atomically.
+    ``filters`` are the field filters the counts were taken with, as a dict of ``include`` and
+    ``exclude`` patterns.
+
+    The file is the ``MAGIC`` line, a single line JSON header with the field filters, field names,
+    index names, entry counts and shard tracking signatures, then the raw bytes of every index's
+    field id array, followed by every index's count array, so loading it is a few bulk reads.
+    """
+    header = {
+        'timestamp': timestamp,
+        'filters': filters if filters else {'include': [], 'exclude': []},
+        'byteorder': sys.byteorder,
+        'fields': store.vocab.names,
+        'indices': [
+            [idx, len(ids), store.tracking.get(idx)] for idx, (ids, _) in store.columns.items()],
+    }
+    dirname = os.path.dirname(os.path.abspath(filename))
+    fdesc, tmpname = tempfile.mkstemp(prefix='.snapshot-', dir=dirname)
+    try:
+        with os.fdopen(fdesc, 'wb') as tmpfile:
+            tmpfile.write(MAGIC)
+            tmpfile.write(json.dumps(header, separators=(',', ':')).encode('utf-8') + b'\n')
+            for ids, _ in store.columns.values():
+                ids.tofile(tmpfile)
+            for _, counts in store.columns.values():
+                counts.tofile(tmpfile)
+        os.replace(tmpname, filename)
+    except BaseException:
+        os.unlink(tmpname)
+        raise
+    LOGGER.debug('Saved snapshot of %s indices to %s', len(store), filename)
+
+def load_snapshot(filename):
+    """
+    Read a snapshot written by :py:func:`save_snapshot`
+
+    :returns: The snapshot counts, with their own vocabulary, the snapshot timestamp, and the
+        field filters the counts were taken with
+    :rtype: tuple(:py:class:`~.es_fieldusage.helpers.store.UsageStore`, str, dict)
+    """
+    with open(filename, 'rb') as fdesc:
+        if fdesc.readline() != MAGIC:
+            raise ConfigurationException(f'{filename} is not an es-fieldusage snapshot file')
+        header = json.loads(fdesc.readline())
+        total = sum(length for _, length, _ in header['indices'])
+        all_ids = array(ID_TYPE)
+        all_counts = array(COUNT_TYPE)
+        try:
+            all_ids.fromfile(fdesc, total)
+            all_counts.fromfile(fdesc, total)
+        except EOFError as exc:
+            raise ConfigurationException(f'Snapshot file {filename} is truncated') from exc
+    if header['byteorder'] != sys.byteorder:
+        all_ids.byteswap()
+        all_counts.byteswap()
+    store = UsageStore()
+    for name in header['fields']:
+        store.vocab.get_id(name)
+    offset = 0
+    for idx, length, tracking in header['indices']:
+        store.columns[idx] = (
+            all_ids[offset:offset + length], all_counts[offset:offset + length])
+        store.tracking[idx] = tracking
+        offset += length
+    return store, header['timestamp'], header['filters']
+
+def diff(current, previous):
+    """
+    Return the change in field usage from UsageStore ``previous`` to UsageStore ``current``.
+
+    Usage counts are cumulative since each shard started tracking them, and restart from zero when
+    a shard is relocated or restarted. A count lower than before is therefore taken to be a count
+    since such a reset. An index whose shard tracking signature has changed has had at least one
+    shard reset, so its counts are all taken to be since then, as are those of an index not in
+    ``previous``, which is new.
+
+    :returns: The deltas, with the same vocabulary as ``current``, and the names of any indices
+        which had shards reset
+    :rtype: tuple(:py:class:`~.es_fieldusage.helpers.store.UsageStore`, list)
+    """
+    # Map the field ids of the previous vocabulary to the ids of the current one
+    translate = [current.vocab.get_id(name) for name in previous.vocab.names]
+    deltas = UsageStore(current.vocab)
+    resets = []
+    changed = vectorized_changes(translate, len(current.vocab)) if np is not None else None
+    for idx, (ids, counts) in current.columns.items():
+        deltas.tracking[idx] = current.tracking.get(idx)
+        if idx not in previous.columns:
+            deltas.columns[idx] = (ids, counts)
+            continue
+        if current.tracking.get(idx) != previous.tracking.get(idx):
+            resets.append(idx)
+            deltas.columns[idx] = (ids, counts)
+            continue
+        if changed is not None:
+            deltas.columns[idx] = (ids, changed(ids, counts, *previous.columns[idx]))
+        else:
+            deltas.columns[idx] = (ids, changes(translate, ids, counts, *previous.columns[idx]))
+    return deltas, resets
+
+# pylint: disable=too-many-arguments
+def changes(translate, ids, counts, prev_ids, prev_counts):
+    """
+    Return the change from ``prev_counts`` to ``counts`` for each of ``ids``, where ``translate``
+    maps the previous field ids (``prev_ids``) to the current ones
+    """
+    before = dict(zip(map(translate.__getitem__, prev_ids), prev_counts))
+    retval = array(COUNT_TYPE)
+    for fid, count in zip(ids, counts):
+        prior = before.get(fid, 0)
+        retval.append(count - prior if count >= prior else count)
+    return retval
+
+def vectorized_changes(translate, size):
+    """
+    Return a function like :py:func:`changes` using NumPy, which looks up the previous counts in a
+    dense array of ``size`` (the current vocabulary size) counts, reused for every index
+    """
+    translate = np.array(translate, dtype=np.uint32)
+    before = np.zeros(size, dtype=np.int64)
+    def changed(ids, counts, prev_ids, prev_counts):
+        ids = np.frombuffer(ids, dtype=np.uint32)
+        counts = np.frombuffer(counts, dtype=np.int64)
+        prev_ids = translate[np.frombuffer(prev_ids, dtype=np.uint32)]
+        before[prev_ids] = np.frombuffer(prev_counts, dtype=np.int64)
+        prior = before[ids]
+        before[prev_ids] = 0
+        return array(COUNT_TYPE, np.where(counts >= prior, counts - prior, counts).tobytes())
+    return changed
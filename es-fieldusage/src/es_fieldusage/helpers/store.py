@@ -0,0 +1,249 @@
+"""Compact field usage count storage"""
+import sys
+from array import array
+from collections.abc import ItemsView, Mapping, MutableMapping, ValuesView
+from itertools import compress, islice
+from threading import Lock
+from es_fieldusage.helpers.lazy import lazy_import
+
+# NumPy is imported on first use, so commands which never sum usage don't pay for it
+np = lazy_import('numpy')
+
+# Field ids (4 bytes) and usage counts (8 bytes)
+ID_TYPE = 'I'
+COUNT_TYPE = 'q'
+
+class FieldVocabulary:
+    """Interned field names, each with a unique integer id, shared by every index"""
+    def __init__(self):
+        #: Attribute. Field names, in id order
+        self.names = []
+        #: Attribute. Field name -> id
+        self.ids = {}
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def get_id(self, name):
+        """Return the id of field ``name``, adding it to the vocabulary if it is new"""
+        try:
+            return self.ids[name]
+        except KeyError:
+            with self.lock:
+                if name not in self.ids:
+                    self.ids[name] = len(self.names)
+                    self.names.append(sys.intern(name))
+                return self.ids[name]
+
+class FieldItems(ItemsView):
+    """Iterate ``(field, count)`` tuples without looking up each field"""
+    def __iter__(self):
+        return self._mapping.iter_items()
+
+class FieldValues(ValuesView):
+    """Iterate counts without looking up each field"""
+    def __iter__(self):
+        return self._mapping.iter_values()
+
+class FieldCounts(Mapping):
+    """
+    A read-only, dictionary-like view of field name -> usage count, for the ``start`` to ``stop``
+    slice of parallel arrays of field ``ids`` (in ``vocab``) and ``counts``. Field order is the
+    array order.
+    """
+    __slots__ = ('vocab', 'ids', 'counts', 'start', 'stop', 'positions')
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, vocab, ids, counts, start=0, stop=None):
+        self.vocab = vocab
+        self.ids = ids
+        self.counts = counts
+        self.start = start
+        self.stop = len(ids) if stop is None else stop
+        self.positions = None
+
+    @classmethod
+    def from_items(cls, vocab, items):
+        """Return a new FieldCounts for an iterable of ``(field, count)`` tuples"""
+        ids = array(ID_TYPE)
+        counts = array(COUNT_TYPE)
+        for field, count in items:
+            ids.append(vocab.get_id(field))
+            counts.append(count)
+        return cls(vocab, ids, counts)
+
+    def __getitem__(self, field):
+        if self.positions is None:
+            # Only built if something looks up fields by name, which the hot paths do not
+            self.positions = {fid: pos for pos, fid in enumerate(self.iter_ids())}
+        try:
+            return self.counts[self.start + self.positions[self.vocab.ids[field]]]
+        except KeyError as exc:
+            raise KeyError(field) from exc
+
+    def __iter__(self):
+        return map(self.vocab.names.__getitem__, self.iter_ids())
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __repr__(self):
+        return f'{type(self).__name__}({dict(self.items())})'
+
+    def iter_ids(self):
+        """Iterate field ids"""
+        return islice(self.ids, self.start, self.stop)
+
+    def iter_values(self):
+        """Iterate counts"""
+        return islice(self.counts, self.start, self.stop)
+
+    def iter_items(self):
+        """Iterate ``(field, count)`` tuples"""
+        return zip(iter(self), self.iter_values())
+
+    def items(self):
+        return FieldItems(self)
+
+    def values(self):
+        return FieldValues(self)
+
+    def first_zero(self):
+        """
+        Return the array position of the first zero count, which, for counts sorted in descending
+        order, divides the accessed fields from the unaccessed fields
+        """
+        low, high = self.start, self.stop
+        while low < high:
+            mid = (low + high) // 2
+            if self.counts[mid] > 0:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def accessed(self):
+        """Return a view of the fields with a count above zero (counts must be sorted descending)"""
+        return FieldCounts(self.vocab, self.ids, self.counts, self.start, self.first_zero())
+
+    def unaccessed(self):
+        """Return a view of the fields with a count of zero (counts must be sorted descending)"""
+        return FieldCounts(self.vocab, self.ids, self.counts, self.first_zero(), self.stop)
+
+    def nbytes(self):
+        """Return the size in bytes of the arrays backing this view"""
+        return self.ids.itemsize * len(self.ids) + self.counts.itemsize * len(self.counts)
+
+class UsageStore(MutableMapping):
+    """
+    A dictionary-like store of index name -> :py:class:`FieldCounts`, holding one pair of compact
+    field id and count arrays per index, with field names interned once in a shared ``vocab``
+    rather than repeated as dictionary keys in every index.
+
+    Any mapping of field name -> count can be assigned to an index, and is converted on the way in.
+    """
+    def __init__(self, vocab=None):
+        self.vocab = FieldVocabulary() if vocab is None else vocab
+        #: Attribute. Index name -> ``(ids, counts)`` arrays
+        self.columns = {}
+        #: Attribute. Index name -> shard tracking signature, which changes if a shard's usage
+        #: counts were reset (see :py:func:`~.es_fieldusage.helpers.utils.tracking_signature`)
+        self.tracking = {}
+
+    def __setitem__(self, idx, data):
+        if isinstance(data, FieldCounts) and data.vocab is self.vocab:
+            self.columns[idx] = (
+                data.ids[data.start:data.stop], data.counts[data.start:data.stop])
+        else:
+            counts = FieldCounts.from_items(self.vocab, data.items())
+            self.columns[idx] = (counts.ids, counts.counts)
+
+    def __getitem__(self, idx):
+        return FieldCounts(self.vocab, *self.columns[idx])
+
+    def __delitem__(self, idx):
+        del self.columns[idx]
+        self.tracking.pop(idx, None)
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    def __len__(self):
+        return len(self.columns)
+
+    def __contains__(self, idx):
+        return idx in self.columns
+
+    def __repr__(self):
+        return f'{type(self).__name__}({list(self.columns)})'
+
+    def merge(self, other):
+        """Add every index in UsageStore ``other``, and its shard tracking signature, to this one"""
+        self.update(other)
+        self.tracking.update(other.tracking)
+
+    def field_ids(self, accessed=False):
+        """
+        Return the set of ids of the fields found in any index, or only those with a count above
+        zero in any index, if ``accessed``. This needs no sorting, and no summing of counts.
+        """
+        found = set()
+        for ids, counts in self.columns.values():
+            found.update(compress(ids, counts) if accessed else ids)
+        return found
+
+    def nbytes(self):
+        """Return the size in bytes of all of the arrays in the store"""
+        return sum(self[idx].nbytes() for idx in self.columns)
+
+    def totals(self):
+        """
+        Return the counts of every field found in any index, summed across all indices, as a
+        :py:class:`FieldCounts` sorted by count, descending, then by field name.
+
+        If NumPy is installed, the per-index arrays are summed by field id in one vectorized pass,
+        and ordered by count with one argsort. Otherwise, they are summed into an array indexed by
+        field id in a single loop.
+        """
+        if np is not None:
+            ids, counts = self.vectorized_totals()
+        else:
+            ids, counts = self.array_totals()
+        return FieldCounts(self.vocab, ids, counts)
+
+    def vectorized_totals(self):
+        """Return sorted ``(ids, counts)`` arrays of the summed counts, using NumPy"""
+        size = len(self.vocab)
+        all_ids = np.concatenate(
+            [np.frombuffer(ids, dtype=np.uint32) for ids, _ in self.columns.values()]
+            + [np.empty(0, dtype=np.uint32)])
+        all_counts = np.concatenate(
+            [np.frombuffer(counts, dtype=np.int64) for _, counts in self.columns.values()]
+            + [np.empty(0, dtype=np.int64)])
+        # Summing the sparse per-index columns by field id is the column sum of the dense
+        # index-by-field matrix, without building the matrix
+        summed = np.zeros(size, dtype=np.int64)
+        np.add.at(summed, all_ids, all_counts)
+        found = np.flatnonzero(np.bincount(all_ids, minlength=size))
+        # Order by name, then stable sort by count, descending, so equal counts stay in name order
+        by_name = found[np.argsort(np.array(self.vocab.names, dtype=object)[found], kind='stable')]
+        order = by_name[np.argsort(-summed[by_name], kind='stable')]
+        return (
+            array(ID_TYPE, order.astype(np.uint32).tobytes()),
+            array(COUNT_TYPE, summed[order].tobytes()),
+        )
+
+    def array_totals(self):
+        """Return sorted ``(ids, counts)`` arrays of the summed counts, without NumPy"""
+        summed = array(COUNT_TYPE, bytes(array(COUNT_TYPE).itemsize * len(self.vocab)))
+        found = bytearray(len(self.vocab))
+        for ids, counts in self.columns.values():
+            for fid, count in zip(ids, counts):
+                summed[fid] += count
+                found[fid] = 1
+        names = self.vocab.names
+        order = sorted(
+            (fid for fid, flag in enumerate(found) if flag),
+            key=lambda fid: (-summed[fid], names[fid]))
+        return array(ID_TYPE, order), array(COUNT_TYPE, (summed[fid] for fid in order))
@@ -0,0 +1,204 @@
+"""Streaming helper functions"""
+import codecs
+import json
+import logging
+import re
+import time
+from urllib.parse import quote
+import urllib3
+from es_fieldusage.defaults import STREAM_CHUNK_SIZE
+from es_fieldusage.exceptions import (
+    ConfigurationException, ResultNotExpected, TimeoutException)
+from es_fieldusage.helpers.metrics import api_name
+
+LOGGER = logging.getLogger(__name__)
+# The structural characters we need to see outside of shard objects
+TOKENS = re.compile(r'["{}\[\]:]')
+# Everything after an opening quote, up to and including the closing quote
+STRING_END = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"', re.S)
+
+class ShardStreamParser:
+    """
+    Incrementally parse a field_usage_stats API response, which has this shape:
+
+    .. code-block:: json
+
+        {"_shards": {...}, "index-name": {"shards": [{...}, {...}]}, ...}
+
+    Feed the response text in pieces of any size with :py:meth:`feed`, which yields an
+    ``(index, None)`` tuple when the ``shards`` array of each index opens, and an ``(index, shard)``
+    tuple as soon as each complete shard object has arrived. Only the shard currently being
+    received is ever held in memory.
+    """
+    def __init__(self):
+        self.buffer = ''
+        self.pos = 0
+        #: Attribute. The open containers, as ``{`` or ``[``
+        self.stack = []
+        #: Attribute. The current key at each level of ``stack``
+        self.keys = []
+        self.last_string = None
+        #: Attribute. Buffer position of the shard object we are waiting to complete
+        self.shard_start = None
+        #: Attribute. Buffer length to wait for before trying to decode the shard object again
+        self.retry_at = 0
+        self.decoder = json.JSONDecoder()
+
+    def in_shards_array(self):
+        """Return True if we are directly inside the ``shards`` array of an index"""
+        return (
+            self.stack == ['{', '{', '[']
+            and self.keys[0] != '_shards'
+            and self.keys[1] == 'shards'
+        )
+
+    def decode_shard(self):
+        """
+        Try to decode the shard object at ``self.shard_start``. Return the shard, or None if it
+        has not been completely received yet.
+        """
+        if len(self.buffer) < self.retry_at:
+            return None
+        try:
+            shard, end = self.decoder.raw_decode(self.buffer, self.shard_start)
+        except json.JSONDecodeError:
+            # Incomplete. Wait until the pending data has doubled, to keep re-parsing linear.
+            self.retry_at = self.shard_start + 2 * (len(self.buffer) - self.shard_start)
+            return None
+        self.shard_start = None
+        self.retry_at = 0
+        self.pos = end
+        return shard
+
+    def feed(self, text):
+        """Add ``text`` to the buffer and yield each ``(index, shard)`` completed by it"""
+        self.buffer += text
+        while True:
+            if self.shard_start is not None:
+                shard = self.decode_shard()
+                if shard is None:
+                    break
+                yield self.keys[0], shard
+                continue
+            match = TOKENS.search(self.buffer, self.pos)
+            if not match:
+                self.pos = len(self.buffer)
+                break
+            char = match.group()
+            start = match.start()
+            if char == '"':
+                end = STRING_END.match(self.buffer, start + 1)
+                if not end:
+                    # Incomplete string. Wait for more data.
+                    self.pos = start
+                    break
+                self.last_string = json.loads(self.buffer[start:end.end()])
+                self.pos = end.end()
+                continue
+            self.pos = start + 1
+            if char == ':':
+                self.keys[-1] = self.last_string
+            elif char == '{' and self.in_shards_array():
+                self.shard_start = start
+            elif char in '{[':
+                self.stack.append(char)
+                self.keys.append(None)
+                if self.in_shards_array():
+                    yield self.keys[0], None
+            else:
+                self.stack.pop()
+                self.keys.pop()
+        self.trim()
+
+    def trim(self):
+        """Drop everything from the buffer that has already been parsed"""
+        cut = self.pos if self.shard_start is None else self.shard_start
+        self.buffer = self.buffer[cut:]
+        self.pos -= cut
+        if self.shard_start is not None:
+            self.shard_start -= cut
+            self.retry_at = max(0, self.retry_at - cut)
+
+    def close(self, text=''):
+        """
+        Parse any final ``text``, without waiting for more data, and raise an exception if the
+        response ended before it was complete
+        """
+        self.retry_at = 0
+        yield from self.feed(text)
+        if self.shard_start is not None or self.stack:
+            raise ResultNotExpected('Field usage stats response ended unexpectedly')
+
+def iter_shards(chunks):
+    """
+    Yield ``(index, shard)`` tuples (see :py:class:`ShardStreamParser`) from an iterable of
+    field_usage_stats response ``chunks`` (bytes), decoding the UTF-8 incrementally
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    parser = ShardStreamParser()
+    for chunk in chunks:
+        yield from parser.feed(decoder.decode(chunk))
+    yield from parser.close(decoder.decode(b'', final=True))
+
+def stream_request(client, path, chunk_size=STREAM_CHUNK_SIZE, metrics=None, deadline=None):
+    """
+    Perform a GET request to ``path`` using the connection pool and headers of ``client``, and
+    yield the response body in chunks of ``chunk_size`` bytes as it is received, rather than
+    reading it all into memory as the client API methods do.
+
+    The request bypasses the client, so it is recorded in ``metrics`` here, if given, and limited
+    by ``deadline`` (a :py:class:`~.es_fieldusage.helpers.client.Deadline`) here, if given. It
+    only has the time left, and raises :py:exc:`~.es_fieldusage.exceptions.TimeoutException` if
+    that runs out before the whole response has been received.
+    """
+    node = client.transport.node_pool.get()
+    if not hasattr(node, 'pool'):
+        raise ConfigurationException(
+            f'Streaming requires the urllib3 HTTP node class, not {type(node).__name__}')
+    # pylint: disable=protected-access
+    headers = dict(client._headers)
+    headers.update(node._headers)
+    headers['accept'] = 'application/json'
+    target = f'{node.path_prefix}{path}'
+    LOGGER.debug('Streaming GET %s', target)
+    kwargs = {}
+    limited = deadline is not None and deadline.expires is not None
+    if limited:
+        # A retry would have no more time than this attempt
+        kwargs['retries'] = False
+        kwargs['timeout'] = urllib3.Timeout(
+            total=deadline.request_timeout(node.config.request_timeout))
+    nbytes = 0
+    start = time.perf_counter()
+    response = None
+    try:
+        response = node.pool.urlopen(
+            'GET', target, headers=headers, preload_content=False, **kwargs)
+        if response.status != 200:
+            raise ResultNotExpected(
+                f'HTTP {response.status} from {target}: {response.data.decode("utf-8", "replace")}')
+        for chunk in response.stream(chunk_size):
+            # The timeout applies to each read, so the time left is checked between them
+            if limited:
+                deadline.request_timeout()
+            nbytes += len(chunk)
+            yield chunk
+    except urllib3.exceptions.TimeoutError as exc:
+        if not limited:
+            raise
+        raise TimeoutException(f'No response within {deadline.seconds} seconds') from exc
+    finally:
+        if response is not None:
+            response.release_conn()
+        if metrics is not None:
+            metrics.add_request(api_name(path), nbytes, time.perf_counter() - start)
+
+def stream_field_usage(
+        client, search_pattern, chunk_size=STREAM_CHUNK_SIZE, metrics=None, deadline=None):
+    """
+    Yield ``(index, shard)`` tuples from the field_usage_stats API for ``search_pattern`` (see
+    :py:func:`stream_request`)
+    """
+    path = f'/{quote(search_pattern, safe=",*")}/_field_usage_stats'
+    return iter_shards(stream_request(
+        client, path, chunk_size=chunk_size, metrics=metrics, deadline=deadline))
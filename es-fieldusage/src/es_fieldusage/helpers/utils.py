@@ -1,26 +1,50 @@
 """Utility helper functions"""
 
+import json
 import logging
+from hashlib import sha256
 from pathlib import Path
 from collections import defaultdict
 from functools import reduce
 from itertools import chain
 from operator import getitem, itemgetter
 import click
-from es_fieldusage.defaults import click_options
+from es_fieldusage.defaults import CLIENT_OPTIONS, MAX_BATCH_LENGTH, click_options
 from es_fieldusage.exceptions import ConfigurationException
 
 LOGGER = logging.getLogger(__name__)
 NOPE = 'DONOTUSE'
 
-def cli_opts(value, onoff=None, override=None):
+def batch_indices(indices, max_count=None, max_length=MAX_BATCH_LENGTH):
+    """
+    Yield lists of index names from ``indices``, in order, with no more than ``max_count`` names
+    per list, and a comma-separated length of no more than ``max_length`` characters, so that
+    each list can be sent as a single API request target.
+    """
+    batch = []
+    length = 0
+    for idx in indices:
+        # Each name after the first adds a comma
+        addition = len(idx) + (1 if batch else 0)
+        if batch and (length + addition > max_length or len(batch) == max_count):
+            yield batch
+            batch = []
+            addition = len(idx)
+            length = 0
+        batch.append(idx)
+        length += addition
+    if batch:
+        yield batch
+
+def cli_opts(value, onoff=None, override=None, options=None):
     """
     In order to make building a Click interface more cleanly, this function returns all Click
     option settings indicated by ``value``, both forming the lone argument (e.g. ``--option``),
     and all key word arguments as a dict.
 
     The single arg is rendered as ``f'--{value}'``. Likewise, ``value`` is the key to extract
-    all keyword args from the supplied dictionary.
+    all keyword args from the supplied dictionary, ``options``, or
+    :py:func:`~.es_fieldusage.defaults.click_options` if not given.
     The facilities to override default values and show hidden values is added here.
     For default value overriding, the NOPE constant is used as None and False are valid default
     values
@@ -34,7 +58,19 @@ def cli_opts(value, onoff=None, override=None):
         except KeyError as exc:
             raise ConfigurationException from exc
     # return (argval,), override_hidden(retval, show=show)
-    return (argval,), override_settings(click_options()[value], override)
+    # A copy, so an override only applies to this one command
+    if options is None:
+        options = click_options()
+    return (argval,), override_settings(dict(options[value]), override)
+
+def client_opts(value, onoff=None, show=False):
+    """
+    Return the Click option settings of the Elasticsearch client option ``value``, as
+    :py:func:`cli_opts` does, from :py:data:`~.es_fieldusage.defaults.CLIENT_OPTIONS`. If the
+    option is hidden by default, ``show`` makes it visible.
+    """
+    return cli_opts(value, onoff=onoff, override={'hidden': False} if show else None,
+        options=CLIENT_OPTIONS)
 
 def convert_mapping(data, new_dict=None):
     """
@@ -64,6 +100,26 @@ def detuple(path):
         return list(path[0])
     return path
 
+def flatten_mapping(data, prefix='', retval=None):
+    """
+    Flatten an Elasticsearch mapping into a single-level dictionary keyed by dotted field path,
+    exactly as the field usage API names fields, in one traversal of the mapping.
+
+    Receive the mapping dict as ``data``
+    Strip out "properties" keys. They are not in the field_usage stats paths.
+    Set the value at the end of each dict path to 0 (we merge counts from field usage later)
+    """
+    if retval is None:
+        retval = {}
+    for key, value in data.items():
+        if isinstance(value, dict):
+            path = f'{prefix}{key}'
+            if 'properties' in value:
+                flatten_mapping(value['properties'], prefix=f'{path}.', retval=retval)
+            else:
+                retval[path] = 0
+    return retval
+
 def get_value_from_path(data, path):
     """
     Return value from dict ``data``. Recreate all keys from list ``path``
@@ -88,6 +144,13 @@ def iterate_paths(data, path=None):
         else:
             yield newpath
 
+def mapping_hash(data):
+    """
+    Return a content hash of mapping ``data``. Key order is preserved (not sorted), so only
+    byte-identical mappings share a hash, and field order in results is unaffected.
+    """
+    return sha256(json.dumps(data, separators=(',', ':')).encode('utf-8')).hexdigest()
+
 def option_wrapper():
     """Return the click decorator passthrough function"""
     return passthrough(click.option)
@@ -99,6 +162,14 @@ def output_report(search_pattern, report):
     click.secho('\nSearch Pattern: ', nl=False)
     # Search Pattern
     click.secho(search_pattern, bold=True) 
+    # Clusters, when reporting on several at once
+    if 'clusters' in report:
+        click.secho(f'{len(report["clusters"])} ', bold=True, nl=False)
+        click.secho('Clusters: ', nl=False)
+        click.secho(', '.join(report['clusters']), bold=True)
+    if 'failed_clusters' in report:
+        click.secho('Clusters Failed: ', nl=False)
+        click.secho(', '.join(report['failed_clusters']), bold=True, fg='red')
     # Indices Found
     if not isinstance(report['indices'], list):
         click.secho('Index Found: ', nl=False)
@@ -110,15 +181,42 @@ def output_report(search_pattern, report):
             click.secho('(data too big)', bold=True)
         else:
             click.secho(f'{report["indices"]}', bold=True)
+    # Usage since snapshot
+    if 'since' in report:
+        click.secho('Usage Since Snapshot: ', nl=False)
+        click.secho(report['since'], bold=True)
     # Total Fields
     click.secho('Total Fields Found: ', nl=False)
     click.secho(report['field_count'], bold=True)
     # Accessed Fields
     click.secho('Accessed Fields: ', nl=False)
-    click.secho(len(report['accessed'].keys()), bold=True)
+    click.secho(report['accessed_count'], bold=True)
     # Unaccessed Fields
     click.secho('Unaccessed Fields: ', nl=False)
-    click.secho(len(report['unaccessed'].keys()), bold=True)
+    click.secho(report['unaccessed_count'], bold=True)
+
+def output_profile(metrics):
+    """
+    Output a breakdown of the time spent in each phase, slowest first, the requests made to each
+    API, and the counters in ``metrics`` to stderr, so it never mixes with output on stdout
+    """
+    data = metrics.as_dict()
+    elapsed = data['elapsed']
+    click.secho('\nProfile', overline=True, underline=True, bold=True, err=True)
+    click.secho(f'\nElapsed: {elapsed:.3f}s', err=True)
+    lines = [f'\n{"Phase":<24} {"Calls":>8} {"Seconds":>10} {"%":>6}']
+    phases = sorted(data['phases'].items(), key=lambda item: -item[1]['seconds'])
+    for name, value in phases:
+        share = 100 * value['seconds'] / elapsed if elapsed else 0
+        lines.append(f'{name:<24} {value["calls"]:>8} {value["seconds"]:>10.3f} {share:>6.1f}')
+    lines.append(f'\n{"API":<24} {"Requests":>8} {"Seconds":>10} {"Bytes":>14}')
+    for name, value in sorted(data['apis'].items()):
+        lines.append(
+            f'{name:<24} {value["requests"]:>8} {value["seconds"]:>10.3f} {value["bytes"]:>14}')
+    lines.append(f'\n{"Counter":<24} {"Value":>8}')
+    for name, value in sorted(data['counters'].items()):
+        lines.append(f'{name:<24} {value:>8}')
+    click.echo('\n'.join(lines), err=True)
 
 def override_settings(data, new_data):
     """Override keys in data with values matching in new_data"""
@@ -133,6 +231,15 @@ def passthrough(func):
     """Wrapper to make it easy to store click configuration elsewhere"""
     return lambda a, k: func(*a, **k)
 
+def tracking_signature(shards):
+    """
+    Return a short signature of the usage tracking ids and start times of ``shards`` (from the
+    field_usage_stats API). It changes whenever any shard's usage counts restart from zero.
+    """
+    ids = sorted(
+        f'{shard.get("tracking_id")}@{shard.get("tracking_started_at_millis")}' for shard in shards)
+    return sha256('|'.join(ids).encode('utf-8')).hexdigest()[:16]
+
 def sort_by_name(data):
     """Sort dictionary by key alphabetically"""
     return dict(sorted(data.items(), key=itemgetter(0)))
@@ -0,0 +1,54 @@
+"""Output file writer functions"""
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+LOGGER = logging.getLogger(__name__)
+
+def get_umask():
+    """Return the current umask, which can only be read by setting it"""
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+def write_atomic(filename, dump, mode=0o644):
+    """
+    Call ``dump(fdesc)`` to write the contents of ``filename`` to binary file ``fdesc``, which is a
+    buffered temporary file in the same directory, then rename it over ``filename``, so a reader
+    never sees a partly written file.
+    """
+    dirname = os.path.dirname(os.path.abspath(filename))
+    fdesc, tmpname = tempfile.mkstemp(prefix=f'.{os.path.basename(filename)}.', dir=dirname)
+    try:
+        with os.fdopen(fdesc, 'wb') as tmpfile:
+            dump(tmpfile)
+        # mkstemp creates the file readable only by its owner
+        os.chmod(tmpname, mode)
+        os.replace(tmpname, filename)
+    except BaseException:
+        os.unlink(tmpname)
+        raise
+
+def write_files(jobs, workers=1):
+    """
+    Write each of ``jobs``, a list of ``(filename, dump)`` tuples, where ``dump(fdesc)`` writes the
+    entire contents of ``filename`` to binary file ``fdesc``. Files are written atomically by
+    :py:func:`write_atomic` in a pool of ``workers`` threads, so that the writes of many files
+    overlap.
+
+    :returns: The filenames written, in the same order as ``jobs``
+    :rtype: list
+    """
+    mode = 0o666 & ~get_umask()
+
+    def write(job):
+        filename, dump = job
+        write_atomic(filename, dump, mode=mode)
+        return filename
+
+    if workers < 2 or len(jobs) < 2:
+        return [write(job) for job in jobs]
+    LOGGER.debug('Writing %s files with %s workers', len(jobs), workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(write, jobs))
@@ -1,27 +1,95 @@
 """Main app definition"""
 # pylint: disable=broad-exception-caught
+import os
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from math import ceil
 from es_client.helpers.utils import prune_nones
+from es_fieldusage.helpers.batches import fetch_batches
+from es_fieldusage.helpers.cache import MappingCache
+from es_fieldusage.helpers.metrics import Metrics, instrument
+from es_fieldusage.helpers.report import per_index_summary, summary_report
 from es_fieldusage.helpers.client import get_client
+from es_fieldusage.helpers.filters import FieldFilter
+from es_fieldusage.helpers import snapshot as snapshots
+from es_fieldusage.helpers import stream as streaming
+from es_fieldusage.helpers.store import FieldCounts, FieldVocabulary, UsageStore
 from es_fieldusage.helpers import utils
-from es_fieldusage.exceptions import ResultNotExpected, ValueMismatch
+from es_fieldusage.exceptions import FieldUsageException, ResultNotExpected, ValueMismatch
 
 class FieldUsage:
-    """It's the main class"""
+    """
+    It's the main class
 
-    def __init__(self, client_args, other_args, search_pattern):
+    ``mapping_cache`` is a cache filename, or a
+    :py:class:`~.es_fieldusage.helpers.cache.MappingCache` shared between objects. If ``client`` is
+    given, it is used instead of connecting with ``client_args`` and ``other_args``, and the
+    requests it makes are not recorded in ``self.metrics``.
+
+    With ``rollup``, the usage of each backing index is summed into its data stream, and of each
+    other index into its alias, if it has one, and reported under that name (see
+    :py:meth:`roll_up`).
+
+    Only the fields matching any of the ``include`` patterns, if given, and none of the
+    ``exclude`` patterns are counted and reported (see
+    :py:class:`~.es_fieldusage.helpers.filters.FieldFilter`).
+
+    With a ``deadline`` (a :py:class:`~.es_fieldusage.helpers.client.Deadline`), each request
+    only has the time left before it, and none is made after it.
+    """
+
+    # pylint: disable=too-many-arguments,too-many-locals
+    def __init__(
+        self, client_args, other_args, search_pattern, workers=1, stream=False, batch_size=None,
+        concurrency=1, retries=2, snapshot=None, mapping_cache=None, client=None, rollup=False,
+        include=None, exclude=None, deadline=None):
         self.logger = logging.getLogger(__name__)
-        self.client = get_client(configdict={
-            'elasticsearch': {
-                'client': prune_nones(client_args.asdict()),
-                'other_settings': prune_nones(other_args.asdict())
-            }
-        })
-        self.usage_stats = {}
+        # Phase timers and counters, and the requests made to each API
+        self.metrics = Metrics()
+        if client is not None:
+            self.client = client
+        else:
+            with self.metrics.timer('connect'):
+                self.client = instrument(get_client(configdict={
+                    'elasticsearch': {
+                        'client': prune_nones(client_args.asdict()),
+                        'other_settings': prune_nones(other_args.asdict())
+                    }
+                }), self.metrics)
+        #: Attribute. The time limit on requests, if any, which streamed requests also observe
+        self.deadline = deadline
+        if deadline is not None:
+            deadline.limit(self.client)
+        self.search_pattern = search_pattern
+        self.workers = workers
+        self.stream = stream
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.retries = retries
+        self.snapshot = snapshot
+        self.snapshot_time = None
+        self.rollup = rollup
+        #: Attribute. Data stream or alias -> the names of the indices rolled up into it
+        self.rollup_members = {}
+        self.reset_indices = []
+        self.field_filter = FieldFilter(include, exclude)
+        # Field names are interned once in a shared vocabulary, and counts kept in compact arrays
+        self.vocab = FieldVocabulary()
+        self.usage_stats = UsageStore(self.vocab)
+        self.mapping_hashes = {}
+        self.leaf_cache = {}
+        # Mapping hash -> the leaf fields kept by self.field_filter, if it filters any out
+        self.kept_leaf_cache = {}
+        # Flattened mappings persisted between runs, if a cache file is given
+        if isinstance(mapping_cache, MappingCache):
+            self.mapping_cache = mapping_cache
+        else:
+            self.mapping_cache = MappingCache(mapping_cache) if mapping_cache else None
         self.indices_data = []
-        self.per_index_data = {}
+        self.per_index_data = UsageStore(self.vocab)
         self.results_data = {}
-        self.report_data = {}
+        self.report_data = None
         self.per_index_report_data = {}
         self.get(search_pattern)
 
@@ -29,48 +97,407 @@ class FieldUsage:
         """
         Get ``raw_data`` from the field_usage_stats API for all indices in ``search_pattern``
         Iterate over ``raw_data`` to build ``self.usage_stats``
+
+        If ``self.batch_size`` is set, ``search_pattern`` is first resolved to concrete indices,
+        which are fetched in batches of no more than ``self.batch_size`` indices each.
+
+        If ``self.snapshot`` is set, ``self.usage_stats`` will only contain the usage since then.
+        If ``self.rollup`` is set, it is then rolled up by data stream and alias.
         """
         try:
-            field_usage = self.client.indices.field_usage_stats(index=search_pattern)
+            if self.batch_size:
+                self.get_batched(search_pattern)
+            else:
+                self.usage_stats.merge(self.fetch_usage(search_pattern))
+        except FieldUsageException:
+            raise
         except Exception as exc:
             raise ResultNotExpected(f'Unable to get field usage: {exc}') from exc
-        for index in list(field_usage.keys()):
-            if index == '_shards':
-                # Ignore this key as it is "global"
-                continue
-            self.usage_stats[index] = self.sum_index_stats(field_usage, index)
+        self.metrics.count('indices', len(self.usage_stats))
+        if self.snapshot:
+            with self.metrics.timer('snapshot'):
+                self.apply_snapshot()
+        if self.rollup:
+            self.roll_up(search_pattern)
+
+    def resolve_groups(self, search_pattern):
+        """
+        Return the data stream each backing index in ``search_pattern`` belongs to, and the alias
+        each other index belongs to, from a single resolve_index API call. An index with several
+        aliases belongs to the first, by name.
+
+        :returns: Index name -> data stream or alias name
+        :rtype: dict
+        """
+        with self.metrics.timer('resolve_index'):
+            resolved = self.client.indices.resolve_index(name=search_pattern)
+        groups = {}
+        for alias in sorted(resolved.get('aliases', []), key=lambda item: item['name']):
+            for idx in alias.get('indices', []):
+                groups.setdefault(idx, alias['name'])
+        for item in resolved.get('indices', []):
+            if item.get('aliases'):
+                groups.setdefault(item['name'], min(item['aliases']))
+        # A data stream's backing indices always roll up into the data stream
+        for stream in resolved.get('data_streams', []):
+            for idx in stream.get('backing_indices', []):
+                groups[idx] = stream['name']
+        for item in resolved.get('indices', []):
+            if item.get('data_stream'):
+                groups[item['name']] = item['data_stream']
+        return groups
+
+    def roll_up(self, search_pattern):
+        """
+        Replace the usage stats of the indices in each data stream or alias (see
+        :py:meth:`resolve_groups`) with one entry for the data stream or alias, with the counts
+        of each field summed across its indices. Indices in neither are left as they are.
+
+        The mappings are still read per index, and the fields of a data stream or alias are those
+        in the mapping of any of its indices, but each distinct mapping is only flattened once.
+        """
+        groups = self.resolve_groups(search_pattern)
+        members = {}
+        for idx in self.usage_stats:
+            members.setdefault(groups.get(idx, idx), []).append(idx)
+        rolled = UsageStore(self.vocab)
+        with self.metrics.timer('rollup'):
+            for group, names in members.items():
+                if names == [group]:
+                    rolled[group] = self.usage_stats[group]
+                    continue
+                subset = UsageStore(self.vocab)
+                subset.columns = {idx: self.usage_stats.columns[idx] for idx in names}
+                rolled[group] = subset.totals()
+                self.rollup_members[group] = names
+        self.logger.debug(
+            'Rolled %s indices up into %s data streams, aliases or indices',
+            len(self.usage_stats), len(rolled))
+        self.metrics.count('rolled_up_indices', sum(map(len, self.rollup_members.values())))
+        self.usage_stats = rolled
+
+    def apply_snapshot(self):
+        """
+        If the snapshot file ``self.snapshot`` exists, replace ``self.usage_stats`` with the change
+        in usage since it was taken. Then save the current usage as the new snapshot.
+
+        A snapshot taken with other field filters did not count the same fields, so every count is
+        taken to be new, as if every shard had been reset since.
+        """
+        current = self.usage_stats
+        now = datetime.now(timezone.utc).isoformat()
+        filters = self.field_filter.patterns
+        if os.path.isfile(self.snapshot):
+            previous, self.snapshot_time, snapshot_filters = snapshots.load_snapshot(self.snapshot)
+            self.logger.info('Reporting field usage since snapshot at %s', self.snapshot_time)
+            if snapshot_filters != filters:
+                self.logger.warning(
+                    'The snapshot was taken with field filters %s, not %s. Counting all usage as '
+                    'since the snapshot', snapshot_filters, filters)
+                self.reset_indices = list(current)
+            else:
+                self.usage_stats, self.reset_indices = snapshots.diff(current, previous)
+                if self.reset_indices:
+                    self.logger.warning(
+                        'Shard usage counters were reset since the snapshot for %s indices. '
+                        'Their usage is counted from the reset: %s',
+                        len(self.reset_indices), self.reset_indices)
+        snapshots.save_snapshot(self.snapshot, current, now, filters)
+
+    def get_batched(self, search_pattern):
+        """
+        Resolve ``search_pattern`` to concrete indices, and split them into batches of no more than
+        ``self.batch_size`` indices. Fetch up to ``self.concurrency`` batches at a time, retrying
+        each failed batch up to ``self.retries`` times, and merge them into ``self.usage_stats``
+        """
+        indices = self.resolve_indices(search_pattern)
+        batches = list(utils.batch_indices(indices, max_count=self.batch_size))
+        self.logger.debug(
+            'Fetching field usage for %s indices in %s batches', len(indices), len(batches))
+        results = fetch_batches(
+            self.fetch_usage, batches, concurrency=self.concurrency, retries=self.retries)
+        for usage in results:
+            self.usage_stats.merge(usage)
+
+    def fetch_usage(self, index):
+        """
+        Return the usage stats for each index in ``index`` (an index name, pattern, or
+        comma-separated list), summed across all shards
+        """
+        if self.stream:
+            return self.fetch_usage_streaming(index)
+        with self.metrics.timer('field_usage_stats'):
+            field_usage = self.client.indices.field_usage_stats(index=index)
+        retval = UsageStore(self.vocab)
+        with self.metrics.timer('aggregate'):
+            for idx in list(field_usage.keys()):
+                if idx == '_shards':
+                    # Ignore this key as it is "global"
+                    continue
+                retval[idx] = self.sum_index_stats(field_usage, idx)
+                retval.tracking[idx] = utils.tracking_signature(field_usage[idx]['shards'])
+        return retval
+
+    def fetch_usage_streaming(self, index):
+        """
+        Stream the field_usage_stats API response for ``index``, and fold each shard into the
+        per-index usage stats as it arrives, so the raw response is never held in memory all at
+        once. Shards arrive grouped by index, so each index is stored compactly when its last shard
+        has been added.
+
+        The time spent receiving and parsing the response is timed as ``field_usage_stats``, and
+        only the time spent adding each shard as ``aggregate``.
+        """
+        retval = UsageStore(self.vocab)
+        current, result, tracked = None, {}, []
+        shards = 0
+        timer = self.metrics.timer
+        with timer('field_usage_stats'):
+            for idx, shard in streaming.stream_field_usage(
+                    self.client, index, metrics=self.metrics, deadline=self.deadline):
+                with timer('aggregate'):
+                    if idx != current:
+                        if current is not None:
+                            retval[current] = result
+                            retval.tracking[current] = utils.tracking_signature(tracked)
+                        current, result, tracked = idx, {}, []
+                    if shard is not None:
+                        shards += 1
+                        self.add_shard_stats(result, shard)
+                        tracked.append({
+                            'tracking_id': shard.get('tracking_id'),
+                            'tracking_started_at_millis': shard.get('tracking_started_at_millis'),
+                        })
+        if current is not None:
+            retval[current] = result
+            retval.tracking[current] = utils.tracking_signature(tracked)
+        self.metrics.count('shards', shards)
+        return retval
+
+    def resolve_indices(self, search_pattern):
+        """Return a sorted list of the concrete indices matching ``search_pattern``"""
+        with self.metrics.timer('resolve_indices'):
+            cat = self.client.cat.indices(index=search_pattern, h='index', format='json')
+        return sorted(item['index'] for item in cat)
 
     def get_field_mappings(self, idx):
         """Return only the field mappings for index ``idx`` (not the entire index mapping)"""
-        return self.client.indices.get_mapping(index=idx)[idx]['mappings']['properties']
+        with self.metrics.timer('get_mapping'):
+            mappings = self.client.indices.get_mapping(index=idx)
+        self.metrics.count('mappings_fetched')
+        return mappings[idx]['mappings'].get('properties', {})
+
+    def cache_leaves(self, idx, properties):
+        """
+        Hash the field mappings ``properties`` of ``idx`` and flatten them to leaf fields, unless a
+        byte-identical mapping has already been flattened, in which case that is reused.
+
+        :returns: The mapping hash
+        :rtype: str
+        """
+        with self.metrics.timer('flatten_mapping'):
+            digest = utils.mapping_hash(properties)
+            self.mapping_hashes[idx] = digest
+            if digest not in self.leaf_cache:
+                self.leaf_cache[digest] = utils.flatten_mapping(properties)
+                self.metrics.count('mappings_flattened')
+        return digest
+
+    def kept_leaves(self, digest):
+        """
+        Return the flattened leaf fields of the mapping with hash ``digest`` which
+        ``self.field_filter`` keeps. Each distinct mapping is only filtered once, and the mapping
+        cache keeps every leaf field, so it can be shared by runs with different filters.
+        """
+        if not self.field_filter.active:
+            return self.leaf_cache[digest]
+        if digest not in self.kept_leaf_cache:
+            with self.metrics.timer('filter_fields'):
+                self.kept_leaf_cache[digest] = self.field_filter.leaves(self.leaf_cache[digest])
+        return self.kept_leaf_cache[digest]
+
+    def get_mapping_versions(self, index):
+        """
+        Return a cache key for the current mapping of each index in ``index``: its name, UUID and
+        mapping version, which Elasticsearch increments whenever the mapping changes. The cluster
+        state request is filtered to only these values, so it is tiny compared to the mappings.
+
+        :returns: Index name -> key, or an empty dictionary if the versions could not be read
+        :rtype: dict
+        """
+        try:
+            with self.metrics.timer('mapping_versions'):
+                state = self.client.cluster.state(
+                    metric='metadata', index=index, filter_path=[
+                        'metadata.indices.*.mapping_version',
+                        'metadata.indices.*.settings.index.uuid',
+                    ])
+            indices = state.get('metadata', {}).get('indices', {})
+            return {
+                idx: f'{idx}/{meta["settings"]["index"]["uuid"]}/{meta["mapping_version"]}'
+                for idx, meta in indices.items()
+            }
+        except Exception as exc:
+            self.logger.warning('Unable to read mapping versions, so not using the cache: %s', exc)
+            return {}
+
+    def fetch_mappings(self, index, versions=None):
+        """
+        Get the mappings for all indices in ``index`` in a single API call, cache the flattened
+        leaf fields once per distinct mapping, and add them to ``self.mapping_cache`` under their
+        key in ``versions``, if present
+        """
+        try:
+            with self.metrics.timer('get_mapping'):
+                mappings = self.client.indices.get_mapping(index=index)
+        except Exception as exc:
+            raise ResultNotExpected(f'Unable to get index mappings: {exc}') from exc
+        self.metrics.count('mappings_fetched', len(mappings))
+        for idx, value in mappings.items():
+            digest = self.cache_leaves(idx, value['mappings'].get('properties', {}))
+            if versions and idx in versions:
+                self.mapping_cache.put(versions[idx], digest, self.leaf_cache[digest])
+        return len(mappings)
+
+    def get_mappings(self, index=None):
+        """
+        Get the mappings for all indices in ``index`` (default: ``self.search_pattern``) in a single
+        API call, and cache the flattened leaf fields once per distinct mapping
+
+        With ``self.mapping_cache``, only the mapping versions are requested for ``index``, and only
+        the mappings which are not already in the cache at their current version are fetched.
+        """
+        if index is None:
+            index = self.search_pattern
+        versions = self.get_mapping_versions(index) if self.mapping_cache is not None else {}
+        if not versions:
+            count = self.fetch_mappings(index)
+            self.logger.debug(
+                '%s distinct mapping(s) found for %s indices', len(self.leaf_cache), count)
+            return
+        missing = []
+        with self.metrics.timer('mapping_cache'):
+            for idx, key in versions.items():
+                cached = self.mapping_cache.get(key)
+                if cached is None:
+                    missing.append(idx)
+                    continue
+                digest, leaves = cached
+                self.mapping_hashes[idx] = digest
+                if digest not in self.leaf_cache:
+                    self.leaf_cache[digest] = dict.fromkeys(leaves, 0)
+        self.logger.debug(
+            '%s of %s index mappings found in the cache', len(versions) - len(missing),
+            len(versions))
+        self.metrics.count('mapping_cache_hits', len(versions) - len(missing))
+        self.metrics.count('mapping_cache_misses', len(missing))
+        for batch in utils.batch_indices(sorted(missing)):
+            self.fetch_mappings(','.join(batch), versions=versions)
+
+    def mapping_digests(self, idx):
+        """
+        Return the set of mapping hashes of ``idx``, or of every index rolled up into it, fetching
+        any mapping which is not known yet
+        """
+        digests = set()
+        for name in self.rollup_members.get(idx, [idx]):
+            if name not in self.mapping_hashes:
+                # The index was not in the bulk response, e.g. it was created since
+                self.cache_leaves(name, self.get_field_mappings(name))
+            digests.add(self.mapping_hashes[name])
+        return digests
+
+    def get_field_leaves(self, idx):
+        """
+        Return a new dictionary of the flattened leaf fields in the mapping of ``idx``, or in the
+        mapping of any index rolled up into it
+        """
+        if not self.mapping_hashes:
+            self.get_mappings()
+        digests = self.mapping_digests(idx)
+        if len(digests) == 1:
+            return dict(self.kept_leaves(digests.pop()))
+        leaves = {}
+        for digest in sorted(digests):
+            leaves.update(self.kept_leaves(digest))
+        return leaves
+
+    def save_mapping_cache(self):
+        """Save ``self.mapping_cache``, if there is one"""
+        if self.mapping_cache is not None:
+            with self.metrics.timer('mapping_cache'):
+                self.mapping_cache.save()
+
+    def field_leaf_ids(self):
+        """
+        Return the set of ids of the leaf fields in the mapping of any index in
+        ``self.usage_stats``. Each distinct mapping is only visited once.
+        """
+        if not self.mapping_hashes:
+            self.get_mappings()
+        digests = set()
+        for idx in self.usage_stats:
+            digests.update(self.mapping_digests(idx))
+        self.save_mapping_cache()
+        found = set()
+        with self.metrics.timer('field_ids'):
+            for digest in digests:
+                found.update(map(self.vocab.get_id, self.kept_leaves(digest)))
+        return found
+
+    def all_field_ids(self):
+        """Return the set of ids of every field in any index mapping, or with any usage stats"""
+        return self.field_leaf_ids() | self.usage_stats.field_ids()
+
+    def field_count(self):
+        """Return the number of fields in any index mapping, or with any usage stats"""
+        return len(self.all_field_ids())
+
+    def accessed_count(self):
+        """Return the number of fields accessed in any index"""
+        return len(self.usage_stats.field_ids(accessed=True))
+
+    def accessed_fields(self):
+        """
+        Return the fields accessed in any index, with their counts summed across all indices, in
+        descending order of count. Only fields with usage stats can have been accessed, so this
+        needs no mappings, and no per-index results.
+        """
+        with self.metrics.timer('totals'):
+            return self.usage_stats.totals().accessed()
+
+    def unaccessed_fields(self):
+        """
+        Return the fields in any index mapping, or with usage stats, which were not accessed in any
+        index, sorted by name, each with a count of zero. This needs no per-index results.
+        """
+        unaccessed = self.all_field_ids() - self.usage_stats.field_ids(accessed=True)
+        with self.metrics.timer('sort'):
+            names = sorted(map(self.vocab.names.__getitem__, unaccessed))
+            return FieldCounts.from_items(self.vocab, ((name, 0) for name in names))
 
     def populate_values(self, idx, data):
         """Now add the field usage values for idx to data and return the result"""
-        for field in list(self.usage_stats[idx].keys()):
-            if '.' in field:
-                path = tuple(field.split('.'))
-            else:
-                path = field
-            data[path] = self.usage_stats[idx][field]
+        data.update(self.usage_stats[idx].items())
         return data
 
     def get_resultset(self, idx):
         """Populate a result set with the fields in the index mapping"""
         result = {}
         if idx in self.usage_stats:
-            allfields = utils.convert_mapping(self.get_field_mappings(idx))
-            result = self.populate_values(idx, allfields)
+            with self.metrics.timer('merge'):
+                allfields = self.get_field_leaves(idx)
+                result = self.populate_values(idx, allfields)
         return result
 
     def merge_results(self, idx):
-        """Merge field usage data with index mapping"""
-        retval = {}
-        data = self.get_resultset(idx)
-        for path in utils.iterate_paths(data):
-            value = utils.get_value_from_path(data, path)
-            key = '.'.join(utils.detuple(path))
-            retval[key] = value
-        return retval
+        """
+        Merge field usage data with index mapping
+
+        The mapping is flattened to dotted field paths in a single pass, so the usage counts are
+        joined directly, with no need to walk nested paths back out again.
+        """
+        return self.get_resultset(idx)
 
     def verify_single_index(self, index=None):
         """
@@ -93,63 +520,95 @@ class FieldUsage:
 
     @property
     def per_index_report(self):
-        """Generate summary report data"""
+        """
+        Generate per-index summary report data. The accessed and unaccessed fields for each index
+        are views over the results stored in ``self.per_index_data``, not copies.
+        """
         if not self.per_index_report_data:
-            self.report_data['indices'] = self.indices
-            self.report_data['field_count'] = len(self.results.keys())
-            for idx in list(self.results_by_index.keys()):
-                self.per_index_report_data[idx] = {}
-                self.per_index_report_data[idx]['accessed'] = {}
-                self.per_index_report_data[idx]['unaccessed'] = {}
-                for key, value in self.results_by_index[idx].items():
-                    if value == 0:
-                        self.per_index_report_data[idx]['unaccessed'][key] = value
-                    else:
-                        self.per_index_report_data[idx]['accessed'][key] = value
+            self.per_index_report_data = per_index_summary(self.results_by_index)
         return self.per_index_report_data
 
     @property
     def report(self):
-        """Generate summary report data"""
-        if not self.report_data:
-            self.report_data['indices'] = self.indices
-            self.report_data['field_count'] = len(self.results.keys())
-            self.report_data['accessed'] = {}
-            self.report_data['unaccessed'] = {}
-            for key, value in self.results.items():
-                if value == 0:
-                    self.report_data['unaccessed'][key] = value
-                else:
-                    self.report_data['accessed'][key] = value
+        """
+        Generate summary report data (see
+        :py:func:`~.es_fieldusage.helpers.report.summary_report`). Each section is only computed
+        when it is first read, and none of them need the per-index results:
+
+        * ``accessed`` and ``unaccessed``: :py:meth:`accessed_fields` and
+          :py:meth:`unaccessed_fields`
+        * ``accessed_count`` and ``unaccessed_count``: their lengths, found without sorting
+        * ``field_count``: the total of both
+        """
+        if self.report_data is None:
+            extra = {}
+            if self.snapshot_time:
+                extra['since'] = lambda: self.snapshot_time
+            self.report_data = summary_report(self, **extra)
         return self.report_data
 
     def result(self, idx=None):
         """Return a single index result as a dictionary"""
         idx = self.verify_single_index(index=idx)
-        return utils.sort_by_value(self.merge_results(idx))
+        result = self.merge_results(idx)
+        with self.metrics.timer('sort'):
+            return utils.sort_by_value(result)
+
+    def result_batch(self, batch):
+        """
+        Get the mappings for the indices in list ``batch`` in a single API call, then return a list
+        of ``(index, result)`` tuples for each index in ``batch``
+        """
+        self.get_mappings(index=','.join(batch))
+        return [(idx, self.result(idx=idx)) for idx in batch]
+
+    def concurrent_results(self, idx_list):
+        """
+        Split ``idx_list`` into batches and compute the result for each batch in a pool of
+        ``self.workers`` threads, so the mapping fetches and merges for many indices overlap.
+        Results are collected in ``idx_list`` order, regardless of which batch finishes first.
+        """
+        # A few batches per worker keeps the pool busy if some batches are slower than others
+        max_count = ceil(len(idx_list) / (self.workers * 4))
+        batches = list(utils.batch_indices(idx_list, max_count=max_count))
+        self.logger.debug('Computing %s batches with %s workers', len(batches), self.workers)
+        retval = UsageStore(self.vocab)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for batch_result in executor.map(self.result_batch, batches):
+                retval.update(batch_result)
+        return retval
 
     @property
     def results_by_index(self):
         """
-        Return all results as a dictionary, with the index name as the root key, and all stats for
-        that index as the value, which is a dictionary generated by ``self.result()``.
+        Return all results as a dictionary-like
+        :py:class:`~.es_fieldusage.helpers.store.UsageStore`, with the index name as the root key,
+        and all stats for that index as the value, which is a compact view of the dictionary
+        generated by ``self.result()``.
         """
         if not self.per_index_data:
             if not isinstance(self.indices, list):
                 idx_list = [self.indices]
             else:
                 idx_list = self.indices
-            for idx in idx_list:
-                self.per_index_data[idx] = self.result(idx=idx)
+            if self.workers > 1 and len(idx_list) > 1:
+                self.per_index_data = self.concurrent_results(idx_list)
+            else:
+                for idx in idx_list:
+                    self.per_index_data[idx] = self.result(idx=idx)
+            self.save_mapping_cache()
         return self.per_index_data
 
     @property
     def results(self):
-        """Return results for all indices found with values summed per mapping leaf"""
-        # The summing re-orders things so it needs to be re-sorted
+        """
+        Return results for all indices found with values summed per mapping leaf, as a compact,
+        dictionary-like :py:class:`~.es_fieldusage.helpers.store.FieldCounts` view
+        """
         if not self.results_data:
-            self.results_data = dict(
-                utils.sort_by_value(utils.sum_dict_values(self.results_by_index)))
+            results_by_index = self.results_by_index
+            with self.metrics.timer('totals'):
+                self.results_data = results_by_index.totals()
         return self.results_data
 
     @property
@@ -161,19 +620,22 @@ class FieldUsage:
             return self.indices_data[0]
         return self.indices_data
 
+    def add_shard_stats(self, result, shard):
+        """Add the usage stats of each field in ``shard`` to ``result``, unless filtered out"""
+        # Each field name is only matched once, then looked up in the filter's decisions
+        decisions = self.field_filter.decisions
+        for field, stats in shard['stats']['fields'].items():
+            keep = decisions.get(field)
+            if keep is None:
+                keep = self.field_filter(field)
+            if keep:
+                result[field] = result.get(field, 0) + stats['any']
+        return result
+
     def sum_index_stats(self, field_usage, idx):
         """Per field, sum all of the usage stats for all shards in ``idx``"""
-        def appender(result, field, value):
-            if not field in result:
-                result[field] = value
-            else:
-                result[field] += value
-            return result
         result = {}
         for shard in field_usage[idx]['shards']:
-            for field in list(shard['stats']['fields'].keys()):
-                if field in ['_id', '_source']:
-                    # We don't care about these because these can be used by runtime queries
-                    continue
-                result = appender(result, field, shard['stats']['fields'][field]['any'])
+            self.add_shard_stats(result, shard)
+        self.metrics.count('shards', len(field_usage[idx]['shards']))
         return result
@@ -0,0 +1,243 @@
+"""Field usage across several clusters at once"""
+# pylint: disable=broad-exception-caught
+import logging
+import os
+import threading
+from concurrent import futures
+from es_client.helpers.utils import prune_nones
+from es_fieldusage.exceptions import ResultNotExpected, TimeoutException
+from es_fieldusage.helpers.cache import MappingCache
+from es_fieldusage.helpers.client import Deadline, get_client
+from es_fieldusage.helpers.metrics import Metrics, instrument
+from es_fieldusage.helpers.report import per_index_summary, summary_report
+from es_fieldusage.helpers.store import FieldCounts, UsageStore
+from es_fieldusage.main import FieldUsage
+
+LOGGER = logging.getLogger(__name__)
+
+def cluster_index(cluster, idx):
+    """Return the name of index ``idx`` in ``cluster``, as in cross-cluster search"""
+    return f'{cluster}:{idx}'
+
+def cluster_snapshot(snapshot, cluster):
+    """Return the snapshot filename for ``cluster``: ``snapshot``, with the cluster name added"""
+    root, ext = os.path.splitext(snapshot)
+    return f'{root}-{cluster}{ext}'
+
+class MultiFieldUsage:
+    """
+    Field usage for ``search_pattern`` in several clusters at once
+
+    ``clusters`` maps each cluster name to a ``(client_args, other_args, timeout)`` tuple (see
+    :py:func:`~.es_fieldusage.helpers.client.get_clusters`). Each cluster is read by its own
+    :py:class:`~.es_fieldusage.main.FieldUsage` object, in its own daemon thread, for up to its
+    ``timeout`` seconds, or ``timeout`` if it has none: each request only has the time left, and
+    a cluster which runs out of time is abandoned, so it cannot keep the process from exiting. A
+    cluster which fails or runs out of time is logged, and left out of the results. Only if every
+    cluster fails is an exception raised.
+
+    In :py:attr:`results_by_index` and :py:attr:`per_index_report`, each index is named
+    ``cluster:index``. They are only computed when first read, after every cluster's usage stats
+    and mappings have been fetched. :py:attr:`results` and :py:attr:`report` sum each field across
+    all clusters, and the report needs no per-index results.
+
+    :py:attr:`client`, for indexing the results, connects with ``client_args`` and
+    ``other_args``. A ``snapshot`` file is kept per cluster. ``kwargs`` are passed to each
+    FieldUsage object.
+    """
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self, clusters, search_pattern, timeout=None, client_args=None, other_args=None,
+        snapshot=None, mapping_cache=None, **kwargs):
+        self.metrics = Metrics()
+        self.search_pattern = search_pattern
+        self.client_args = client_args
+        self.other_args = other_args
+        self.client_data = None
+        #: Attribute. Cluster name -> FieldUsage object, for each cluster which returned results
+        self.field_usage = {}
+        #: Attribute. Cluster name -> error message, for each cluster which did not
+        self.failed = {}
+        # The usage stats of every cluster, keyed by cluster:index
+        self.usage_stats = UsageStore()
+        self.per_index_data = UsageStore(self.usage_stats.vocab)
+        self.per_index_report_data = {}
+        self.field_names_data = None
+        self.results_data = None
+        self.report_data = None
+        # One cache for every cluster, so they do not overwrite each other's cache file
+        if mapping_cache and not isinstance(mapping_cache, MappingCache):
+            mapping_cache = MappingCache(mapping_cache)
+        with self.metrics.timer('clusters'):
+            self.fetch(clusters, timeout, snapshot, dict(kwargs, mapping_cache=mapping_cache))
+
+    def cluster_results(self, client_args, other_args, kwargs):
+        """
+        Return a FieldUsage object for one cluster, once it has the usage stats and mappings of
+        every index. Only these need requests to the cluster: the per-index results are merged
+        from them if they are read.
+        """
+        field_usage = FieldUsage(client_args, other_args, self.search_pattern, **kwargs)
+        field_usage.field_leaf_ids()
+        return field_usage
+
+    def run_cluster(self, future, client_args, other_args, kwargs):
+        """Set the result of ``future`` to that of :py:meth:`cluster_results`, or its exception"""
+        try:
+            future.set_result(self.cluster_results(client_args, other_args, kwargs))
+        except Exception as exc:
+            future.set_exception(exc)
+
+    def fetch(self, clusters, timeout, snapshot, kwargs):
+        """
+        Get the usage stats of all ``clusters`` concurrently, each in a daemon thread, and add
+        each one's to ``self.usage_stats`` as it finishes, or record why it failed in
+        ``self.failed``
+        """
+        pending = {}
+        for name, (client_args, other_args, cluster_timeout) in clusters.items():
+            limit = timeout if cluster_timeout is None else cluster_timeout
+            cluster_kwargs = dict(kwargs)
+            if limit is not None:
+                if client_args.request_timeout is None:
+                    # The deadline only limits requests once connected
+                    client_args.update_settings({'request_timeout': limit})
+                cluster_kwargs['deadline'] = Deadline(limit)
+            if snapshot:
+                cluster_kwargs['snapshot'] = cluster_snapshot(snapshot, name)
+            future = futures.Future()
+            threading.Thread(
+                target=self.run_cluster, args=(future, client_args, other_args, cluster_kwargs),
+                name=f'es-fieldusage-{name}', daemon=True).start()
+            pending[name] = (future, cluster_kwargs.get('deadline'))
+        for name, (future, deadline) in pending.items():
+            wait = None if deadline is None else max(0.0, deadline.remaining())
+            try:
+                field_usage = future.result(timeout=wait)
+            except futures.TimeoutError:
+                # The deadline stays, so the abandoned thread makes no more requests
+                self.fail(name, TimeoutException(f'No results within {deadline.seconds} seconds'))
+            except Exception as exc:
+                self.fail(name, exc)
+            else:
+                if deadline is not None:
+                    # Any mapping still needed for the per-index results may be fetched later
+                    deadline.lift()
+                self.add_cluster(name, field_usage)
+        if not self.field_usage:
+            raise ResultNotExpected(f'No cluster returned field usage: {self.failed}')
+
+    def add_cluster(self, name, field_usage):
+        """Add the usage stats of cluster ``name``"""
+        self.field_usage[name] = field_usage
+        for idx, counts in field_usage.usage_stats.items():
+            self.usage_stats[cluster_index(name, idx)] = counts
+        self.merge_metrics(field_usage)
+        self.metrics.count('clusters')
+
+    def fail(self, name, exc):
+        """Record that cluster ``name`` failed with exception ``exc``"""
+        LOGGER.error('Unable to get field usage from cluster %s: %s', name, exc)
+        self.failed[name] = str(exc) or type(exc).__name__
+        self.metrics.count('clusters_failed')
+
+    def merge_metrics(self, field_usage):
+        """Move the metrics recorded by ``field_usage`` since the last call to ``self.metrics``"""
+        self.metrics.merge(field_usage.metrics.reset())
+
+    @property
+    def client(self):
+        """Return a client for ``client_args`` and ``other_args``, connecting on first use"""
+        if self.client_data is None:
+            with self.metrics.timer('connect'):
+                self.client_data = instrument(get_client(configdict={
+                    'elasticsearch': {
+                        'client': prune_nones(self.client_args.asdict()),
+                        'other_settings': prune_nones(self.other_args.asdict())
+                    }
+                }), self.metrics)
+        return self.client_data
+
+    @property
+    def indices(self):
+        """Return all indices found, as ``cluster:index`` names"""
+        return list(self.usage_stats)
+
+    def field_names(self):
+        """Return the set of names of the fields in any index mapping, or with any usage stats"""
+        if self.field_names_data is None:
+            names = set()
+            for field_usage in self.field_usage.values():
+                names.update(map(field_usage.vocab.names.__getitem__, field_usage.all_field_ids()))
+            self.field_names_data = names
+        return self.field_names_data
+
+    def field_count(self):
+        """Return the number of fields in any index mapping, or with any usage stats"""
+        return len(self.field_names())
+
+    def accessed_count(self):
+        """Return the number of fields accessed in any index"""
+        return len(self.usage_stats.field_ids(accessed=True))
+
+    def accessed_fields(self):
+        """
+        Return the fields accessed in any index, with their counts summed across all indices in
+        all clusters, in descending order of count
+        """
+        with self.metrics.timer('totals'):
+            return self.usage_stats.totals().accessed()
+
+    def unaccessed_fields(self):
+        """
+        Return the fields in any index mapping, or with usage stats, which were not accessed in any
+        index, sorted by name, each with a count of zero
+        """
+        vocab = self.usage_stats.vocab
+        accessed = set(map(vocab.names.__getitem__, self.usage_stats.field_ids(accessed=True)))
+        with self.metrics.timer('sort'):
+            names = sorted(self.field_names() - accessed)
+            return FieldCounts.from_items(vocab, ((name, 0) for name in names))
+
+    @property
+    def results_by_index(self):
+        """
+        Return the results of every index in every cluster, as a dictionary-like
+        :py:class:`~.es_fieldusage.helpers.store.UsageStore` with ``cluster:index`` names as keys
+        """
+        if not self.per_index_data:
+            for name, field_usage in self.field_usage.items():
+                for idx, counts in field_usage.results_by_index.items():
+                    self.per_index_data[cluster_index(name, idx)] = counts
+                self.merge_metrics(field_usage)
+        return self.per_index_data
+
+    @property
+    def results(self):
+        """Return the counts of every field, summed across all indices in all clusters"""
+        if self.results_data is None:
+            results_by_index = self.results_by_index
+            with self.metrics.timer('totals'):
+                self.results_data = results_by_index.totals()
+        return self.results_data
+
+    @property
+    def per_index_report(self):
+        """Generate per-index summary report data, keyed by ``cluster:index``"""
+        if not self.per_index_report_data:
+            self.per_index_report_data = per_index_summary(self.results_by_index)
+        return self.per_index_report_data
+
+    @property
+    def report(self):
+        """
+        Generate summary report data for all clusters, with the same sections as
+        :py:attr:`~.es_fieldusage.main.FieldUsage.report`, plus the ``clusters`` which returned
+        results, and the ``failed_clusters``, if any, with their errors
+        """
+        if self.report_data is None:
+            extra = {'clusters': lambda: list(self.field_usage)}
+            if self.failed:
+                extra['failed_clusters'] = lambda: dict(self.failed)
+            self.report_data = summary_report(self, **extra)
+        return self.report_data
@@ -0,0 +1,275 @@
+"""Long-running server mode"""
+# pylint: disable=broad-exception-caught
+import io
+import json
+import logging
+import os
+import signal
+import stat
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from threading import Lock, current_thread, main_thread
+from urllib.parse import parse_qs, unquote, urlsplit
+from es_fieldusage.exceptions import ConfigurationException, FieldUsageException
+from es_fieldusage.helpers import formats
+from es_fieldusage.helpers.metrics import Metrics, instrument
+from es_fieldusage.main import FieldUsage
+from es_fieldusage.version import __version__
+
+LOGGER = logging.getLogger(__name__)
+
+CONTENT_TYPES = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+    'columnar': 'application/octet-stream',
+}
+
+def json_body(data):
+    """Return ``data`` encoded as a JSON response body"""
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+def get_sections(params):
+    """Return the report sections named in the ``sections`` query parameter (default: both)"""
+    sections = params.get('sections', ','.join(formats.SECTIONS)).split(',')
+    unknown = set(sections) - set(formats.SECTIONS)
+    if unknown:
+        raise ConfigurationException(f'Unknown sections: {sorted(unknown)}')
+    return sections
+
+class UsageServer:
+    """
+    Answer field usage queries from one long-running process, with one pooled client, connected
+    and version checked once, and one in-memory mapping cache shared by every query. Repeated
+    queries then only request the field usage stats and mapping versions, over connections
+    which are already open.
+
+    ``kwargs`` are passed to :py:class:`~.es_fieldusage.main.FieldUsage` for every query. The
+    requests the client makes for all queries are recorded in ``self.metrics``.
+    """
+    def __init__(self, client, mapping_cache=None, **kwargs):
+        self.metrics = Metrics()
+        self.client = instrument(client, self.metrics)
+        self.mapping_cache = mapping_cache
+        self.kwargs = kwargs
+        self.started = time.time()
+        self.queries = 0
+        self.lock = Lock()
+
+    def field_usage(self, search_pattern):
+        """Return a FieldUsage object for ``search_pattern``, with the shared client and cache"""
+        with self.lock:
+            self.queries += 1
+        return FieldUsage(
+            None, None, search_pattern, mapping_cache=self.mapping_cache, client=self.client,
+            **self.kwargs)
+
+    def report(self, search_pattern, params):
+        """
+        Return the summary report for ``search_pattern``, as JSON with the summary counts and the
+        ``sections`` requested, or only those sections in any other output ``format``
+
+        :returns: The content type and the response body
+        :rtype: tuple(str, bytes)
+        """
+        output_format = params.get('format', 'json')
+        sections = get_sections(params)
+        report = self.field_usage(search_pattern).report
+        if output_format != 'json':
+            if output_format not in formats.FORMATS:
+                raise ConfigurationException(f'Unknown output format: {output_format}')
+            body = io.BytesIO()
+            formats.dump(
+                output_format, body, 'all_indices', [(key, report[key]) for key in sections])
+            return CONTENT_TYPES[output_format], body.getvalue()
+        indices = report['indices']
+        data = {
+            'search_pattern': search_pattern,
+            'indices': indices if isinstance(indices, list) else [indices],
+            'field_count': report['field_count'],
+            'accessed_count': report['accessed_count'],
+            'unaccessed_count': report['unaccessed_count'],
+        }
+        if 'since' in report:
+            data['since'] = report['since']
+        for key in sections:
+            data[key] = dict(report[key].items())
+        return CONTENT_TYPES['json'], json_body(data)
+
+    def results(self, search_pattern, params):
+        """
+        Return the results for each index in ``search_pattern``, as a JSON object of index name ->
+        field -> count, or as NDJSON rows of the ``sections`` requested
+
+        :returns: The content type and the response body
+        :rtype: tuple(str, bytes)
+        """
+        output_format = params.get('format', 'json')
+        sections = get_sections(params)
+        results = self.field_usage(search_pattern).results_by_index
+        if output_format == 'json':
+            return CONTENT_TYPES['json'], json_body(
+                {idx: dict(result.items()) for idx, result in results.items()})
+        if output_format != 'ndjson':
+            raise ConfigurationException('Per-index results are only available as JSON or NDJSON')
+        body = io.BytesIO()
+        for idx, result in results.items():
+            shown = {'accessed': result.accessed(), 'unaccessed': result.unaccessed()}
+            formats.write_ndjson(body, idx, [(key, shown[key]) for key in sections])
+        return CONTENT_TYPES['ndjson'], body.getvalue()
+
+    def health(self):
+        """Return the server status, uptime, and number of queries answered, as JSON"""
+        cached = len(self.mapping_cache.entries) if self.mapping_cache is not None else 0
+        return CONTENT_TYPES['json'], json_body({
+            'status': 'ok',
+            'version': __version__,
+            'uptime': round(time.time() - self.started, 3),
+            'queries': self.queries,
+            'cached_mappings': cached,
+        })
+
+    def request_metrics(self):
+        """Return the requests made to each API for all queries so far, as JSON"""
+        return CONTENT_TYPES['json'], json_body(self.metrics.as_dict())
+
+    def close(self):
+        """Save the mapping cache, and close the client's connections"""
+        if self.mapping_cache is not None:
+            self.mapping_cache.save(force=True)
+        self.client.close()
+
+class UsageHandler(BaseHTTPRequestHandler):
+    """
+    Route HTTP GET requests to the :py:class:`UsageServer` in ``self.server.app``:
+
+    * ``/report/{search_pattern}``: :py:meth:`UsageServer.report`
+    * ``/results/{search_pattern}``: :py:meth:`UsageServer.results`
+    * ``/_health``: :py:meth:`UsageServer.health`
+    * ``/_metrics``: :py:meth:`UsageServer.request_metrics`
+    """
+    server_version = f'es-fieldusage/{__version__}'
+    # Keep connections open between queries
+    protocol_version = 'HTTP/1.1'
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        LOGGER.debug('%s %s', self.address_string(), format % args)
+
+    def send_body(self, status, content_type, body):
+        """Send a complete response"""
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def route(self, path, params):
+        """Return the content type and body for ``path``, or None if there is no such route"""
+        app = self.server.app
+        parts = [unquote(part) for part in path.strip('/').split('/', 1)]
+        if parts == ['_health']:
+            return app.health()
+        if parts == ['_metrics']:
+            return app.request_metrics()
+        if len(parts) == 2 and parts[1]:
+            if parts[0] == 'report':
+                return app.report(parts[1], params)
+            if parts[0] == 'results':
+                return app.results(parts[1], params)
+        return None
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Answer a query"""
+        url = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        start = time.perf_counter()
+        try:
+            response = self.route(url.path, params)
+        except ConfigurationException as exc:
+            return self.send_error_body(400, exc)
+        except FieldUsageException as exc:
+            LOGGER.error('Query %s failed: %s', self.path, exc)
+            return self.send_error_body(502, exc)
+        except Exception as exc:
+            LOGGER.exception('Query %s failed', self.path)
+            return self.send_error_body(500, exc)
+        if response is None:
+            return self.send_error_body(404, f'No such route: {url.path}')
+        self.send_body(200, *response)
+        LOGGER.info('Answered %s in %.3fs', self.path, time.perf_counter() - start)
+        return None
+
+    def send_error_body(self, status, error):
+        """Send a JSON error response"""
+        self.send_body(
+            status, CONTENT_TYPES['json'], json_body({'error': str(error), 'status': status}))
+
+class AppServerMixIn:  # pylint: disable=too-few-public-methods
+    """Answer requests with :py:class:`UsageHandler`, from :py:class:`UsageServer` ``app``"""
+    daemon_threads = True
+
+    def __init__(self, server_address, app):
+        #: Attribute. The :py:class:`UsageServer` which answers requests
+        self.app = app
+        super().__init__(server_address, UsageHandler)
+
+class UsageHTTPServer(AppServerMixIn, ThreadingHTTPServer):
+    """An HTTP server on a TCP ``host:port``"""
+
+class UnixHTTPServer(AppServerMixIn, ThreadingMixIn, UnixStreamServer):
+    """An HTTP server on a Unix socket, which only the user running it can connect to"""
+
+    def server_bind(self):
+        # Replace the socket file left behind by a server which did not shut down cleanly
+        try:
+            if stat.S_ISSOCK(os.stat(self.server_address).st_mode):
+                os.unlink(self.server_address)
+        except FileNotFoundError:
+            pass
+        super().server_bind()
+        os.chmod(self.server_address, 0o600)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except FileNotFoundError:
+            pass
+
+def make_server(app, listen='127.0.0.1:9280', unix_socket=None):
+    """
+    Return an HTTP server for :py:class:`UsageServer` ``app``, bound to the ``host:port`` in
+    ``listen``, or to the path ``unix_socket``, if given
+    """
+    if unix_socket:
+        return UnixHTTPServer(unix_socket, app)
+    host, _, port = listen.rpartition(':')
+    try:
+        address = (host or '127.0.0.1', int(port))
+    except ValueError as exc:
+        raise ConfigurationException(f'Invalid address to listen on: {listen}') from exc
+    return UsageHTTPServer(address, app)
+
+def interrupt(*_):
+    """Signal handler which stops the server as Ctrl-C does"""
+    raise KeyboardInterrupt
+
+def serve(server):
+    """
+    Serve queries until interrupted or terminated, then save the mapping cache and close the
+    server
+    """
+    if current_thread() is main_thread():
+        signal.signal(signal.SIGTERM, interrupt)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        LOGGER.info('Interrupted. Shutting down.')
+    finally:
+        server.server_close()
+        server.app.close()
@@ -0,0 +1,50 @@
+"""Test bulk indexing against a local fake Elasticsearch"""
+from unittest import TestCase
+from elasticsearch8 import Elasticsearch
+from es_fieldusage.helpers import bulk
+from es_fieldusage.helpers.store import UsageStore
+from benchmarks.fake_es import FakeCluster, FakeElasticsearch
+
+STAMP = '2024-01-01T00:00:00+00:00'
+
+def results():
+    """Return per-index results like FieldUsage.results_by_index"""
+    store = UsageStore()
+    store['index-1'] = {'a': 3, 'b': 0}
+    store['index-2'] = {'a': 1, 'c': 2, 'd': 0}
+    return store
+
+class TestBulk(TestCase):
+    """Test the bulk helper functions"""
+    def setUp(self):
+        self.cluster = FakeCluster()
+        self.server = FakeElasticsearch(self.cluster)
+        self.client = Elasticsearch(hosts=self.server.__enter__())
+    def tearDown(self):
+        self.client.close()
+        self.server.__exit__(None, None, None)
+    def test_actions(self):
+        """One document per field per index, with an _id which only depends on its values"""
+        actions = list(bulk.usage_actions(results(), 'usage', STAMP))
+        self.assertEqual(5, len(actions))
+        self.assertEqual(
+            {'@timestamp': STAMP, 'index': 'index-2', 'field': 'c', 'count': 2, 'accessed': True},
+            actions[3]['_source'])
+        again = list(bulk.usage_actions(results(), 'usage', STAMP))
+        self.assertEqual([action['_id'] for action in actions], [action['_id'] for action in again])
+        self.assertEqual(5, len({action['_id'] for action in actions}))
+    def test_actions_no_ids(self):
+        """Without ids, Elasticsearch generates each _id"""
+        actions = list(bulk.usage_actions(results(), 'usage', STAMP, ids=False))
+        self.assertEqual(5, len(actions))
+        self.assertFalse(any('_id' in action for action in actions))
+    def test_send(self):
+        """Documents are indexed, and indexing the same results again overwrites them"""
+        bulk.create_index(self.client, 'usage')
+        bulk.create_index(self.client, 'usage')
+        actions = bulk.usage_actions(results(), 'usage', STAMP)
+        self.assertEqual((5, 0), bulk.send(self.client, actions, chunk_size=2))
+        actions = bulk.usage_actions(results(), 'usage', STAMP)
+        self.assertEqual((5, 0), bulk.send(self.client, actions, chunk_size=2, threads=2))
+        self.assertEqual(5, len(self.cluster.documents['usage']))
+        self.assertEqual(6, self.cluster.requests['/_bulk'])
@@ -0,0 +1,64 @@
+"""Test the MappingCache class"""
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from es_fieldusage.helpers.cache import MappingCache
+
+class TestMappingCache(TestCase):
+    """Test the MappingCache class"""
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.filename = os.path.join(self.tmpdir.name, 'cache', 'mappings.json')
+    def tearDown(self):
+        self.tmpdir.cleanup()
+    def test_round_trip(self):
+        """Saved entries load back, and a missing file is an empty cache"""
+        cache = MappingCache(self.filename)
+        self.assertIsNone(cache.get('index-1/uuid/1'))
+        cache.put('index-1/uuid/1', 'abc', {'a': 0, 'b.c': 0})
+        cache.put('index-2/uuid/3', 'abc', {'a': 0, 'b.c': 0})
+        cache.save()
+        loaded = MappingCache(self.filename)
+        self.assertEqual(('abc', ['a', 'b.c']), loaded.get('index-2/uuid/3'))
+        self.assertEqual(1, len(loaded.leaves))
+    def test_eviction(self):
+        """Only the most recently used entries, and the leaves they use, are saved"""
+        cache = MappingCache(self.filename, max_entries=2)
+        cache.put('one', 'h1', ['a'])
+        cache.put('two', 'h2', ['b'])
+        cache.put('three', 'h3', ['c'])
+        cache.get('one')
+        cache.save()
+        loaded = MappingCache(self.filename)
+        loaded.load()
+        self.assertEqual(['three', 'one'], list(loaded.entries))
+        self.assertEqual({'h1', 'h3'}, set(loaded.leaves))
+    def test_clean_run(self):
+        """A run which only reads cached entries does not write the file"""
+        cache = MappingCache(self.filename)
+        cache.put('one', 'h1', ['a'])
+        cache.put('two', 'h2', ['b'])
+        cache.save()
+        os.utime(self.filename, (0, 0))
+        loaded = MappingCache(self.filename)
+        self.assertEqual(('h1', ['a']), loaded.get('one'))
+        self.assertEqual(['two', 'one'], list(loaded.entries))
+        loaded.save()
+        self.assertEqual(0, os.path.getmtime(self.filename))
+        # The order is saved with the next change
+        loaded.put('three', 'h3', ['c'])
+        loaded.save()
+        reloaded = MappingCache(self.filename)
+        reloaded.load()
+        self.assertEqual(['two', 'one', 'three'], list(reloaded.entries))
+    def test_unreadable(self):
+        """A corrupt cache file is ignored, and replaced on save"""
+        os.makedirs(os.path.dirname(self.filename))
+        with open(self.filename, 'w', encoding='utf-8') as fdesc:
+            fdesc.write('{not json')
+        cache = MappingCache(self.filename)
+        with self.assertLogs('es_fieldusage.helpers.cache', level='WARNING'):
+            self.assertIsNone(cache.get('one'))
+        cache.put('one', 'h1', ['a'])
+        cache.save()
+        self.assertEqual(('h1', ['a']), MappingCache(self.filename).get('one'))
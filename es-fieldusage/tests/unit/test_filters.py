@@ -0,0 +1,43 @@
+"""Test field name filters"""
+from unittest import TestCase
+from es_fieldusage.exceptions import ConfigurationException
+from es_fieldusage.helpers.filters import FieldFilter, compile_patterns
+
+class TestCompilePatterns(TestCase):
+    """Test compiling globs and regular expressions into one"""
+    def test_globs_and_regexes(self):
+        """Globs and /regexes/ are combined, and must each match the whole field name"""
+        regex = compile_patterns(['host.*', '/(source|destination)\\.ip/'])
+        for field in ['host.name', 'host.os.name', 'source.ip', 'destination.ip']:
+            self.assertIsNotNone(regex.fullmatch(field), field)
+        for field in ['myhost.name', 'source.ip.keyword', 'source']:
+            self.assertIsNone(regex.fullmatch(field), field)
+    def test_invalid(self):
+        """An invalid regular expression is a configuration error"""
+        with self.assertRaises(ConfigurationException):
+            compile_patterns(['/host.(name/'])
+
+class TestFieldFilter(TestCase):
+    """Test the FieldFilter class"""
+    def test_default(self):
+        """With no patterns, every field but _id and _source is kept, and mappings are as is"""
+        keep = FieldFilter()
+        self.assertTrue(keep('message'))
+        self.assertFalse(keep('_id'))
+        self.assertFalse(keep('_source'))
+        leaves = {'a': 0, 'b': 0}
+        self.assertIs(leaves, keep.leaves(leaves))
+    def test_include_exclude(self):
+        """A field is kept if it is included, and not excluded, and each decision is remembered"""
+        keep = FieldFilter(include=['host.*', 'message'], exclude=['*.keyword'])
+        self.assertEqual(
+            {'host.name': 0, 'message': 0},
+            keep.leaves(dict.fromkeys(['host.name', 'host.name.keyword', 'message', 'url'], 0)))
+        self.assertEqual(
+            {'host.name': True, 'host.name.keyword': False, 'message': True, 'url': False},
+            keep.decisions)
+    def test_exclude_only(self):
+        """With only exclude patterns, every other field is kept"""
+        keep = FieldFilter(exclude=['/.*\\.keyword/'])
+        self.assertTrue(keep('message'))
+        self.assertFalse(keep('message.keyword'))
@@ -0,0 +1,49 @@
+"""Test output formats"""
+import csv
+import io
+import json
+from unittest import TestCase, skipIf
+from unittest.mock import patch
+from es_fieldusage.helpers import formats
+from es_fieldusage.helpers.store import FieldCounts, FieldVocabulary
+
+ROWS = [('accessed', 'a"b', 5), ('accessed', 'c.d', 1), ('unaccessed', 'é', 0)]
+
+def sections():
+    """Return accessed and unaccessed sections of the fields in ROWS"""
+    counts = FieldCounts.from_items(FieldVocabulary(), [row[1:] for row in ROWS])
+    return [('accessed', counts.accessed()), ('unaccessed', counts.unaccessed())]
+
+def dump(output_format):
+    """Return the bytes written for ROWS in ``output_format``"""
+    fdesc = io.BytesIO()
+    formats.dump(output_format, fdesc, 'index-1', sections())
+    return fdesc.getvalue()
+
+class TestFormats(TestCase):
+    """Test the output formats"""
+    def test_ndjson(self):
+        """One JSON object per row"""
+        rows = [json.loads(line) for line in dump('ndjson').decode('utf-8').splitlines()]
+        self.assertEqual(
+            [{'index': 'index-1', 'section': row[0], 'field': row[1], 'count': row[2]}
+                for row in ROWS], rows)
+    def test_csv(self):
+        """A header, then one row per field"""
+        rows = list(csv.reader(io.StringIO(dump('csv').decode('utf-8'))))
+        self.assertEqual(formats.CSV_HEADER, rows[0])
+        self.assertEqual([['index-1', *map(str, row)] for row in ROWS], rows[1:])
+    def test_packed_columns(self):
+        """Without PyArrow, columnar output is the packed format, which reads back"""
+        with patch('es_fieldusage.helpers.formats.pa', None):
+            data = dump('columnar')
+            self.assertEqual('columns', formats.suffix('columnar'))
+        self.assertEqual(('index-1', ROWS), formats.read_columns(io.BytesIO(data)))
+    @skipIf(formats.pa is None, 'pyarrow is not installed')
+    def test_arrow(self):
+        """With PyArrow, columnar output is an Arrow IPC file"""
+        table = formats.pa.ipc.open_file(formats.pa.BufferReader(dump('columnar'))).read_all()
+        self.assertEqual(formats.CSV_HEADER, table.column_names)
+        self.assertEqual(
+            [{'index': 'index-1', 'section': row[0], 'field': row[1], 'count': row[2]}
+                for row in ROWS], table.to_pylist())
@@ -0,0 +1,46 @@
+"""Test the lazy loading helpers and CLI startup"""
+import subprocess
+import sys
+from unittest import TestCase
+from click.testing import CliRunner
+from es_fieldusage.cli import COMMANDS, run
+from es_fieldusage.helpers.lazy import lazy_import
+
+# Modules which only commands need, so must not be imported with the CLI
+HEAVY = [
+    'numpy', 'pyarrow', 'ecs_logging', 'es_client', 'elasticsearch8', 'elastic_transport',
+    'voluptuous', 'six', 'es_fieldusage.commands', 'es_fieldusage.main',
+]
+# Print which of the modules named in the arguments are imported (not just lazily loadable)
+IMPORTED = '''
+import sys, types
+import es_fieldusage.cli
+print(','.join(name for name in sys.argv[1:] if type(sys.modules.get(name)) is types.ModuleType))
+'''
+
+class TestLazyImport(TestCase):
+    """Test the lazy_import function"""
+    def test_missing(self):
+        """A module which is not installed is None"""
+        self.assertIsNone(lazy_import('es_fieldusage_no_such_module'))
+    def test_loaded(self):
+        """A module which is already imported is returned as it is"""
+        self.assertIs(sys.modules['subprocess'], lazy_import('subprocess'))
+
+class TestStartup(TestCase):
+    """Test what importing the CLI imports"""
+    def test_no_heavy_imports(self):
+        """Importing the CLI only imports commands, and their dependencies, lazily"""
+        proc = subprocess.run(
+            [sys.executable, '-c', IMPORTED, *HEAVY], capture_output=True, text=True, check=True)
+        self.assertEqual('', proc.stdout.strip())
+    def test_command_help(self):
+        """The short help listed for each lazy command is the command's own"""
+        runner = CliRunner()
+        for name, (_, short_help) in COMMANDS.items():
+            command = run.get_command(None, name)
+            self.assertEqual(short_help, command.get_short_help_str(limit=200))
+        # Ignore where the help text is wrapped
+        output = ' '.join(runner.invoke(run, ['--help']).output.split())
+        for name, (_, short_help) in COMMANDS.items():
+            self.assertIn(f'{name} {short_help}', output)
@@ -0,0 +1,230 @@
+"""Test the FieldUsage class"""
+import json
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import AsyncMock, MagicMock, patch
+from es_fieldusage.exceptions import ResultNotExpected
+from es_fieldusage.helpers.stream import iter_shards
+from es_fieldusage.main import FieldUsage
+
+MAPPING = {
+    'properties': {
+        '@timestamp': {'type': 'date'},
+        'host': {'properties': {'name': {'type': 'keyword'}, 'ip': {'type': 'ip'}}},
+        'message': {'type': 'text'},
+    }
+}
+
+def shard(fields):
+    """Return a single shard entry from the field_usage_stats API"""
+    return {'stats': {'fields': {key: {'any': value} for key, value in fields.items()}}}
+
+FIELD_USAGE = {
+    '_shards': {'total': 3, 'successful': 3, 'failed': 0},
+    'index-1': {
+        'shards': [
+            shard({'_id': 9, '@timestamp': 3, 'host.name': 1}),
+            shard({'@timestamp': 2, 'message.keyword': 4}),
+        ]
+    },
+    'index-2': {'shards': [shard({'_source': 5, 'host.ip': 7})]},
+}
+
+def get_mapping(index=None):
+    """Mock the get_mapping API for any of the indices in FIELD_USAGE"""
+    names = [idx for idx in FIELD_USAGE if idx != '_shards'] if '*' in index else index.split(',')
+    return {idx: {'mappings': MAPPING} for idx in names}
+
+def field_usage_stats(index=None):
+    """Mock the field_usage_stats API for a pattern or comma-separated list of indices"""
+    if '*' in index:
+        return FIELD_USAGE
+    return {idx: value for idx, value in FIELD_USAGE.items() if idx in index.split(',')}
+
+def cluster_state(index=None, **_):
+    """Mock the cluster state API, filtered to index mapping versions"""
+    indices = get_mapping(index=index)
+    return {'metadata': {'indices': {
+        idx: {'mapping_version': 2, 'settings': {'index': {'uuid': f'{idx}-uuid'}}}
+        for idx in indices}}}
+
+def field_usage(side_effect=field_usage_stats, resolved=None, **kwargs):
+    """Return a FieldUsage object built on a mock client"""
+    client = MagicMock()
+    client.indices.resolve_index.return_value = resolved if resolved else {}
+    client.cat.indices.return_value = [{'index': 'index-2'}, {'index': 'index-1'}]
+    client.indices.field_usage_stats.side_effect = side_effect
+    client.indices.get_mapping.side_effect = get_mapping
+    client.cluster.state.side_effect = cluster_state
+    with patch('es_fieldusage.main.get_client', return_value=client):
+        return FieldUsage(MagicMock(), MagicMock(), 'index-*', **kwargs)
+
+class TestFieldUsage(TestCase):
+    """Test the FieldUsage class"""
+    def test_usage_stats(self):
+        """Shard stats are summed per index, skipping _id and _source"""
+        obj = field_usage()
+        self.assertEqual({'@timestamp': 5, 'host.name': 1, 'message.keyword': 4},
+            obj.usage_stats['index-1'])
+        self.assertEqual({'host.ip': 7}, obj.usage_stats['index-2'])
+    def test_result(self):
+        """Mapping leaves and usage counts are merged and sorted by value"""
+        expected = [
+            ('@timestamp', 5), ('message.keyword', 4), ('host.name', 1), ('host.ip', 0),
+            ('message', 0),
+        ]
+        self.assertEqual(expected, list(field_usage().result('index-1').items()))
+    def test_results(self):
+        """Results are summed across all indices"""
+        expected = [
+            ('host.ip', 7), ('@timestamp', 5), ('message.keyword', 4), ('host.name', 1),
+            ('message', 0),
+        ]
+        self.assertEqual(expected, list(field_usage().results.items()))
+    def test_report(self):
+        """The report splits accessed and unaccessed fields"""
+        report = field_usage().report
+        self.assertEqual(['index-1', 'index-2'], report['indices'])
+        self.assertEqual(5, report['field_count'])
+        self.assertEqual({'message': 0}, report['unaccessed'])
+        self.assertEqual(4, len(report['accessed']))
+    def test_mappings_fetched_once(self):
+        """A single get_mapping call is made, and identical mappings are flattened once"""
+        obj = field_usage()
+        _ = obj.results_by_index
+        obj.client.indices.get_mapping.assert_called_once_with(index='index-*')
+        # Without a mapping cache, the mapping versions are not needed
+        obj.client.cluster.state.assert_not_called()
+        self.assertEqual(1, len(obj.leaf_cache))
+        self.assertEqual(obj.mapping_hashes['index-1'], obj.mapping_hashes['index-2'])
+    def test_workers(self):
+        """Concurrent results match sequential results, in the same order"""
+        expected = field_usage().results_by_index
+        result = field_usage(workers=4).results_by_index
+        self.assertEqual(list(expected.keys()), list(result.keys()))
+        for idx, value in expected.items():
+            self.assertEqual(list(value.items()), list(result[idx].items()))
+    def test_stream(self):
+        """Streamed shard aggregation matches aggregation of the full response"""
+        data = json.dumps(FIELD_USAGE).encode('utf-8')
+        chunks = [data[i:i + 10] for i in range(0, len(data), 10)]
+        with patch('es_fieldusage.main.streaming.stream_field_usage',
+                return_value=iter_shards(chunks)):
+            obj = field_usage(stream=True)
+        self.assertEqual(field_usage().usage_stats, obj.usage_stats)
+    def test_batches(self):
+        """Batched fetches resolve the pattern and merge into the same usage stats"""
+        obj = field_usage(batch_size=1, concurrency=2)
+        self.assertEqual(2, obj.client.indices.field_usage_stats.call_count)
+        self.assertEqual(field_usage().usage_stats, obj.usage_stats)
+        self.assertEqual(['index-1', 'index-2'], list(obj.usage_stats.keys()))
+    @patch('es_fieldusage.helpers.batches.asyncio.sleep', new_callable=AsyncMock)
+    def test_batch_retry(self, _):
+        """A failed batch is retried"""
+        side_effect = [ConnectionError('timeout'), field_usage_stats('index-1,index-2')]
+        obj = field_usage(side_effect=side_effect, batch_size=2)
+        self.assertEqual(2, obj.client.indices.field_usage_stats.call_count)
+        self.assertEqual(field_usage().usage_stats, obj.usage_stats)
+    @patch('es_fieldusage.helpers.batches.asyncio.sleep', new_callable=AsyncMock)
+    def test_batch_retries_exhausted(self, _):
+        """A batch that keeps failing raises an exception"""
+        with self.assertRaises(ResultNotExpected):
+            field_usage(side_effect=ConnectionError('timeout'), batch_size=2, retries=1)
+    def test_snapshot(self):
+        """The first run saves a snapshot, and the next reports only the usage since then"""
+        with TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'snap')
+            first = field_usage(snapshot=filename)
+            self.assertNotIn('since', first.report)
+            self.assertEqual(field_usage().usage_stats['index-1'], first.usage_stats['index-1'])
+            second = field_usage(snapshot=filename)
+        self.assertEqual(0, sum(second.results.values()))
+        self.assertEqual(5, second.report['field_count'])
+        self.assertIn('since', second.report)
+    def test_snapshot_filters_changed(self):
+        """A snapshot taken with other field filters is not diffed, and all usage is counted"""
+        with TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'snap')
+            field_usage(snapshot=filename, include=['host.*'])
+            with self.assertLogs('es_fieldusage.main', level='WARNING'):
+                second = field_usage(snapshot=filename)
+            self.assertEqual(field_usage().usage_stats, second.usage_stats)
+            self.assertEqual(['index-1', 'index-2'], sorted(second.reset_indices))
+            third = field_usage(snapshot=filename)
+        self.assertEqual(0, sum(third.results.values()))
+        self.assertEqual([], third.reset_indices)
+    def test_mapping_cache(self):
+        """Unchanged mappings are loaded from the cache file, instead of fetched again"""
+        with TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'mappings.json')
+            first = field_usage(mapping_cache=filename)
+            _ = first.results_by_index
+            first.client.indices.get_mapping.assert_called_once_with(index='index-1,index-2')
+            second = field_usage(mapping_cache=filename, workers=2)
+            self.assertEqual(first.results, second.results)
+            second.client.indices.get_mapping.assert_not_called()
+            self.assertEqual(2, second.client.cluster.state.call_count)
+    def test_report_lazy(self):
+        """Report sections are computed on demand, and match the full results"""
+        obj = field_usage()
+        report = obj.report
+        self.assertEqual({'host.ip': 7, '@timestamp': 5, 'message.keyword': 4, 'host.name': 1},
+            report['accessed'])
+        obj.client.indices.get_mapping.assert_not_called()
+        self.assertEqual((5, 4, 1), (
+            report['field_count'], report['accessed_count'], report['unaccessed_count']))
+        self.assertEqual(0, len(obj.per_index_data))
+        self.assertEqual(list(obj.results.unaccessed().items()), list(report['unaccessed'].items()))
+        self.assertEqual(list(obj.results.accessed().items()), list(report['accessed'].items()))
+    def test_rollup_data_stream(self):
+        """Backing indices are summed into their data stream, with the fields of every mapping"""
+        obj = field_usage(rollup=True, resolved={
+            'indices': [],
+            'data_streams': [{'name': 'logs', 'backing_indices': ['index-1', 'index-2']}],
+        })
+        obj.client.indices.resolve_index.assert_called_once_with(name='index-*')
+        self.assertEqual('logs', obj.indices)
+        expected = [
+            ('host.ip', 7), ('@timestamp', 5), ('message.keyword', 4), ('host.name', 1),
+            ('message', 0),
+        ]
+        self.assertEqual(expected, list(obj.results_by_index['logs'].items()))
+        self.assertEqual(2, obj.metrics.as_dict()['counters']['rolled_up_indices'])
+    def test_rollup_alias(self):
+        """Indices are summed into their alias, and indices with none are left as they are"""
+        obj = field_usage(rollup=True, resolved={
+            'indices': [{'name': 'index-1', 'aliases': ['web', 'all']}],
+            'aliases': [{'name': 'all', 'indices': ['index-1']}],
+        })
+        self.assertEqual(['all', 'index-2'], sorted(obj.indices))
+        self.assertEqual({'host.ip': 7}, obj.usage_stats['index-2'])
+    def test_include_exclude(self):
+        """Only the fields kept by the filters are counted and reported, in usage and mappings"""
+        obj = field_usage(include=['host.*', '/message.*/'], exclude=['*.keyword'])
+        self.assertEqual({'host.name': 1}, obj.usage_stats['index-1'])
+        self.assertEqual(
+            [('host.name', 1), ('host.ip', 0), ('message', 0)],
+            list(obj.result('index-1').items()))
+        self.assertEqual({'host.ip': 7, 'host.name': 1}, obj.report['accessed'])
+        self.assertEqual({'message': 0}, obj.report['unaccessed'])
+    def test_filter_mapping_cache(self):
+        """The mapping cache keeps every field, whatever the filters"""
+        with TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'mappings.json')
+            _ = field_usage(mapping_cache=filename, include=['host.*']).results
+            obj = field_usage(mapping_cache=filename)
+            obj.client.indices.get_mapping.assert_not_called()
+            self.assertEqual(5, obj.report['field_count'])
+    def test_metrics(self):
+        """Each phase is timed, and shards and mappings are counted"""
+        obj = field_usage()
+        _ = obj.results
+        data = obj.metrics.as_dict()
+        self.assertEqual(
+            {'connect', 'field_usage_stats', 'aggregate', 'get_mapping', 'flatten_mapping',
+             'merge', 'sort', 'totals'}, set(data['phases']))
+        self.assertEqual(2, data['phases']['merge']['calls'])
+        self.assertEqual(
+            {'indices': 2, 'shards': 3, 'mappings_fetched': 2, 'mappings_flattened': 1},
+            data['counters'])
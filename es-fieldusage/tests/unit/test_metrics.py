@@ -0,0 +1,82 @@
+"""Test the run time instrumentation"""
+import logging
+from unittest import TestCase
+from unittest.mock import patch
+from elasticsearch8 import Elasticsearch
+from es_fieldusage.helpers.logging import log_metrics
+from es_fieldusage.helpers.metrics import Metrics, api_name, instrument
+from benchmarks.fake_es import FakeCluster, FakeElasticsearch
+
+class TestApiName(TestCase):
+    """Test the api_name function"""
+    def test_api_name(self):
+        """The API is the first path segment starting with an underscore, plus any group"""
+        self.assertEqual('_mapping', api_name('/index-1,index-2/_mapping'))
+        self.assertEqual('_field_usage_stats', api_name('/index-*/_field_usage_stats?pretty'))
+        self.assertEqual('_cat/indices', api_name('/_cat/indices/index-*?format=json'))
+        self.assertEqual('_cluster/state', api_name('/_cluster/state/metadata/index-1'))
+        self.assertEqual('_bulk', api_name('/_bulk'))
+        self.assertEqual('{index}', api_name('/index-1'))
+        self.assertEqual('/', api_name('/'))
+
+class TestMetrics(TestCase):
+    """Test the Metrics class"""
+    def test_nested_timers(self):
+        """A phase timed inside another is not counted in the outer phase"""
+        metrics = Metrics()
+        clock = iter([0.0, 1.0, 3.0, 10.0])
+        with patch('es_fieldusage.helpers.metrics.time.perf_counter', lambda: next(clock)):
+            with metrics.timer('outer'):
+                with metrics.timer('inner'):
+                    pass
+        self.assertEqual([1, 8.0], metrics.phases['outer'])
+        self.assertEqual([1, 2.0], metrics.phases['inner'])
+    def test_counters(self):
+        """Counters and requests are summed by name"""
+        metrics = Metrics()
+        metrics.count('shards', 3)
+        metrics.count('shards')
+        metrics.add_request('_mapping', 100, 0.5)
+        metrics.add_request('_mapping', 50, 0.25)
+        data = metrics.as_dict()
+        self.assertEqual({'shards': 4}, data['counters'])
+        self.assertEqual({'_mapping': {'requests': 2, 'bytes': 150, 'seconds': 0.75}}, data['apis'])
+    def test_reset(self):
+        """Resetting returns what was recorded so far, and starts again from nothing"""
+        metrics = Metrics()
+        metrics.count('shards', 3)
+        metrics.add_request('_mapping', 100, 0.5)
+        with metrics.timer('merge'):
+            pass
+        taken = metrics.reset()
+        self.assertEqual({'shards': 3}, taken.counters)
+        self.assertEqual([1, 100, 0.5], taken.apis['_mapping'])
+        self.assertEqual(1, taken.phases['merge'][0])
+        self.assertEqual(({}, {}, {}), (metrics.phases, metrics.counters, metrics.apis))
+        metrics.count('shards')
+        self.assertEqual({'shards': 1}, metrics.counters)
+    def test_log_metrics(self):
+        """Metrics are logged as extra fields, for the ECS formatter"""
+        metrics = Metrics()
+        metrics.count('shards', 2)
+        with self.assertLogs('metrics', level='INFO') as logs:
+            log_metrics(logging.getLogger('metrics'), metrics)
+        record = logs.records[0]
+        self.assertEqual('metric', record.event['kind'])
+        self.assertEqual({'shards': 2}, record.es_fieldusage['counters'])
+
+class TestInstrument(TestCase):
+    """Test recording the requests made by a client"""
+    def test_instrument(self):
+        """Each request is recorded with the size of its response body, per API"""
+        cluster = FakeCluster(mappings={'index-1': {'a': {'type': 'keyword'}}})
+        metrics = Metrics()
+        with FakeElasticsearch(cluster) as url:
+            client = instrument(Elasticsearch(hosts=url), metrics)
+            client.indices.get_mapping(index='index-1')
+            client.options(request_timeout=5).indices.get_mapping(index='index-1')
+            client.close()
+        data = metrics.as_dict()['apis']
+        self.assertEqual(['_mapping'], list(data))
+        self.assertEqual(2, data['_mapping']['requests'])
+        self.assertEqual(cluster.sent['/index-1/_mapping'], data['_mapping']['bytes'])
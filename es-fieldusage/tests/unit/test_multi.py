@@ -0,0 +1,207 @@
+"""Test reporting on several clusters at once"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+from unittest import TestCase
+from elasticsearch8 import Elasticsearch
+from elastic_transport import ConnectionTimeout
+from es_client.builder import ClientArgs, OtherArgs
+from es_fieldusage.exceptions import ConfigurationException, ResultNotExpected, TimeoutException
+from es_fieldusage.helpers.bulk import usage_actions
+from es_fieldusage.helpers.client import Deadline, get_clusters
+from es_fieldusage.helpers.stream import stream_field_usage
+from es_fieldusage.multi import MultiFieldUsage
+from benchmarks.fake_es import FakeCluster, FakeElasticsearch
+
+MAPPING = {'a': {'type': 'keyword'}, 'b': {'type': 'long'}, 'c': {'type': 'text'}}
+CONFIG = '''
+clusters:
+  prod-east:
+    client:
+      hosts: http://127.0.0.1:9201
+    timeout: 30
+  prod-west:
+    client:
+      hosts: http://127.0.0.1:9202
+  staging:
+    client:
+      hosts: http://127.0.0.1:9203
+    other_settings:
+      skip_version_test: true
+'''
+
+# Report on a responsive cluster and one which never answers in time, then exit
+HUNG = '''
+import sys
+from benchmarks.fake_es import FakeCluster, FakeElasticsearch
+from es_fieldusage.multi import MultiFieldUsage
+from tests.unit.test_multi import MAPPING, cluster_args
+fast = FakeCluster(mappings={'index-1': MAPPING}, usage={'index-1': {'a': 3}})
+hung = FakeCluster(mappings={'index-1': MAPPING}, usage={'index-1': {'a': 1}}, latency=60.0)
+with FakeElasticsearch(fast) as fast_url, FakeElasticsearch(hung) as hung_url:
+    field_usage = MultiFieldUsage(
+        {'fast': cluster_args(fast_url), 'hung': cluster_args(hung_url)}, 'index-*',
+        timeout=float(sys.argv[1]))
+    print(sorted(field_usage.report['clusters']), sorted(field_usage.report['failed_clusters']))
+'''
+
+def cluster_args(url, timeout=None):
+    """Return the named cluster tuple for a fake Elasticsearch at ``url``"""
+    client_args = ClientArgs()
+    client_args.update_settings({'hosts': [url]})
+    other_args = OtherArgs()
+    other_args.update_settings({'skip_version_test': True})
+    return client_args, other_args, timeout
+
+class TestMultiFieldUsage(TestCase):
+    """Test the MultiFieldUsage class against several fake clusters"""
+    def setUp(self):
+        self.fakes = {
+            'east': FakeCluster(
+                mappings={'index-1': MAPPING}, usage={'index-1': {'a': 3}}, shards=2),
+            'west': FakeCluster(
+                mappings={'index-1': MAPPING, 'index-2': MAPPING},
+                usage={'index-1': {'a': 1, 'b': 2}, 'index-2': {}}),
+        }
+        stack = ExitStack()
+        self.addCleanup(stack.close)
+        self.urls = {
+            name: stack.enter_context(FakeElasticsearch(cluster))
+            for name, cluster in self.fakes.items()
+        }
+    def test_merged(self):
+        """Indices are keyed by cluster and index, and the report sums every cluster"""
+        clusters = {name: cluster_args(url) for name, url in self.urls.items()}
+        field_usage = MultiFieldUsage(clusters, 'index-*')
+        self.assertEqual(
+            ['east:index-1', 'west:index-1', 'west:index-2'], sorted(field_usage.indices))
+        self.assertEqual(
+            {'a': 1, 'b': 2, 'c': 0}, dict(field_usage.results_by_index['west:index-1']))
+        report = field_usage.report
+        self.assertEqual(['east', 'west'], sorted(report['clusters']))
+        self.assertEqual({'a': 4, 'b': 2}, dict(report['accessed']))
+        self.assertEqual({'c': 0}, dict(report['unaccessed']))
+        self.assertEqual((3, 2, 1), (
+            report['field_count'], report['accessed_count'], report['unaccessed_count']))
+        self.assertNotIn('failed_clusters', report)
+        self.assertEqual(2, field_usage.metrics.as_dict()['counters']['clusters'])
+    def test_lazy_results(self):
+        """The summary report needs no per-index results, and matches their totals"""
+        clusters = {name: cluster_args(url) for name, url in self.urls.items()}
+        field_usage = MultiFieldUsage(clusters, 'index-*')
+        report = dict(field_usage.report)
+        self.assertEqual(0, len(field_usage.per_index_data))
+        self.assertEqual(
+            ['east:index-1', 'west:index-1', 'west:index-2'], sorted(report['indices']))
+        results = field_usage.results
+        self.assertEqual(dict(results.accessed()), dict(report['accessed']))
+        self.assertEqual(dict(results.unaccessed()), dict(report['unaccessed']))
+        self.assertEqual(len(results), report['field_count'])
+        self.assertEqual(3, len(field_usage.per_index_data))
+        phases = field_usage.metrics.as_dict()['phases']
+        self.assertEqual(3, phases['merge']['calls'])
+    def test_timeout(self):
+        """A cluster which runs out of time is left out, and the others are still reported"""
+        self.fakes['west'].latency = 2.0
+        clusters = {
+            'east': cluster_args(self.urls['east']),
+            'west': cluster_args(self.urls['west'], timeout=0.5),
+        }
+        start = time.monotonic()
+        field_usage = MultiFieldUsage(clusters, 'index-*')
+        self.assertLess(time.monotonic() - start, 1.5)
+        self.assertEqual(['east:index-1'], field_usage.indices)
+        self.assertEqual(['east'], field_usage.report['clusters'])
+        self.assertIn('west', field_usage.report['failed_clusters'])
+    def test_hung_cluster_exit(self):
+        """A cluster which never answers in time neither delays the results nor keeps the process"""
+        start = time.monotonic()
+        proc = subprocess.run(
+            [sys.executable, '-c', HUNG, '1.0'], capture_output=True, text=True, check=True,
+            timeout=30)
+        self.assertLess(time.monotonic() - start, 15)
+        self.assertEqual("['fast'] ['hung']", proc.stdout.strip())
+    def test_all_failed(self):
+        """If no cluster returns results, that is an error"""
+        clusters = {'east': cluster_args(self.urls['east'], timeout=0.5)}
+        self.fakes['east'].latency = 2.0
+        with self.assertRaises(ResultNotExpected):
+            MultiFieldUsage(clusters, 'index-*', timeout=10)
+    def test_bulk_actions(self):
+        """Documents for several clusters have the cluster and index name separately"""
+        clusters = {name: cluster_args(url) for name, url in self.urls.items()}
+        field_usage = MultiFieldUsage(clusters, 'index-1')
+        sources = [
+            action['_source'] for action in usage_actions(
+                field_usage.results_by_index, 'es-fieldusage', '2024-01-01T00:00:00+00:00')]
+        self.assertIn(
+            {'@timestamp': '2024-01-01T00:00:00+00:00', 'cluster': 'east', 'index': 'index-1',
+             'field': 'a', 'count': 3, 'accessed': True}, sources)
+        self.assertEqual(6, len(sources))
+
+class TestDeadline(TestCase):
+    """Test limiting a client's requests to the time left"""
+    def setUp(self):
+        self.fake = FakeCluster(mappings={'index-1': MAPPING}, usage={'index-1': {}})
+        stack = ExitStack()
+        self.addCleanup(stack.close)
+        self.url = stack.enter_context(FakeElasticsearch(self.fake))
+    def test_time_left(self):
+        """A request only has the time left, however long the client's own timeout"""
+        client = Deadline(0.5).limit(Elasticsearch(self.url, request_timeout=30))
+        self.fake.latency = 2.0
+        start = time.monotonic()
+        with self.assertRaises(ConnectionTimeout):
+            client.indices.get_mapping(index='index-1')
+        self.assertLess(time.monotonic() - start, 1.5)
+    def test_expired(self):
+        """Once the time has run out, no request is made, until the deadline is lifted"""
+        deadline = Deadline(0.0)
+        client = deadline.limit(Elasticsearch(self.url))
+        with self.assertRaises(TimeoutException):
+            client.options(request_timeout=10).indices.get_mapping(index='index-1')
+        self.assertEqual({}, self.fake.requests)
+        deadline.lift()
+        self.assertIn('index-1', client.indices.get_mapping(index='index-1'))
+    def test_stream(self):
+        """A streamed request, which bypasses the client, only has the time left too"""
+        deadline = Deadline(0.5)
+        client = deadline.limit(Elasticsearch(self.url, request_timeout=30))
+        shards = list(stream_field_usage(client, 'index-1', deadline=deadline))
+        self.assertEqual({'index-1'}, {idx for idx, _ in shards})
+        self.fake.latency = 2.0
+        start = time.monotonic()
+        with self.assertRaises(TimeoutException):
+            list(stream_field_usage(client, 'index-1', deadline=deadline))
+        self.assertLess(time.monotonic() - start, 1.5)
+        self.fake.latency = 0.0
+        requests = self.fake.requests['/index-1/_field_usage_stats']
+        with self.assertRaises(TimeoutException):
+            list(stream_field_usage(client, 'index-1', deadline=deadline))
+        self.assertEqual(requests, self.fake.requests['/index-1/_field_usage_stats'])
+
+class TestGetClusters(TestCase):
+    """Test reading named clusters from the configuration file"""
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.params = {'config': os.path.join(tmpdir.name, 'config.yml')}
+        with open(self.params['config'], 'w', encoding='utf-8') as fdesc:
+            fdesc.write(CONFIG)
+    def test_patterns(self):
+        """Clusters are selected by name, with wildcards"""
+        clusters = get_clusters(self.params, ['prod-*'])
+        self.assertEqual(['prod-east', 'prod-west'], sorted(clusters))
+        client_args, _, timeout = clusters['prod-east']
+        self.assertEqual('http://127.0.0.1:9201', client_args.hosts)
+        self.assertEqual(30.0, timeout)
+        self.assertIsNone(clusters['prod-west'][2])
+        _, other_args, _ = get_clusters(self.params, ['staging'])['staging']
+        self.assertTrue(other_args.skip_version_test)
+    def test_no_match(self):
+        """Naming no configured cluster is a configuration error"""
+        with self.assertRaises(ConfigurationException):
+            get_clusters(self.params, ['dev'])
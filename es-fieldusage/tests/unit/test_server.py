@@ -0,0 +1,153 @@
+"""Test the long-running server mode"""
+import json
+import os
+import socket
+import tempfile
+import threading
+from http.client import HTTPConnection
+from unittest import TestCase
+from unittest.mock import patch
+from elasticsearch8 import Elasticsearch
+from es_fieldusage.helpers.cache import MappingCache
+from es_fieldusage.main import FieldUsage
+from es_fieldusage.server import UsageServer, make_server
+from benchmarks.fake_es import FakeCluster, FakeElasticsearch
+
+MAPPINGS = {
+    'index-1': {'a': {'type': 'keyword'}, 'b': {'properties': {'c': {'type': 'long'}}}},
+    'index-2': {'a': {'type': 'keyword'}, 'd': {'type': 'text'}},
+}
+USAGE = {'index-1': {'a': 4, 'b.c': 1}, 'index-2': {'a': 2}}
+
+class UnixHTTPConnection(HTTPConnection):
+    """An HTTP connection over a Unix socket"""
+    def __init__(self, path):
+        super().__init__('localhost')
+        self.path = path
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+class TestServer(TestCase):
+    """Test querying the server over HTTP"""
+    def setUp(self):
+        self.cluster = FakeCluster(mappings=MAPPINGS, usage=USAGE)
+        self.fake = FakeElasticsearch(self.cluster)
+        self.url = self.fake.__enter__()
+        self.addCleanup(self.fake.__exit__, None, None, None)
+        self.app = UsageServer(Elasticsearch(hosts=self.url), mapping_cache=MappingCache(None))
+    def start(self, **kwargs):
+        """Serve in a thread, until the test ends"""
+        httpd = make_server(self.app, **kwargs)
+        thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+        thread.start()
+        def stop():
+            httpd.shutdown()
+            httpd.server_close()
+            self.app.close()
+        self.addCleanup(stop)
+        return httpd
+    def get(self, conn, path):
+        """Return the status, content type and body of GET ``path``"""
+        conn.request('GET', path)
+        response = conn.getresponse()
+        return response.status, response.getheader('Content-Type'), response.read()
+    def test_report(self):
+        """The report matches FieldUsage, and is answered again without fetching any mapping"""
+        httpd = self.start(listen='127.0.0.1:0')
+        conn = HTTPConnection(*httpd.server_address)
+        status, ctype, body = self.get(conn, '/report/index-*')
+        self.assertEqual((200, 'application/json'), (status, ctype))
+        data = json.loads(body)
+        expected = FieldUsage(
+            None, None, 'index-*', client=Elasticsearch(hosts=self.url)).report
+        self.assertEqual(['index-1', 'index-2'], data['indices'])
+        self.assertEqual(expected['field_count'], data['field_count'])
+        self.assertEqual(expected['accessed_count'], data['accessed_count'])
+        self.assertEqual(dict(expected['accessed'].items()), data['accessed'])
+        self.assertEqual(dict(expected['unaccessed'].items()), data['unaccessed'])
+        mappings = self.cluster.requests['/index-1,index-2/_mapping']
+        # Again, on the same connection
+        _, _, body = self.get(conn, '/report/index-*?sections=accessed')
+        self.assertEqual(data['accessed'], json.loads(body)['accessed'])
+        self.assertNotIn('unaccessed', json.loads(body))
+        self.assertEqual(mappings, self.cluster.requests['/index-1,index-2/_mapping'])
+        conn.close()
+    def test_results(self):
+        """Per-index results are returned as JSON, or NDJSON rows"""
+        httpd = self.start(listen='127.0.0.1:0')
+        conn = HTTPConnection(*httpd.server_address)
+        _, _, body = self.get(conn, '/results/index-*')
+        self.assertEqual({'a': 4, 'b.c': 1}, json.loads(body)['index-1'])
+        self.assertEqual({'a': 2, 'd': 0}, json.loads(body)['index-2'])
+        status, ctype, body = self.get(conn, '/results/index-2?format=ndjson&sections=unaccessed')
+        self.assertEqual((200, 'application/x-ndjson'), (status, ctype))
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(
+            [{'index': 'index-2', 'section': 'unaccessed', 'field': 'd', 'count': 0}], rows)
+        conn.close()
+    def test_errors(self):
+        """Bad requests, unknown routes, and failed queries each have their own status"""
+        httpd = self.start(listen='127.0.0.1:0')
+        conn = HTTPConnection(*httpd.server_address)
+        self.assertEqual(400, self.get(conn, '/report/index-*?format=yaml')[0])
+        self.assertEqual(400, self.get(conn, '/report/index-*?sections=other')[0])
+        self.assertEqual(404, self.get(conn, '/nothing/here')[0])
+        with patch.object(self.app, 'report', side_effect=RuntimeError('boom')):
+            with self.assertLogs('es_fieldusage.server', level='ERROR'):
+                status, _, body = self.get(conn, '/report/index-*')
+        self.assertEqual((500, 'boom'), (status, json.loads(body)['error']))
+        conn.close()
+    def test_health_and_metrics(self):
+        """The server counts the queries answered, and the requests made for them"""
+        httpd = self.start(listen='127.0.0.1:0')
+        conn = HTTPConnection(*httpd.server_address)
+        self.get(conn, '/report/index-*')
+        health = json.loads(self.get(conn, '/_health')[2])
+        self.assertEqual(
+            ('ok', 1, 2), (health['status'], health['queries'], health['cached_mappings']))
+        apis = json.loads(self.get(conn, '/_metrics')[2])['apis']
+        self.assertEqual(1, apis['_mapping']['requests'])
+        self.assertEqual(1, apis['_field_usage_stats']['requests'])
+        conn.close()
+    def test_unix_socket(self):
+        """The server answers on a Unix socket, which is removed when it is closed"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'fieldusage.sock')
+            # A socket left behind by an earlier server is replaced
+            stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            stale.bind(path)
+            stale.close()
+            httpd = self.start(unix_socket=path)
+            self.assertEqual(0o600, os.stat(path).st_mode & 0o777)
+            conn = UnixHTTPConnection(path)
+            status, _, body = self.get(conn, '/report/index-1')
+            self.assertEqual((200, ['index-1']), (status, json.loads(body)['indices']))
+            conn.close()
+            httpd.shutdown()
+            httpd.server_close()
+            self.assertFalse(os.path.exists(path))
+
+class TestCacheSaving(TestCase):
+    """Test the mapping cache options a long-running server uses"""
+    def test_memory_only(self):
+        """A cache with no file keeps its entries in memory"""
+        cache = MappingCache(None, max_entries=1)
+        cache.put('index-1', 'hash1', ['a'])
+        cache.put('index-2', 'hash2', ['b'])
+        cache.save()
+        self.assertEqual({'index-2': 'hash2'}, cache.entries)
+        self.assertEqual(('hash2', ['b']), cache.get('index-2'))
+    def test_save_interval(self):
+        """The file is saved at most once per interval, unless forced"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'mappings.json')
+            cache = MappingCache(filename, save_interval=3600)
+            cache.put('index-1', 'hash1', ['a'])
+            cache.save()
+            cache.put('index-2', 'hash2', ['b'])
+            cache.save()
+            self.assertEqual(1, len(MappingCache(filename).get('index-1')[1]))
+            self.assertIsNone(MappingCache(filename).get('index-2'))
+            cache.save(force=True)
+            self.assertEqual(('hash2', ['b']), MappingCache(filename).get('index-2'))
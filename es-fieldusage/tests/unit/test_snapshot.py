@@ -0,0 +1,54 @@
+"""Test snapshot functions"""
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+from es_fieldusage.exceptions import ConfigurationException
+from es_fieldusage.helpers.snapshot import diff, load_snapshot, save_snapshot
+from es_fieldusage.helpers.store import UsageStore
+
+def store_of(data, tracking):
+    """Return a UsageStore of ``data`` with the shard tracking signature ``tracking``"""
+    store = UsageStore()
+    for idx, counts in data.items():
+        store[idx] = counts
+        store.tracking[idx] = tracking
+    return store
+
+class TestSnapshot(TestCase):
+    """Test saving, loading and comparing snapshots"""
+    def test_round_trip(self):
+        """A saved snapshot loads back identically"""
+        store = store_of({'index-1': {'a': 3, 'b': 0}, 'index-2': {}, 'index-3': {'c': 1}}, 'x')
+        with TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'snap')
+            filters = {'include': ['host.*'], 'exclude': []}
+            save_snapshot(filename, store, '2024-01-01T00:00:00+00:00', filters)
+            loaded, timestamp, loaded_filters = load_snapshot(filename)
+            self.assertEqual(['snap'], os.listdir(tmpdir))
+        self.assertEqual('2024-01-01T00:00:00+00:00', timestamp)
+        self.assertEqual(filters, loaded_filters)
+        self.assertEqual(dict(store.items()), dict(loaded.items()))
+        self.assertEqual(store.tracking, loaded.tracking)
+    def test_not_a_snapshot(self):
+        """Any other file is rejected"""
+        with TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'snap')
+            with open(filename, 'w', encoding='utf-8') as fdesc:
+                fdesc.write('{}\n')
+            with self.assertRaises(ConfigurationException):
+                load_snapshot(filename)
+    def test_diff(self):
+        """Deltas are the increase, or all counts for a new index or one with shards reset"""
+        previous = store_of({'index-1': {'b': 2, 'a': 5}, 'index-2': {'a': 9, 'c': 3}}, 'x')
+        current = store_of({'index-1': {'a': 7, 'b': 2, 'd': 1}, 'index-3': {'a': 4}}, 'x')
+        current['index-2'] = {'a': 2, 'c': 3}
+        current.tracking['index-2'] = 'y'
+        expected = {
+            'index-1': {'a': 2, 'b': 0, 'd': 1}, 'index-2': {'a': 2, 'c': 3}, 'index-3': {'a': 4}}
+        deltas, resets = diff(current, previous)
+        self.assertEqual(expected, dict(deltas.items()))
+        self.assertEqual(['index-2'], resets)
+        self.assertIs(current.vocab, deltas.vocab)
+        with patch('es_fieldusage.helpers.snapshot.np', None):
+            self.assertEqual(expected, dict(diff(current, previous)[0].items()))
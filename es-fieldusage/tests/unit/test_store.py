@@ -0,0 +1,57 @@
+"""Test store classes"""
+from unittest import TestCase
+from unittest.mock import patch
+from es_fieldusage.helpers.store import FieldCounts, FieldVocabulary, UsageStore
+from es_fieldusage.helpers.utils import sort_by_value, sum_dict_values
+
+DATA = {'b': 5, 'a': 3, 'c': 0, 'd': 0}
+
+class TestFieldCounts(TestCase):
+    """Test the FieldCounts class"""
+    def setUp(self):
+        self.counts = FieldCounts.from_items(FieldVocabulary(), DATA.items())
+    def test_dictionary_view(self):
+        """FieldCounts behaves like the dictionary it was built from, in the same order"""
+        self.assertEqual(DATA, self.counts)
+        self.assertEqual(list(DATA.items()), list(self.counts.items()))
+        self.assertEqual(list(DATA.values()), list(self.counts.values()))
+        self.assertEqual(3, self.counts['a'])
+        self.assertNotIn('e', self.counts)
+    def test_accessed(self):
+        """Sorted counts split into accessed and unaccessed views"""
+        self.assertEqual({'b': 5, 'a': 3}, self.counts.accessed())
+        self.assertEqual(['c', 'd'], list(self.counts.unaccessed()))
+        self.assertEqual(0, len(self.counts.unaccessed().accessed()))
+
+class TestUsageStore(TestCase):
+    """Test the UsageStore class"""
+    def test_shared_vocabulary(self):
+        """Indices share one vocabulary, and read back as they were stored"""
+        store = UsageStore()
+        store['index-1'] = DATA
+        store['index-2'] = {'a': 1, 'e': 2}
+        self.assertEqual(['b', 'a', 'c', 'd', 'e'], store.vocab.names)
+        self.assertEqual(DATA, store['index-1'])
+        self.assertEqual(['index-1', 'index-2'], list(store))
+        self.assertEqual(6 * 12, store.nbytes())
+    def test_field_ids(self):
+        """All field ids, or only accessed field ids, are found without summing"""
+        store = UsageStore()
+        store['index-1'] = DATA
+        store['index-2'] = {'a': 0, 'c': 1}
+        self.assertEqual({0, 1, 2, 3}, store.field_ids())
+        self.assertEqual({'a', 'b', 'c'}, {store.vocab.names[fid] for fid in store.field_ids(True)})
+    def test_totals(self):
+        """Totals match summing dictionaries, sorted by count then name, with or without NumPy"""
+        store = UsageStore()
+        store['index-1'] = {'z': 2, 'b': 5, 'a': 0, 'c': 0}
+        store['index-2'] = {'c': 4, 'y': 1, 'b': 0}
+        store['index-3'] = {}
+        expected = list(sort_by_value(sum_dict_values(store)).items())
+        self.assertEqual([('b', 5), ('c', 4), ('z', 2), ('y', 1), ('a', 0)], expected)
+        self.assertEqual(expected, list(store.totals().items()))
+        with patch('es_fieldusage.helpers.store.np', None):
+            self.assertEqual(expected, list(store.totals().items()))
+    def test_empty_totals(self):
+        """An empty store has empty totals"""
+        self.assertEqual({}, UsageStore().totals())
@@ -0,0 +1,44 @@
+"""Test stream helper functions"""
+import json
+from unittest import TestCase
+from es_fieldusage.exceptions import ResultNotExpected
+from es_fieldusage.helpers.stream import iter_shards
+
+RESPONSE = {
+    '_shards': {'total': 3, 'successful': 3, 'failed': 0},
+    'index-1': {
+        'shards': [
+            {'tracking_id': 'a', 'stats': {'fields': {'_id': {'any': 1}, 'f\\"{[': {'any': 2}}}},
+            {'tracking_id': 'b', 'stats': {'fields': {'ünïcode': {'any': 3}}}},
+        ]
+    },
+    'index-2': {'shards': [{'tracking_id': 'c', 'stats': {'fields': {}}}]},
+    'index-3': {'shards': []},
+}
+
+def expected():
+    """Return the (index, shard) tuples iter_shards should yield for RESPONSE"""
+    retval = []
+    for idx, value in RESPONSE.items():
+        if idx == '_shards':
+            continue
+        retval.append((idx, None))
+        retval.extend((idx, shard) for shard in value['shards'])
+    return retval
+
+def chunked(data, size):
+    """Split bytes ``data`` into chunks of ``size``"""
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+class TestIterShards(TestCase):
+    """Test the iter_shards function"""
+    def test_chunk_sizes(self):
+        """Shards are yielded in order regardless of where chunk boundaries fall"""
+        data = json.dumps(RESPONSE, indent=1, ensure_ascii=False).encode('utf-8')
+        for size in (1, 2, 7, 64, len(data)):
+            self.assertEqual(expected(), list(iter_shards(chunked(data, size))))
+    def test_truncated(self):
+        """A truncated response raises an exception"""
+        data = json.dumps(RESPONSE).encode('utf-8')
+        with self.assertRaises(ResultNotExpected):
+            list(iter_shards(chunked(data[:-30], 16)))
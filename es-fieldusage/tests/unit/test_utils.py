@@ -1,3 +1,71 @@
 """Test utils functions"""
-from es_fieldusage.helpers.utils import override_settings
+from unittest import TestCase
+from es_client.defaults import click_options as es_client_options
+from es_fieldusage.defaults import CLIENT_OPTIONS, click_options
+from es_fieldusage.helpers.utils import (
+    batch_indices, cli_opts, client_opts, convert_mapping, detuple, flatten_mapping,
+    get_value_from_path, iterate_paths, override_settings)
 
+MAPPING = {
+    '@timestamp': {'type': 'date'},
+    'host': {
+        'properties': {
+            'name': {'type': 'keyword'},
+            'os': {'properties': {'family': {'type': 'keyword'}}},
+        }
+    },
+    'message': {'type': 'text', 'fields': {'keyword': {'type': 'keyword'}}},
+    'empty': {'properties': {}},
+}
+
+class TestBatchIndices(TestCase):
+    """Test the batch_indices function"""
+    def test_max_count(self):
+        """Batches are split by count, in order"""
+        result = list(batch_indices(['a', 'b', 'c', 'd', 'e'], max_count=2))
+        self.assertEqual([['a', 'b'], ['c', 'd'], ['e']], result)
+    def test_max_length(self):
+        """Batches are split when the comma-separated length would be exceeded"""
+        result = list(batch_indices(['aaa', 'bbb', 'ccc'], max_length=7))
+        self.assertEqual([['aaa', 'bbb'], ['ccc']], result)
+
+class TestFlattenMapping(TestCase):
+    """Test the flatten_mapping function"""
+    def test_dotted_leaves(self):
+        """Leaves are keyed by dotted path in mapping order with a value of 0"""
+        expected = {'@timestamp': 0, 'host.name': 0, 'host.os.family': 0, 'message': 0}
+        self.assertEqual(expected, flatten_mapping(MAPPING))
+        self.assertEqual(list(expected.keys()), list(flatten_mapping(MAPPING).keys()))
+    def test_matches_nested_conversion(self):
+        """The flattened index has the same leaves as convert_mapping + iterate_paths"""
+        nested = convert_mapping(MAPPING)
+        legacy = {
+            '.'.join(detuple(path)): get_value_from_path(nested, path)
+            for path in iterate_paths(nested)
+        }
+        self.assertEqual(legacy, flatten_mapping(MAPPING))
+
+class TestOverrideSettings(TestCase):
+    """Test the override_settings function"""
+    def test_override(self):
+        """Only keys already in data are overridden"""
+        self.assertEqual({'a': 2}, override_settings({'a': 1}, {'a': 2, 'b': 3}))
+    def test_cli_opts_copy(self):
+        """An override only applies to the one option it is given for"""
+        default = click_options()['workers']['help']
+        _, kwargs = cli_opts('workers', override={'help': 'Something else'})
+        self.assertEqual('Something else', kwargs['help'])
+        self.assertEqual(default, cli_opts('workers')[1]['help'])
+    def test_client_opts(self):
+        """The client options are es_client's, and a hidden one is only shown when asked"""
+        self.assertEqual(list(es_client_options()), list(CLIENT_OPTIONS))
+        for name, settings in es_client_options().items():
+            self.assertEqual(
+                {key: value for key, value in settings.items() if key != 'type'},
+                {key: value for key, value in CLIENT_OPTIONS[name].items() if key != 'type'})
+        self.assertEqual(
+            (('--http_compress/--no-http_compress',), True),
+            (client_opts('http_compress', onoff={'on': '', 'off': 'no-'})[0],
+                client_opts('http_compress')[1]['hidden']))
+        self.assertFalse(client_opts('http_compress', show=True)[1]['hidden'])
+        self.assertTrue(CLIENT_OPTIONS['http_compress']['hidden'])
@@ -0,0 +1,34 @@
+"""Test writer functions"""
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from es_fieldusage.commands import file_content
+from es_fieldusage.helpers.store import FieldCounts, FieldVocabulary
+from es_fieldusage.helpers.writer import get_umask, write_files
+
+class TestWriteFiles(TestCase):
+    """Test the write_files function"""
+    def test_write_files(self):
+        """Every file is written whole, in order, with no temporary files left behind"""
+        with TemporaryDirectory() as tmpdir:
+            jobs = [
+                (os.path.join(tmpdir, f'file-{num}.csv'),
+                 lambda fdesc, n=num: fdesc.write(f'{n}\n'.encode('utf-8') * n))
+                for num in range(10)
+            ]
+            with open(jobs[3][0], 'w', encoding='utf-8') as fdesc:
+                fdesc.write('old contents, longer than the new contents\n')
+            self.assertEqual([job[0] for job in jobs], write_files(jobs, workers=4))
+            expected = sorted(f'file-{num}.csv' for num in range(10))
+            self.assertEqual(expected, sorted(os.listdir(tmpdir)))
+            for num, (filename, _) in enumerate(jobs):
+                with open(filename, 'r', encoding='utf-8') as fdesc:
+                    self.assertEqual(f'{num}\n' * num, fdesc.read())
+            self.assertEqual(0o666 & ~get_umask(), os.stat(jobs[0][0]).st_mode & 0o777)
+    def test_file_content(self):
+        """Accessed and unaccessed fields are both written to the same file"""
+        counts = FieldCounts.from_items(FieldVocabulary(), {'a': 2, 'b': 0}.items())
+        data = {'idx': {'accessed': counts.accessed(), 'unaccessed': counts.unaccessed()}}
+        both = file_content(data, 'idx', ['accessed', 'unaccessed'], True, ',')
+        self.assertEqual('a,2\nb,0\n', both)
+        self.assertEqual('b\n', file_content(data, 'idx', ['unaccessed'], False, ','))
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+Benchmark bulk indexing with cat_bulk.py
+
+Runs a local stand-in for the Elasticsearch _bulk endpoint, in another process, which takes
+--latency seconds per request, plus --doc-us microseconds per document, as a cluster's indexing
+would, and sends it generated _cat/indices documents with each combination of --threads and
+--chunk-sizes, printing the throughput of each in docs/s and MB/s.
+
+$ ./bench_ingest_cat_bulk.py --docs 200000 --threads 1,2,4,8 --chunk-sizes 500,2000
+"""
+import json
+import multiprocessing
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import click
+from elasticsearch8 import Elasticsearch
+import cat_bulk
+from bench_ingest_cat_file import cat_item
+from ingest_cat_file import bulkload, cat_documents
+
+class BulkHandler(BaseHTTPRequestHandler):
+    """Accept every bulk request, after the server's simulated indexing time"""
+    protocol_version = "HTTP/1.1"
+    # Otherwise each response waits for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def send_json(self, body):
+        """Send body as a JSON response, as Elasticsearch would"""
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("X-Elastic-Product", "Elasticsearch")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Answer the product check"""
+        self.send_json({"version": {"number": "8.10.0"}, "tagline": "You Know, for Search"})
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Index a bulk request, or create an index"""
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if not self.path.split("?")[0].endswith("/_bulk"):
+            self.send_json({"acknowledged": True})
+            return
+        # Every action is an index action, followed by its document
+        count = body.count(b"\n") // 2
+        time.sleep(self.server.latency + count * self.server.doc_seconds)
+        item = {"index": {"status": 201, "result": "created"}}
+        self.send_json({"took": 1, "errors": False, "items": [item] * count})
+
+    do_PUT = do_POST
+
+def serve(latency, doc_seconds, ports):
+    """Serve the stand-in bulk endpoint on a free port, which is put on the ports queue"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), BulkHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.doc_seconds = doc_seconds
+    ports.put(server.server_port)
+    server.serve_forever()
+
+def documents(count):
+    """Return count generated _cat documents, normalized as ingest_cat_file.py would"""
+    rng = random.Random(42)
+    return list(cat_documents(cat_item(num, rng) for num in range(count)))
+
+@click.command()
+@click.option("--docs", default=200000, show_default=True, help="Documents per run")
+@click.option("--threads", "threads_list", default="1,2,4,8", show_default=True, help="Comma-separated thread counts")
+@click.option("--chunk-sizes", default="500,2000", show_default=True, help="Comma-separated documents per bulk request")
+@click.option("--latency", default=0.01, show_default=True, help="Seconds per bulk request")
+@click.option("--doc-us", default=20.0, show_default=True, help="Microseconds of indexing per document")
+def run(docs, threads_list, chunk_sizes, latency, doc_us):
+    """Print the throughput of each thread count and chunk size"""
+    # In its own process, so that it does not compete with the client for the GIL
+    ports = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(latency, doc_us / 1e6, ports), daemon=True)
+    server.start()
+    client = Elasticsearch(hosts="http://127.0.0.1:{0}".format(ports.get()))
+    generated = documents(docs)
+    try:
+        for chunk_size in [int(value) for value in chunk_sizes.split(",")]:
+            for threads in [int(value) for value in threads_list.split(",")]:
+                stats = cat_bulk.send(
+                    client, bulkload("bench", generated), threads=threads, chunk_size=chunk_size)
+                click.echo("chunk_size={0:<6} threads={1:<3}: {2}".format(chunk_size, threads, stats))
+    finally:
+        server.terminate()
+
+if __name__ == '__main__':
+    run()
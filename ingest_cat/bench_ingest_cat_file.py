@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+Benchmark reading _cat API dumps with ingest_cat_file.py
+
+Generates _cat/indices dumps of each of the given sizes, then reads each one in a fresh process,
+turning every index into a bulk action, either incrementally, as ingest_cat_file.py does, or
+with json.load and a list of documents, as it used to, and prints the time taken and the peak
+memory (RSS) of each. Incremental reading stays flat as the file grows. json.load, which needs
+several times the file size in memory, is skipped for files larger than --max-load-mb, and for
+NDJSON, which it cannot read.
+
+$ ./bench_ingest_cat_file.py --sizes-mb 100,1000,3000
+"""
+import json
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+import time
+import click
+from ingest_cat_file import bulkload, cat_documents, iter_cat_file
+
+def cat_item(num, rng):
+    """Return a generated _cat/indices item, as in the format=json output"""
+    pri_store = rng.randint(0, 50 * 1024 ** 3)
+    return {
+        "health": rng.choice(["green", "green", "green", "yellow"]),
+        "index": ".ds-metrics-app{0:04}-default-2022.10.20-{1:06}".format(num % 1000, num),
+        "uuid": "{0:022x}".format(rng.getrandbits(88)),
+        "pri": str(rng.randint(1, 5)),
+        "rep": "1",
+        "docs.count": str(rng.randint(0, 10 ** 9)),
+        "store.size": str(pri_store * 2),
+        "pri.store.size": str(pri_store),
+        "creation.date.string": "2022-10-20T13:19:14.865Z",
+    }
+
+def generate(filename, size, ndjson=False):
+    """Write generated _cat/indices output of about size bytes to filename, and return the count"""
+    rng = random.Random(42)
+    count = 0
+    with open(filename, "w", encoding="utf-8") as fileobj:
+        if not ndjson:
+            fileobj.write("[\n")
+        while fileobj.tell() < size:
+            if ndjson:
+                fileobj.write(json.dumps(cat_item(count, rng)) + "\n")
+            else:
+                if count:
+                    fileobj.write(",\n")
+                # As with &pretty
+                fileobj.write("  " + json.dumps(cat_item(count, rng), indent=2).replace("\n", "\n  "))
+            count += 1
+        if not ndjson:
+            fileobj.write("\n]\n")
+    return count
+
+def read_stream(filename):
+    """Read filename as ingest_cat_file.py does, and return the number of bulk actions"""
+    return sum(1 for _ in bulkload("bench", cat_documents(iter_cat_file(filename))))
+
+def read_load(filename):
+    """Read filename with json.load and a list of documents, and return the number of bulk actions"""
+    with open(filename, encoding="utf-8") as fileobj:
+        documents = list(cat_documents(json.load(fileobj)))
+    return sum(1 for _ in bulkload("bench", documents))
+
+def measure(func, filename, queue):
+    """Run func(filename), and put its result, the seconds taken and the peak RSS in MB on queue"""
+    start = time.perf_counter()
+    count = func(filename)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux
+    queue.put((count, elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+def run_child(func, filename):
+    """Run measure() for func in a fresh process, so each peak RSS is its own"""
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    child = context.Process(target=measure, args=(func, filename, queue))
+    child.start()
+    child.join()
+    if child.exitcode:
+        raise SystemExit("Reading {0} failed".format(filename))
+    return queue.get()
+
+@click.command()
+@click.option("--sizes-mb", default="100,1000,3000", show_default=True, help="Comma-separated dump sizes")
+@click.option("--max-load-mb", default=300, show_default=True, help="Largest dump to read with json.load")
+@click.option("--ndjson", is_flag=True, help="Generate NDJSON dumps instead of JSON arrays")
+@click.option("--directory", type=click.Path(file_okay=False), default=None, help="Where to write the dumps [default: a temporary directory]")
+def run(sizes_mb, max_load_mb, ndjson, directory):
+    """Time and measure the peak memory of reading _cat dumps of several sizes"""
+    with tempfile.TemporaryDirectory(dir=directory) as tmpdir:
+        for size_mb in [int(value) for value in sizes_mb.split(",")]:
+            filename = os.path.join(tmpdir, "cat-{0}mb.json".format(size_mb))
+            count = generate(filename, size_mb * 1024 ** 2, ndjson=ndjson)
+            modes = [("stream", read_stream)]
+            if size_mb <= max_load_mb and not ndjson:
+                modes.append(("json.load", read_load))
+            for label, func in modes:
+                actions, elapsed, peak = run_child(func, filename)
+                if actions != count:
+                    raise SystemExit("{0} read {1} of {2} indices".format(label, actions, count))
+                click.echo("{0:>6} MB {1:<9}: {2:9} indices {3:8.2f} s {4:8.1f} MB peak RSS".format(
+                    size_mb, label, count, elapsed, peak))
+            os.remove(filename)
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,69 @@
+"""Bulk indexing, with throughput reporting, shared by ingest_cat8.py and ingest_cat_file.py"""
+import time
+from elasticsearch8.helpers import expand_action, parallel_bulk, streaming_bulk
+
+CHUNK_SIZE = 500
+MAX_CHUNK_BYTES = 100 * 1024 * 1024
+
+class BulkStats:
+    """Documents sent and indexed, bytes of document source sent, and seconds taken by send()"""
+    def __init__(self):
+        self.total = 0
+        self.successes = 0
+        self.bytes = 0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def __str__(self):
+        elapsed = max(self.elapsed, 1e-9)
+        return "Indexed {0}/{1} documents in {2:.1f}s: {3:.0f} docs/s, {4:.2f} MB/s".format(
+            self.successes, self.total, self.elapsed, self.total / elapsed,
+            self.bytes / 1024 ** 2 / elapsed)
+
+def counting_expand(client, stats):
+    """
+    Return an expand_action callback which serializes each document source, as the bulk helpers
+    would, and adds its size to stats.bytes. The helpers send the serialized source as it is.
+    """
+    serializer = client.transport.serializers.get_serializer("application/json")
+
+    def expand(action):
+        header, data = expand_action(action)
+        if data is not None:
+            data = serializer.dumps(data)
+            stats.bytes += len(data)
+        return header, data
+    return expand
+
+def send(client, actions, threads=1, chunk_size=CHUNK_SIZE, max_chunk_bytes=MAX_CHUNK_BYTES,
+         progress=None, on_item=None, **kwargs):
+    """
+    Index actions in bulk requests of at most chunk_size documents and max_chunk_bytes each, with
+    streaming_bulk, or with parallel_bulk if threads is more than 1. If progress (a tqdm bar, or
+    anything with an update() method) is given, it is updated for each document, and if on_item
+    is given, it is called with whether each document succeeded, and its bulk response item.
+    Other keyword arguments, e.g. ignore_status, are passed to the bulk helper.
+
+    :returns: A BulkStats of the documents and bytes sent
+    """
+    stats = BulkStats()
+    kwargs.update({
+        "client": client,
+        "actions": actions,
+        "chunk_size": chunk_size,
+        "max_chunk_bytes": max_chunk_bytes,
+        "expand_action_callback": counting_expand(client, stats),
+    })
+    if threads > 1:
+        results = parallel_bulk(thread_count=threads, queue_size=threads * 2, **kwargs)
+    else:
+        results = streaming_bulk(**kwargs)
+    for ok, item in results:
+        stats.total += 1
+        stats.successes += ok
+        if progress is not None:
+            progress.update(1)
+        if on_item is not None:
+            on_item(ok, item)
+    stats.elapsed = time.perf_counter() - stats.started
+    return stats
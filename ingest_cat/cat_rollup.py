@@ -0,0 +1,153 @@
+"""Capacity rollups of _cat documents by index name pattern, shared by the ingest_cat scripts"""
+import math
+import re
+from fnmatch import translate
+
+METRICS = ("docs_count", "store_size", "pri_store_size")
+PERCENTILES = (50, 90, 99)
+# Values are counted in buckets GROWTH times as wide as the last
+GROWTH = 1.02
+LOG_GROWTH = math.log(GROWTH)
+
+def bucket_of(value):
+    """Return the Distribution bucket of value"""
+    return int(math.log(value) / LOG_GROWTH) + 1 if value >= 1 else 0
+
+def create_rollup_index(client, index, shards=1):
+    """Creates the rollup index in Elasticsearch if one isn't already there."""
+    stats = {
+        "properties": {
+            name: {"type": "long"}
+            for name in ["sum", "min", "max"] + ["p{0}".format(pct) for pct in PERCENTILES]
+        }
+    }
+    client.options(ignore_status=400, request_timeout=30).indices.create(
+        index=index,
+        settings={"number_of_shards": shards},
+        mappings={
+            "properties": {
+                "@timestamp": {"type": "date"},
+                "pattern": {"type": "keyword"},
+                "indices": {"type": "long"},
+                "docs_count": stats,
+                "store_size": stats,
+                "pri_store_size": stats,
+            }
+        },
+        wait_for_active_shards=shards,
+    )
+
+class Distribution:
+    """
+    The count, sum, minimum, maximum and percentiles of non-negative integers, in constant
+    memory. Values are counted in buckets 2% wide, on a log scale, so each percentile is within
+    1% of the exact value.
+    """
+    def __init__(self):
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+        # Bucket number -> values in it. Bucket 0 holds zeros, and bucket n >= 1 the values in
+        # [GROWTH ** (n - 1), GROWTH ** n)
+        self.buckets = {}
+
+    def add(self, value, bucket=None):
+        """Add value, which is in bucket, if known"""
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if bucket is None:
+            bucket = bucket_of(value)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def percentile(self, pct):
+        """Return the pct percentile (nearest rank), from the middle of its bucket"""
+        rank = max(1, math.ceil(pct / 100 * self.count))
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                if bucket == 0:
+                    return 0
+                value = round(GROWTH ** (bucket - 0.5))
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def as_dict(self):
+        """Return the sum, minimum, maximum and each of PERCENTILES, as p50 etc."""
+        values = {"sum": self.sum, "min": self.min, "max": self.max}
+        for pct in PERCENTILES:
+            values["p{0}".format(pct)] = self.percentile(pct) if self.count else None
+        return values
+
+class Rollups:
+    """
+    Totals, counts and percentiles of METRICS for the indices matching each of patterns (globs,
+    e.g. 'logs-*' or 'partial-*'), for writing to index. An index counts towards every pattern it
+    matches, so '*' rolls up every index.
+    """
+    def __init__(self, patterns, index):
+        self.index = index
+        self.patterns = [(pattern, re.compile(translate(pattern))) for pattern in patterns]
+        self.groups = {}
+        #: Rollup documents yielded by actions()
+        self.written = 0
+
+    def group(self, pattern):
+        """Return the index count and a Distribution per metric of pattern"""
+        if pattern not in self.groups:
+            self.groups[pattern] = {"indices": 0}
+            for metric in METRICS:
+                self.groups[pattern][metric] = Distribution()
+        return self.groups[pattern]
+
+    def add(self, doc):
+        """Add the stats of doc, a normalized _cat document, to each pattern its index matches"""
+        groups = [
+            self.group(pattern) for pattern, regex in self.patterns if regex.match(doc["index"])]
+        if not groups:
+            return
+        for group in groups:
+            group["indices"] += 1
+        for metric in METRICS:
+            # Closed indices have no stats
+            if doc[metric] is None:
+                continue
+            value = int(doc[metric])
+            bucket = bucket_of(value)
+            for group in groups:
+                group[metric].add(value, bucket)
+
+    def observe(self, documents):
+        """Yield each of documents, after adding its stats"""
+        for doc in documents:
+            self.add(doc)
+            yield doc
+
+    def actions(self, timestamp):
+        """
+        Yield an index action for a rollup document of each pattern, stamped with timestamp, and
+        start again with no stats. Its _id is the pattern and timestamp, so that rolling up the
+        same snapshot again overwrites it.
+        """
+        for pattern, group in sorted(self.groups.items()):
+            source = {"@timestamp": timestamp.isoformat(), "pattern": pattern}
+            source["indices"] = group["indices"]
+            for metric in METRICS:
+                source[metric] = group[metric].as_dict()
+            yield {
+                "_op_type": "index",
+                "_index": self.index,
+                "_id": "{0}-{1}".format(pattern, int(timestamp.timestamp())),
+                "_source": source,
+            }
+            self.written += 1
+        self.reset()
+
+    def reset(self):
+        """Start again with no stats"""
+        self.groups = {}
@@ -1,8 +1,11 @@
 #!/usr/bin/env python
+import time
+from datetime import datetime, timezone
 import tqdm
 import click
 from elasticsearch8 import Elasticsearch
-from elasticsearch8.helpers import streaming_bulk
+import cat_bulk
+import cat_rollup
 
 def create_index(client, index, shards=1):
     """Creates an index in Elasticsearch if one isn't already there."""
@@ -25,7 +28,150 @@ def create_index(client, index, shards=1):
         wait_for_active_shards=shards,
     )
 
-def bulkload(index, doclist):
+# Only the stats columns, which change between snapshots, are compared
+STATS = ("health", "pri", "rep", "docs_count", "store_size", "pri_store_size")
+NUMBERS = ("pri", "rep", "docs_count", "store_size", "pri_store_size")
+
+def create_snapshot_template(client, name, shards=1):
+    """
+    Creates an index template which makes name a data stream of snapshot documents, with a mapping
+    sized for a long history: the numbers are only kept as doc values, which is all that charts
+    and aggregations need, and the stored documents are compressed harder.
+    """
+    client.options(request_timeout=30).indices.put_index_template(
+        name=name,
+        index_patterns=[name],
+        data_stream={},
+        priority=200,
+        template={
+            "settings": {"number_of_shards": shards, "codec": "best_compression"},
+            "mappings": {
+                "dynamic": False,
+                "properties": {
+                    "@timestamp": {"type": "date"},
+                    "health": {"type": "keyword"},
+                    "index": {"type": "keyword"},
+                    "uuid": {"type": "keyword", "index": False},
+                    "pri": {"type": "short", "index": False},
+                    "rep": {"type": "short", "index": False},
+                    "docs_count": {"type": "long", "index": False},
+                    "store_size": {"type": "long", "index": False},
+                    "pri_store_size": {"type": "long", "index": False},
+                    "creation_date": {"type": "date", "index": False},
+                }
+            },
+        },
+    )
+
+def get_documents(client, exclude_partial, timestamp_field="@timestamp"):
+    """Read from the _cat API, and return a document per index, with the field names normalized"""
+    all_documents = client.cat.indices(bytes='b', format='json', h='health,index,uuid,pri,rep,docs.count,store.size,pri.store.size,creation.date.string')
+    documents = []
+    for doc in all_documents:
+        if exclude_partial:
+            if doc["index"].startswith('partial-'):
+                continue
+        doc["docs_count"] = doc.pop("docs.count")
+        doc["store_size"] = doc.pop("store.size")
+        doc["pri_store_size"] = doc.pop("pri.store.size")
+        doc[timestamp_field] = doc.pop("creation.date.string")
+        documents.append(doc)
+    return documents
+
+def snapshot_load(name, doclist, timestamp, last, current, rollups=None):
+    """
+    Yield a create action for each document in doclist whose stats have changed since the
+    snapshot in last (uuid -> stats), and add the stats of every document to current. Each
+    document is stamped with the snapshot timestamp, and its _id is the index uuid and the
+    timestamp, so that sending the same snapshot again does not duplicate it. With rollups, every
+    document, changed or not, is rolled up, and the rollup documents follow.
+    """
+    for doc in doclist:
+        for field in NUMBERS:
+            # Closed indices have no stats
+            if doc[field] is not None:
+                doc[field] = int(doc[field])
+        if rollups is not None:
+            rollups.add(doc)
+        stats = tuple(doc[field] for field in STATS)
+        current[doc["uuid"]] = stats
+        if last.get(doc["uuid"]) == stats:
+            continue
+        doc["@timestamp"] = timestamp.isoformat()
+        yield {
+            "_op_type": "create",
+            "_index": name,
+            "_id": "{0}-{1}".format(doc["uuid"], int(timestamp.timestamp())),
+            "_source": doc,
+        }
+    if rollups is not None:
+        yield from rollups.actions(timestamp)
+
+def take_snapshot(client, name, timestamp, last, exclude_partial, rollups=None, **bulk_args):
+    """
+    Write a snapshot of the indices which have changed since the snapshot in last (uuid -> stats)
+    to the data stream name, and update last to the stats of each index which was unchanged, or
+    whose document was written. An index whose document was not written, because a bulk request
+    failed, is sent again with the next snapshot.
+    """
+    current = {}
+    written = set()
+
+    def on_item(ok, item):
+        # A snapshot sent again conflicts with the documents already there
+        result = item.get("create")
+        if result is not None and (ok or result.get("status") == 409):
+            written.add(result["_id"].rpartition("-")[0])
+    try:
+        documents = get_documents(client, exclude_partial, timestamp_field="creation_date")
+        rolled_up = rollups.written if rollups is not None else 0
+        stats = cat_bulk.send(
+            client, snapshot_load(name, documents, timestamp, last, current, rollups),
+            ignore_status=409, on_item=on_item, **bulk_args)
+        if rollups is not None:
+            rolled_up = rollups.written - rolled_up
+        click.echo("{0}: {1} indices, {2} changed, {3} rollups. {4}".format(
+            timestamp.isoformat(), len(documents), stats.total - rolled_up, rolled_up, stats))
+    except Exception:
+        # Only what was written is known to have changed
+        last.update((uuid, current[uuid]) for uuid in written)
+        raise
+    finally:
+        if rollups is not None:
+            rollups.reset()
+    kept = {
+        uuid: values for uuid, values in current.items()
+        if last.get(uuid) == values or uuid in written}
+    last.clear()
+    last.update(kept)
+
+def snapshots(client, name, interval, exclude_partial, rollups=None, **bulk_args):
+    """
+    Write a snapshot of every index to the data stream name, then, if interval is set, another
+    every interval seconds, with only the indices which have changed since the last, until
+    interrupted. A failed snapshot is reported, and the indices it did not write are sent with
+    the next one.
+    """
+    last = {}
+    start = time.monotonic()
+    polls = 0
+    while True:
+        timestamp = datetime.now(timezone.utc).replace(microsecond=0)
+        try:
+            take_snapshot(client, name, timestamp, last, exclude_partial, rollups, **bulk_args)
+        except Exception as exc:
+            if not interval:
+                raise
+            click.echo("{0}: Snapshot failed: {1}".format(timestamp.isoformat(), exc), err=True)
+        if not interval:
+            return
+        polls += 1
+        time.sleep(max(0.0, start + polls * interval - time.monotonic()))
+
+def bulkload(index, doclist, rollups=None):
+    """Yield an index action for each document, then, with rollups, one for each rollup of them"""
+    if rollups is not None:
+        doclist = rollups.observe(doclist)
     for doc in doclist:
         yield {
             "_op_type": "index",
@@ -33,6 +179,8 @@ def bulkload(index, doclist):
             "_id": doc["uuid"],
             "_source": doc,
         }
+    if rollups is not None:
+        yield from rollups.actions(datetime.now(timezone.utc).replace(microsecond=0))
 
 @click.command()
 @click.option("--index", prompt=True, type=str, default="myindex")
@@ -40,38 +188,63 @@ def bulkload(index, doclist):
 @click.option("--username", prompt=True, hide_input=False, default="elastic")
 @click.option("--password", prompt=True, hide_input=True, confirmation_prompt=True)
 @click.option("--exclude_partial", is_flag=True, help="Exclude indices starting with 'partial-'")
-def ingest_cat_doc(index, es_url, username, password, exclude_partial):
-    """Read from the _cat API at es_url using provided credentials and insert into the named index"""
+@click.option("--threads", type=click.IntRange(min=1), default=1, show_default=True, help="Threads sending bulk requests (more than 1 uses parallel_bulk)")
+@click.option("--chunk_size", type=click.IntRange(min=1), default=cat_bulk.CHUNK_SIZE, show_default=True, help="Documents per bulk request")
+@click.option("--max_chunk_bytes", type=click.IntRange(min=1), default=cat_bulk.MAX_CHUNK_BYTES, show_default=True, help="Bytes per bulk request")
+@click.option("--rollup", multiple=True, help="Also write rollup documents, with the totals, counts and percentiles of the sizes of the indices matching this pattern, e.g. 'logs-*' (repeatable)")
+@click.option("--rollup_index", type=str, default=None, help="Index to write rollup documents to  [default: the --index name, with -rollups added]")
+@click.option("--snapshot", is_flag=True, help="Add time-stamped documents to a data stream named after --index, instead of overwriting one per index")
+@click.option("--interval", type=click.FloatRange(min=1), default=None, help="With --snapshot, take another snapshot every this many seconds, of only the changed indices, until interrupted")
+def ingest_cat_doc(index, es_url, username, password, exclude_partial, threads, chunk_size,
+                   max_chunk_bytes, rollup, rollup_index, snapshot, interval):
+    """
+    Read from the _cat API at es_url using provided credentials and insert into the named index
+
+    With --snapshot, every run adds a document per index, stamped with the time of the
+    snapshot, to the data stream named by --index, to keep the history of each index
+
+    With --rollup, the totals, counts and percentiles of the sizes of the indices matching each
+    pattern are computed as the documents are sent, and written as one document per pattern
+    and snapshot to the --rollup_index, for dashboards to read instead of aggregating every index
+    """
+    if interval and not snapshot:
+        raise click.UsageError("--interval needs --snapshot")
 
     try:
         client = Elasticsearch(hosts=es_url, basic_auth=(username, password))
     except Exception as exc:
         click.echo("Failed to connect to Elasticsearch: {0}".format(exc))
 
-    all_documents = client.cat.indices(bytes='b', format='json', h='health,index,uuid,pri,rep,docs.count,store.size,pri.store.size,creation.date.string')
-    documents = []
-    for doc in all_documents:
-        if exclude_partial:
-            if doc["index"].startswith('partial-'):
-                continue
-        doc["docs_count"] = doc.pop("docs.count")
-        doc["store_size"] = doc.pop("store.size")
-        doc["pri_store_size"] = doc.pop("pri.store.size")
-        doc["@timestamp"] = doc.pop("creation.date.string")
-        documents.append(doc)
+    rollups = None
+    if rollup:
+        rollups = cat_rollup.Rollups(rollup, rollup_index or "{0}-rollups".format(index))
+        click.echo("Creating index '{0}'".format(rollups.index))
+        cat_rollup.create_rollup_index(client, rollups.index)
+
+    if snapshot:
+        click.echo("Creating index template for data stream '{0}'".format(index))
+        create_snapshot_template(client, index)
+        try:
+            snapshots(
+                client, index, interval, exclude_partial, rollups=rollups, threads=threads,
+                chunk_size=chunk_size, max_chunk_bytes=max_chunk_bytes,
+            )
+        except KeyboardInterrupt:
+            click.echo("Stopped")
+        return
+
+    documents = get_documents(client, exclude_partial)
 
     click.echo("Creating index '{0}'".format(index))
     create_index(client, index)
 
     progress = tqdm.tqdm(unit="docs", total=len(documents))
-    successes = 0
-
-    for ok, action in streaming_bulk(
-        client=client, index=index, actions=bulkload(index, documents),
-    ):
-        progress.update(1)
-        successes += ok
-    click.echo("Indexed {0}/{1} documents".format(successes, len(documents)))
+    stats = cat_bulk.send(
+        client, bulkload(index, documents, rollups), threads=threads, chunk_size=chunk_size,
+        max_chunk_bytes=max_chunk_bytes, progress=progress,
+    )
+    progress.close()
+    click.echo(stats)
 
 if __name__ == '__main__':
     ingest_cat_doc()
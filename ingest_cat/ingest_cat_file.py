@@ -1,9 +1,18 @@
 #!/usr/bin/env python
+import glob
 import json
+import os
+import re
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from itertools import chain
 import tqdm
 import click
 from elasticsearch8 import Elasticsearch
-from elasticsearch8.helpers import streaming_bulk
+import cat_bulk
+import cat_rollup
 
 def create_index(client, index, shards=1):
     """Creates an index in Elasticsearch if one isn't already there."""
@@ -21,19 +30,251 @@ def create_index(client, index, shards=1):
                 "store_size": {"type": "long"},
                 "pri_store_size": {"type": "long"},
                 "@timestamp": {"type": "date"},
+                "creation_date": {"type": "date"},
             }
         },
         wait_for_active_shards=shards,
     )
 
-def bulkload(index, doclist):
+READ_SIZE = 1024 * 1024
+SUFFIXES = (".json", ".ndjson")
+# A date, and optionally a time, in a file name, e.g. cat-2023-01-15.json or cat_20230115T0600.json
+FILE_DATE = re.compile(
+    r"(\d{4})[-._]?(\d{2})[-._]?(\d{2})(?:[-._T ]?(\d{2})[-.:]?(\d{2})(?:[-.:]?(\d{2}))?)?")
+
+def iter_json_array(fileobj, read_size=READ_SIZE):
+    """
+    Yield each item of the JSON array in fileobj, reading read_size characters at a time, so
+    only one chunk of the file and one item are held in memory at once, however large the file
+    """
+    decoder = json.JSONDecoder()
+    # Skip any leading whitespace, however many reads it takes
+    buffer = ""
+    while not buffer:
+        chunk = fileobj.read(read_size)
+        if not chunk:
+            break
+        buffer = chunk.lstrip()
+    if not buffer.startswith("["):
+        raise ValueError("Expected a JSON array")
+    pos = 1
+    eof = False
+    while True:
+        # Skip to the start of the next item
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buffer) or eof:
+                break
+            buffer, pos = fileobj.read(read_size), 0
+            eof = not buffer
+        if pos >= len(buffer):
+            raise ValueError("Unterminated JSON array")
+        if buffer[pos] == "]":
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+            # A number cut off at the end of the buffer may still decode, so the item is only
+            # complete if what follows it is in the buffer too
+            complete = eof or (end < len(buffer) and buffer[end] in " \t\r\n,]")
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            complete = False
+        if complete:
+            yield item
+            pos = end
+            continue
+        # The item runs past the end of the buffer, so read more, and decode it again
+        chunk = fileobj.read(read_size)
+        eof = not chunk
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+def iter_ndjson(fileobj):
+    """Yield the JSON object on each non-blank line of fileobj"""
+    for line in fileobj:
+        if line.strip():
+            yield json.loads(line)
+
+def iter_cat_file(filename):
+    """
+    Yield each index in the _cat API output in filename, which is either a JSON array, as
+    returned with format=json, or NDJSON, one index per line
+    """
+    with open(filename, encoding="utf-8") as fileobj:
+        first = fileobj.read(1)
+        while first.isspace():
+            first = fileobj.read(1)
+        fileobj.seek(0)
+        if first == "[":
+            yield from iter_json_array(fileobj)
+        else:
+            yield from iter_ndjson(fileobj)
+
+def cat_documents(items, exclude_partial=False, timestamp=None):
+    """
+    Yield a document for each _cat API item, with the field names normalized. If timestamp is
+    given, it is the @timestamp of every document, and the creation date is kept as creation_date.
+    """
+    for doc in items:
+        if exclude_partial:
+            if doc["index"].startswith('partial-'):
+                continue
+        doc["docs_count"] = doc.pop("docs.count")
+        doc["store_size"] = doc.pop("store.size")
+        doc["pri_store_size"] = doc.pop("pri.store.size")
+        if timestamp is None:
+            doc["@timestamp"] = doc.pop("creation.date.string")
+        else:
+            doc["creation_date"] = doc.pop("creation.date.string")
+            doc["@timestamp"] = timestamp.isoformat()
+        yield doc
+
+def bulkload(index, doclist, timestamp=None, rollups=None, rollup_timestamp=None):
+    """
+    Yield an index action for each document. The _id is the index uuid, and the timestamp, if
+    given, so that the snapshots of an index taken at different times are kept apart.
+
+    With rollups, an index action for each rollup of the documents follows, stamped with
+    rollup_timestamp, or else the timestamp, or else the current time. Give the time of the file
+    the documents came from, so that loading it again overwrites the same rollups.
+    """
+    if rollups is not None:
+        doclist = rollups.observe(doclist)
     for doc in doclist:
         yield {
             "_op_type": "index",
             "_index": index,
-            "_id": doc["uuid"],
+            "_id": doc["uuid"] if timestamp is None else "{0}-{1}".format(
+                doc["uuid"], int(timestamp.timestamp())),
             "_source": doc,
         }
+    if rollups is not None:
+        if rollup_timestamp is None:
+            rollup_timestamp = timestamp or datetime.now(timezone.utc).replace(microsecond=0)
+        yield from rollups.actions(rollup_timestamp)
+
+def find_files(paths):
+    """
+    Return the files named by paths, each a file, a directory, in which every .json and .ndjson
+    file is read, or a glob pattern, e.g. 'archive/**/cat-2023-*.json', without duplicates
+    """
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            names = [
+                os.path.join(root, name) for root, _, files in os.walk(path)
+                for name in files if name.endswith(SUFFIXES)
+            ]
+        elif os.path.isfile(path):
+            names = [path]
+        else:
+            names = [name for name in glob.glob(path, recursive=True) if os.path.isfile(name)]
+        found.extend(sorted(os.path.abspath(name) for name in names))
+    return list(dict.fromkeys(found))
+
+def file_timestamp(filename):
+    """
+    Return the time of the _cat snapshot in filename: the date and time in the file name, if
+    there is one, or else the time the file was last modified, in UTC
+    """
+    match = FILE_DATE.search(os.path.basename(filename))
+    if match:
+        try:
+            return datetime(
+                *[int(value) for value in match.groups() if value is not None], tzinfo=timezone.utc)
+        except ValueError:
+            pass
+    return datetime.fromtimestamp(int(os.path.getmtime(filename)), timezone.utc)
+
+def parse_file(filename, exclude_partial, timestamp):
+    """Return a list of the documents in filename, for parse_files() to run in another process"""
+    return list(cat_documents(iter_cat_file(filename), exclude_partial, timestamp))
+
+def parse_files(filenames, exclude_partial, timestamp_from, workers=1):
+    """
+    Yield (filename, timestamp, documents) for each file in turn. The timestamp is None if
+    timestamp_from is "creation", so each index's creation date is used.
+
+    With more than 1 worker, files are parsed in that many processes, and at most two files per
+    worker are parsed ahead of the bulk requests, so memory use stays bounded. Otherwise each file
+    is read incrementally as its documents are sent.
+    """
+    def timestamp(filename):
+        return None if timestamp_from == "creation" else file_timestamp(filename)
+
+    if workers == 1:
+        for filename in filenames:
+            stamp = timestamp(filename)
+            yield filename, stamp, cat_documents(iter_cat_file(filename), exclude_partial, stamp)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for filename in filenames:
+            stamp = timestamp(filename)
+            future = pool.submit(parse_file, filename, exclude_partial, stamp)
+            pending.append((filename, stamp, future))
+            if len(pending) >= workers * 2:
+                filename, stamp, future = pending.popleft()
+                yield filename, stamp, future.result()
+        while pending:
+            filename, stamp, future = pending.popleft()
+            yield filename, stamp, future.result()
+
+class Checkpoint:
+    """
+    Record each file in checkpoint_file, one per line, once all of its documents have been
+    indexed, so that an interrupted backfill can be run again, and skip the files already done.
+
+    Pass it to cat_bulk.send() as its progress, which it updates in turn, if given.
+    """
+    def __init__(self, checkpoint_file=None, progress=None):
+        self.progress = progress
+        self.done = set()
+        self.fileobj = None
+        if checkpoint_file:
+            if os.path.exists(checkpoint_file):
+                with open(checkpoint_file, encoding="utf-8") as fileobj:
+                    self.done = {line.rstrip("\n") for line in fileobj if line.strip()}
+            self.fileobj = open(checkpoint_file, "a", encoding="utf-8")
+        # (documents generated up to the end of the file, filename), in the order sent
+        self.pending = deque()
+        self.generated = 0
+        self.indexed = 0
+        # parallel_bulk reads the actions in another thread
+        self.lock = threading.Lock()
+
+    def track(self, filename, actions):
+        """Yield actions, the documents of filename, and note where the file ends"""
+        for action in actions:
+            self.generated += 1
+            yield action
+        with self.lock:
+            self.pending.append((self.generated, filename))
+        self.record()
+
+    def update(self, count=1):
+        """Count indexed documents, and record each file whose documents have all been indexed"""
+        self.indexed += count
+        if self.progress is not None:
+            self.progress.update(count)
+        self.record()
+
+    def record(self):
+        """Record the files whose documents have all been indexed"""
+        with self.lock:
+            while self.pending and self.pending[0][0] <= self.indexed:
+                _, filename = self.pending.popleft()
+                self.done.add(filename)
+                if self.fileobj is not None:
+                    self.fileobj.write(filename + "\n")
+                    self.fileobj.flush()
+
+    def close(self):
+        """Close the checkpoint file"""
+        if self.fileobj is not None:
+            self.fileobj.close()
 
 @click.command()
 @click.option("--index", prompt=True, type=str, default="myindex")
@@ -41,43 +282,72 @@ def bulkload(index, doclist):
 @click.option("--username", prompt=True, hide_input=False, default="elastic")
 @click.option("--password", prompt=True, hide_input=True, confirmation_prompt=True)
 @click.option("--exclude_partial", is_flag=True, help="Exclude indices starting with 'partial-'")
-@click.argument("filename", nargs=1, type=click.Path(exists=True))
-def ingest_cat_doc(index, es_url, username, password, exclude_partial, filename):
+@click.option("--threads", type=click.IntRange(min=1), default=1, show_default=True, help="Threads sending bulk requests (more than 1 uses parallel_bulk)")
+@click.option("--chunk_size", type=click.IntRange(min=1), default=cat_bulk.CHUNK_SIZE, show_default=True, help="Documents per bulk request")
+@click.option("--max_chunk_bytes", type=click.IntRange(min=1), default=cat_bulk.MAX_CHUNK_BYTES, show_default=True, help="Bytes per bulk request")
+@click.option("--workers", type=click.IntRange(min=1), default=1, show_default=True, help="Processes reading files at once, when reading several")
+@click.option("--timestamp_from", type=click.Choice(["creation", "file"]), default=None, help="Take @timestamp from each index's creation date, or from the date in the file name, or its modification time  [default: creation for one file, file for several]")
+@click.option("--checkpoint", type=click.Path(dir_okay=False), default=None, help="Record the files done in this file, and skip those already recorded")
+@click.option("--rollup", multiple=True, help="Also write rollup documents, with the totals, counts and percentiles of the sizes of the indices matching this pattern, e.g. 'logs-*' (repeatable)")
+@click.option("--rollup_index", type=str, default=None, help="Index to write rollup documents to  [default: the --index name, with -rollups added]")
+@click.argument("filenames", nargs=-1, required=True)
+def ingest_cat_doc(index, es_url, username, password, exclude_partial, threads, chunk_size,
+                   max_chunk_bytes, workers, timestamp_from, checkpoint, rollup, rollup_index,
+                   filenames):
     """
-    Read _cat API JSON output stored in filename, ship to es_url using provided credentials
-    and insert into the named index
+    Read _cat API JSON or NDJSON output stored in filename, ship to es_url using provided
+    credentials and insert into the named index
+
+    The file is read incrementally, one index at a time, so memory use does not grow with its size
+
+    To backfill an archive of _cat output, give several files, directories, or quoted glob
+    patterns instead. Their documents are all sent through the same bulk requests.
+
+    With --rollup, the totals, counts and percentiles of the sizes of the indices matching each
+    pattern are computed as the documents are read, and written as one document per pattern
+    and file to the --rollup_index, for dashboards to read instead of aggregating every index.
     """
+    files = find_files(filenames)
+    if not files:
+        raise click.UsageError("No files found in {0}".format(", ".join(filenames)))
+    if timestamp_from is None:
+        single = len(filenames) == 1 and os.path.isfile(filenames[0])
+        timestamp_from = "creation" if single else "file"
 
     try:
         client = Elasticsearch(hosts=es_url, basic_auth=(username, password))
     except Exception as exc:
         click.echo("Failed to connect to Elasticsearch: {0}".format(exc))
-    
-    all_documents = json.load(open(filename,))
-    documents = []
-    for doc in all_documents:
-        if exclude_partial:
-            if doc["index"].startswith('partial-'):
-                continue
-        doc["docs_count"] = doc.pop("docs.count")
-        doc["store_size"] = doc.pop("store.size")
-        doc["pri_store_size"] = doc.pop("pri.store.size")
-        doc["@timestamp"] = doc.pop("creation.date.string")
-        documents.append(doc)
-            
 
     click.echo("Creating index '{0}'".format(index))
     create_index(client, index)
+    rollups = None
+    if rollup:
+        rollups = cat_rollup.Rollups(rollup, rollup_index or "{0}-rollups".format(index))
+        click.echo("Creating index '{0}'".format(rollups.index))
+        cat_rollup.create_rollup_index(client, rollups.index)
 
-    progress = tqdm.tqdm(unit="docs", total=len(documents))
-    successes = 0
-
-    for ok, action in streaming_bulk(
-        client=client, index=index, actions=bulkload(index, documents),
-    ):
-        progress.update(1)
-        successes += ok
-    click.echo("Indexed {0}/{1} documents".format(successes, len(documents)))
+    # The number of documents is not known until the whole file has been read
+    progress = tqdm.tqdm(unit="docs")
+    done = Checkpoint(checkpoint, progress=progress)
+    todo = [filename for filename in files if filename not in done.done]
+    if len(files) > 1 or len(todo) < len(files):
+        click.echo("Reading {0} files, {1} already done".format(len(todo), len(files) - len(todo)))
+    parsed = parse_files(todo, exclude_partial, timestamp_from, workers)
+    actions = chain.from_iterable(
+        done.track(filename, bulkload(
+            index, documents, stamp, rollups, rollup_timestamp=stamp or file_timestamp(filename)))
+        for filename, stamp, documents in parsed
+    )
+    try:
+        stats = cat_bulk.send(
+            client, actions, threads=threads, chunk_size=chunk_size,
+            max_chunk_bytes=max_chunk_bytes, progress=done,
+        )
+    finally:
+        done.close()
+        progress.close()
+    click.echo(stats)
 
 if __name__ == '__main__':
     ingest_cat_doc()
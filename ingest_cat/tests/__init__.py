@@ -0,0 +1 @@
+"""Tests of the ingest_cat scripts, run from this directory with python -m pytest"""
@@ -0,0 +1,123 @@
+"""Test the capacity rollups in cat_rollup.py"""
+import math
+import random
+from datetime import datetime, timezone
+from unittest import TestCase
+import cat_rollup
+
+TIMESTAMP = datetime(2023, 1, 15, tzinfo=timezone.utc)
+
+def doc(index, docs_count, store_size="200", pri_store_size="100"):
+    """Return a normalized _cat document, as cat_documents() yields"""
+    return {
+        "index": index, "docs_count": docs_count, "store_size": store_size,
+        "pri_store_size": pri_store_size,
+    }
+
+def exact(values, pct):
+    """Return the nearest rank pct percentile of values"""
+    values = sorted(values)
+    return values[max(1, math.ceil(pct / 100 * len(values))) - 1]
+
+class TestDistribution(TestCase):
+    """Test the Distribution class"""
+    def test_bucket_boundaries(self):
+        """Zero has its own bucket, and bucket n holds [GROWTH ** (n - 1), GROWTH ** n)"""
+        self.assertEqual(0, cat_rollup.bucket_of(0))
+        self.assertEqual(1, cat_rollup.bucket_of(1))
+        self.assertEqual(36, cat_rollup.bucket_of(2))
+        for value in [1, 2, 3, 50, 51, 999, 10 ** 6, 10 ** 12, 2 ** 53]:
+            bucket = cat_rollup.bucket_of(value)
+            self.assertLessEqual(cat_rollup.GROWTH ** (bucket - 1), value)
+            self.assertLess(value, cat_rollup.GROWTH ** bucket)
+    def test_add(self):
+        """A known bucket is used as it is"""
+        dist = cat_rollup.Distribution()
+        dist.add(1000, bucket=3)
+        self.assertEqual({3: 1}, dist.buckets)
+        dist.add(1000)
+        self.assertEqual({3: 1, cat_rollup.bucket_of(1000): 1}, dist.buckets)
+    def test_single_value(self):
+        """Every percentile of one value is that value, not the middle of its bucket"""
+        dist = cat_rollup.Distribution()
+        dist.add(12345)
+        self.assertEqual(
+            {"sum": 12345, "min": 12345, "max": 12345, "p50": 12345, "p90": 12345, "p99": 12345},
+            dist.as_dict())
+    def test_zeros(self):
+        """Zeros, e.g. empty indices, are counted exactly"""
+        dist = cat_rollup.Distribution()
+        for value in [0, 0, 0, 0, 0, 0, 0, 0, 0, 7]:
+            dist.add(value)
+        self.assertEqual(0, dist.percentile(50))
+        self.assertEqual(0, dist.percentile(90))
+        self.assertEqual(7, dist.percentile(99))
+    def test_percentiles(self):
+        """Each percentile is within 1% of the exact value"""
+        rng = random.Random(42)
+        values = [rng.randint(1, 50 * 1024 ** 3) for _ in range(10000)]
+        dist = cat_rollup.Distribution()
+        for value in values:
+            dist.add(value)
+        self.assertEqual(sum(values), dist.sum)
+        self.assertEqual(min(values), dist.min)
+        self.assertEqual(max(values), dist.max)
+        for pct in [1, 25, 50, 90, 99, 100]:
+            self.assertAlmostEqual(1, dist.percentile(pct) / exact(values, pct), delta=0.01)
+    def test_empty(self):
+        """With no values, there are no percentiles"""
+        self.assertEqual(
+            {"sum": 0, "min": None, "max": None, "p50": None, "p90": None, "p99": None},
+            cat_rollup.Distribution().as_dict())
+
+class TestRollups(TestCase):
+    """Test the Rollups class"""
+    def test_observe(self):
+        """Documents pass through unchanged, and count towards every pattern they match"""
+        rollups = cat_rollup.Rollups(["*", "partial-*", "logs-*"], "cat-rollups")
+        docs = [doc("logs-1", "10"), doc("partial-logs-2", "20"), doc("metrics-3", "30")]
+        self.assertEqual(docs, list(rollups.observe(iter(docs))))
+        self.assertEqual(["*", "logs-*", "partial-*"], sorted(rollups.groups))
+        self.assertEqual(3, rollups.groups["*"]["indices"])
+        self.assertEqual(60, rollups.groups["*"]["docs_count"].sum)
+        self.assertEqual(1, rollups.groups["partial-*"]["indices"])
+        self.assertEqual(10, rollups.groups["logs-*"]["docs_count"].sum)
+    def test_closed_index(self):
+        """A closed index, with no stats, is counted, but adds to none of the stats"""
+        rollups = cat_rollup.Rollups(["*"], "cat-rollups")
+        rollups.add(doc("closed", None, None, None))
+        rollups.add(doc("open", "5"))
+        group = rollups.groups["*"]
+        self.assertEqual(2, group["indices"])
+        self.assertEqual(1, group["docs_count"].count)
+        self.assertEqual(1, group["store_size"].count)
+    def test_actions(self):
+        """One action per pattern with documents, with an _id that is the same for a snapshot"""
+        rollups = cat_rollup.Rollups(["*", "partial-*"], "cat-rollups")
+        rollups.add(doc("logs-1", "10", "400", "200"))
+        rollups.add(doc("logs-2", "30", "200", "100"))
+        actions = list(rollups.actions(TIMESTAMP))
+        self.assertEqual(1, len(actions))
+        self.assertEqual(1, rollups.written)
+        self.assertEqual("cat-rollups", actions[0]["_index"])
+        self.assertEqual("*-{0}".format(int(TIMESTAMP.timestamp())), actions[0]["_id"])
+        source = actions[0]["_source"]
+        self.assertEqual("2023-01-15T00:00:00+00:00", source["@timestamp"])
+        self.assertEqual("*", source["pattern"])
+        self.assertEqual(2, source["indices"])
+        self.assertEqual(
+            {"sum": 40, "min": 10, "max": 30, "p50": 10, "p90": 30, "p99": 30},
+            source["docs_count"])
+        self.assertEqual(600, source["store_size"]["sum"])
+        self.assertEqual(300, source["pri_store_size"]["sum"])
+    def test_actions_reset(self):
+        """Each call to actions() starts again, so each snapshot is rolled up on its own"""
+        rollups = cat_rollup.Rollups(["*"], "cat-rollups")
+        rollups.add(doc("logs-1", "10"))
+        list(rollups.actions(TIMESTAMP))
+        self.assertEqual([], list(rollups.actions(TIMESTAMP)))
+        rollups.add(doc("logs-2", "5"))
+        actions = list(rollups.actions(TIMESTAMP))
+        self.assertEqual(1, actions[0]["_source"]["indices"])
+        self.assertEqual(5, actions[0]["_source"]["docs_count"]["sum"])
+        self.assertEqual(2, rollups.written)
@@ -0,0 +1,209 @@
+"""Test the snapshot mode of ingest_cat8.py"""
+import json
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+from click.testing import CliRunner
+from elastic_transport import SerializerCollection
+import ingest_cat8
+
+FIRST = datetime(2023, 1, 15, 6, 0, tzinfo=timezone.utc)
+SECOND = datetime(2023, 1, 15, 6, 5, tzinfo=timezone.utc)
+
+def cat_item(name, uuid, docs_count, health="green"):
+    """Return a _cat/indices item, as in the format=json output, or a closed index's"""
+    closed = docs_count is None
+    return {
+        "health": health, "index": name, "uuid": uuid, "pri": "1", "rep": "1",
+        "docs.count": None if closed else str(docs_count),
+        "store.size": None if closed else str(docs_count * 20),
+        "pri.store.size": None if closed else str(docs_count * 10),
+        "creation.date.string": "2022-10-20T13:19:14.865Z",
+    }
+
+class FakeClient:
+    """
+    Stand in for the Elasticsearch client: _cat/indices returns a copy of cat_items, and _bulk
+    keeps each document by _index and _id, rejecting a create with an _id already there with a
+    409, as a data stream does. The _bulk requests numbered in fail_requests, and the next
+    cat_failures _cat/indices requests, fail.
+    """
+    def __init__(self, cat_items):
+        self.cat_items = cat_items
+        self.documents = {}
+        self.requests = 0
+        self.fail_requests = set()
+        self.cat_failures = 0
+        self.transport = SimpleNamespace(serializers=SerializerCollection())
+        self.cat = SimpleNamespace(indices=self.cat_indices)
+        self.indices = MagicMock()
+
+    def cat_indices(self, **_):
+        """Return a copy of cat_items"""
+        if self.cat_failures:
+            self.cat_failures -= 1
+            raise ConnectionError("_cat/indices failed")
+        return json.loads(json.dumps(self.cat_items))
+
+    def options(self, **_):
+        """The same client, as client.options() returns a copy"""
+        return self
+
+    def bulk(self, operations, **_):
+        """Index each (header, source) pair of operations"""
+        self.requests += 1
+        if self.requests in self.fail_requests:
+            raise ConnectionError("_bulk failed")
+        items = []
+        for header, source in zip(operations[::2], operations[1::2]):
+            (op_type, meta), = json.loads(header).items()
+            docs = self.documents.setdefault(meta["_index"], {})
+            if op_type == "create" and meta["_id"] in docs:
+                items.append({op_type: {
+                    "_index": meta["_index"], "_id": meta["_id"], "status": 409,
+                    "error": {"type": "version_conflict_engine_exception"}}})
+                continue
+            docs[meta["_id"]] = json.loads(source)
+            items.append({op_type: {"_index": meta["_index"], "_id": meta["_id"], "status": 201}})
+        errors = any(item[key]["status"] >= 300 for item in items for key in item)
+        return SimpleNamespace(body={"took": 1, "errors": errors, "items": items})
+
+def documents(items):
+    """Return the documents get_documents() makes of items, for snapshot_load()"""
+    return ingest_cat8.get_documents(FakeClient(items), False, timestamp_field="creation_date")
+
+def load(items, timestamp, last):
+    """Return the actions snapshot_load() yields for items, and the stats of every index"""
+    current = {}
+    actions = list(ingest_cat8.snapshot_load("cat", documents(items), timestamp, last, current))
+    return actions, current
+
+class TestSnapshotLoad(TestCase):
+    """Test snapshot_load()"""
+    def test_diff(self):
+        """Only indices new or changed since the last snapshot are sent"""
+        first = [cat_item("logs-1", "u1", 10), cat_item("logs-2", "u2", 20)]
+        actions, last = load(first, FIRST, {})
+        self.assertEqual(["u1-1673762400", "u2-1673762400"], [act["_id"] for act in actions])
+        self.assertEqual({"create"}, {act["_op_type"] for act in actions})
+        source = actions[0]["_source"]
+        self.assertEqual("2023-01-15T06:00:00+00:00", source["@timestamp"])
+        self.assertEqual("2022-10-20T13:19:14.865Z", source["creation_date"])
+        self.assertEqual((10, 200, 100), (
+            source["docs_count"], source["store_size"], source["pri_store_size"]))
+        self.assertEqual({"u1", "u2"}, set(last))
+        # logs-1 is unchanged, logs-2 has grown, logs-3 is new, and logs-4 was deleted
+        second = [
+            cat_item("logs-1", "u1", 10), cat_item("logs-2", "u2", 25),
+            cat_item("logs-3", "u3", 0)]
+        actions, current = load(second, SECOND, last)
+        self.assertEqual(["u2-1673762700", "u3-1673762700"], [act["_id"] for act in actions])
+        self.assertEqual({"u1", "u2", "u3"}, set(current))
+        self.assertEqual({"u1", "u2"}, set(last))
+    def test_health_change(self):
+        """A change in health alone is a change"""
+        _, last = load([cat_item("a", "u1", 10)], FIRST, {})
+        actions, _ = load([cat_item("a", "u1", 10, health="yellow")], SECOND, last)
+        self.assertEqual(["u1-1673762700"], [act["_id"] for act in actions])
+    def test_closed_index(self):
+        """A closed index, with no stats, is sent once, and not again until it changes"""
+        closed = [cat_item("closed", "u1", None, health="red")]
+        actions, last = load(closed, FIRST, {})
+        self.assertIsNone(actions[0]["_source"]["docs_count"])
+        self.assertEqual([], load(closed, SECOND, last)[0])
+
+class TestSnapshots(TestCase):
+    """Test the --snapshot mode, against a fake client"""
+    def run_snapshot(self, client, now, *args):
+        """Run ingest_cat8.py --snapshot at time now, and return the result"""
+        clock = MagicMock()
+        clock.now.return_value = now
+        args = [
+            "--index", "cat-history", "--es_url", "http://127.0.0.1:9200", "--username",
+            "elastic", "--password", "secret", "--snapshot", *args,
+        ]
+        with patch.object(ingest_cat8, "Elasticsearch", return_value=client), \
+                patch.object(ingest_cat8, "datetime", clock):
+            return CliRunner().invoke(ingest_cat8.ingest_cat_doc, args)
+    def test_resend_conflicts(self):
+        """Sending the same snapshot again is a 409 conflict for each index, which is ignored"""
+        client = FakeClient([cat_item("logs-1", "u1", 10), cat_item("logs-2", "u2", 20)])
+        result = self.run_snapshot(client, FIRST)
+        self.assertEqual(0, result.exit_code, result.output)
+        self.assertIn("2 indices, 2 changed, 0 rollups. Indexed 2/2 documents", result.output)
+        self.assertEqual(
+            ["u1-1673762400", "u2-1673762400"], sorted(client.documents["cat-history"]))
+        client.indices.put_index_template.assert_called_once()
+        # A run at the same time, e.g. retried by a scheduler, does not duplicate the snapshot
+        result = self.run_snapshot(client, FIRST)
+        self.assertEqual(0, result.exit_code, result.output)
+        self.assertIn("Indexed 0/2 documents", result.output)
+        self.assertEqual(2, len(client.documents["cat-history"]))
+        # A later snapshot is kept alongside it
+        result = self.run_snapshot(client, SECOND)
+        self.assertIn("Indexed 2/2 documents", result.output)
+        self.assertEqual(4, len(client.documents["cat-history"]))
+    def run_polls(self, client, times, changes=None, *args):
+        """
+        Run ingest_cat8.py --snapshot --interval at each of times, after applying the function
+        changes, if given, to the poll number (from 1), and return the result
+        """
+        polls = []
+
+        def sleep(_):
+            polls.append(len(polls))
+            if len(polls) == len(times):
+                raise KeyboardInterrupt
+            if changes is not None:
+                changes(len(polls))
+        clock = MagicMock()
+        clock.now.side_effect = lambda tz: times[len(polls)]
+        args = [
+            "--index", "cat-history", "--es_url", "http://127.0.0.1:9200", "--username",
+            "elastic", "--password", "secret", "--snapshot", "--interval", "300", *args,
+        ]
+        with patch.object(ingest_cat8, "Elasticsearch", return_value=client), \
+                patch.object(ingest_cat8, "datetime", clock), \
+                patch.object(ingest_cat8.time, "sleep", sleep):
+            return CliRunner(mix_stderr=False).invoke(ingest_cat8.ingest_cat_doc, args)
+    def test_interval(self):
+        """With --interval, each later poll only sends the indices which have changed"""
+        client = FakeClient([cat_item("logs-1", "u1", 10), cat_item("logs-2", "u2", 20)])
+
+        def changes(_):
+            client.cat_items[1] = cat_item("logs-2", "u2", 30)
+        result = self.run_polls(client, [FIRST, SECOND], changes)
+        self.assertEqual(0, result.exit_code, result.output)
+        self.assertIn("2 indices, 2 changed", result.output)
+        self.assertIn("2 indices, 1 changed", result.output)
+        self.assertIn("Stopped", result.output)
+        self.assertEqual(
+            ["u1-1673762400", "u2-1673762400", "u2-1673762700"],
+            sorted(client.documents["cat-history"]))
+    def test_failed_polls(self):
+        """A failed poll is reported, polling goes on, and what it did not write is sent again"""
+        client = FakeClient([cat_item("logs-1", "u1", 10), cat_item("logs-2", "u2", 20)])
+        # The second of the first poll's bulk requests, with logs-2, fails
+        client.fail_requests.add(2)
+        third = FIRST.replace(minute=10)
+
+        def changes(poll):
+            if poll == 1:
+                client.cat_failures = 1
+        result = self.run_polls(client, [FIRST, SECOND, third], changes, "--chunk_size", "1")
+        self.assertEqual(0, result.exit_code, result.output)
+        self.assertIn("2023-01-15T06:00:00+00:00: Snapshot failed: _bulk failed", result.stderr)
+        self.assertIn(
+            "2023-01-15T06:05:00+00:00: Snapshot failed: _cat/indices failed", result.stderr)
+        self.assertIn("2023-01-15T06:10:00+00:00: 2 indices, 1 changed", result.stdout)
+        self.assertIn("Stopped", result.stdout)
+        self.assertEqual(
+            ["u1-1673762400", "u2-1673763000"], sorted(client.documents["cat-history"]))
+    def test_failed_snapshot(self):
+        """Without --interval, a failed snapshot is an error"""
+        client = FakeClient([cat_item("logs-1", "u1", 10)])
+        client.cat_failures = 1
+        result = self.run_snapshot(client, FIRST)
+        self.assertEqual(1, result.exit_code)
+        self.assertIsInstance(result.exception, ConnectionError)
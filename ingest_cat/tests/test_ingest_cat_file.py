@@ -0,0 +1,219 @@
+"""Test ingest_cat_file.py"""
+import io
+import json
+import os
+from datetime import datetime, timezone
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+from click.testing import CliRunner
+import cat_bulk
+import cat_rollup
+import ingest_cat_file
+
+ITEM = {
+    "health": "green", "index": "logs-1", "uuid": "abc", "pri": "1", "rep": "1",
+    "docs.count": "10", "store.size": "200", "pri.store.size": "100",
+    "creation.date.string": "2022-10-20T13:19:14.865Z",
+}
+
+# A chunk boundary may fall anywhere in these: inside strings, numbers and nested arrays
+ITEMS = [
+    {"index": "logs-1", "docs.count": "1500", "store.size": "2.5"},
+    {"index": "with \"quotes\", commas] and [brackets", "docs.count": "0"},
+    {"index": "unicode-éè", "pri": 1.25, "rep": None, "tags": [1, [2, 3]]},
+    1500.75,
+    "a string, with ] in it",
+]
+
+def read_array(text, read_size):
+    """Return the items of the JSON array text, read read_size characters at a time"""
+    return list(ingest_cat_file.iter_json_array(io.StringIO(text), read_size=read_size))
+
+class TestIterJsonArray(TestCase):
+    """Test iter_json_array()"""
+    def check_every_size(self, text, expected):
+        """Every read size, so that a chunk ends at every position in text, reads the same items"""
+        for read_size in range(1, len(text) + 2):
+            self.assertEqual(expected, read_array(text, read_size), "read_size={0}".format(
+                read_size))
+    def test_compact(self):
+        """A chunk boundary inside a string, a number or between items is read across"""
+        self.check_every_size(json.dumps(ITEMS), ITEMS)
+    def test_pretty(self):
+        """A chunk boundary inside the whitespace between items, as with &pretty, is skipped"""
+        self.check_every_size(json.dumps(ITEMS, indent=2), ITEMS)
+    def test_leading_whitespace(self):
+        """Whitespace before the array may fill several reads"""
+        self.check_every_size("\n  \t\r\n   " + json.dumps(ITEMS[:2]) + "\n\n", ITEMS[:2])
+    def test_empty_array(self):
+        """An empty array has no items"""
+        self.check_every_size("  [ \n ]  ", [])
+    def test_number_at_chunk_end(self):
+        """A number cut off at the end of a chunk is not read until it is complete"""
+        self.assertEqual([1500, 2], read_array("[1500,2]", 3))
+        self.assertEqual([1500.75], read_array("[1500.75]", 6))
+    def test_errors(self):
+        """Anything but a complete JSON array is an error"""
+        for text in ["", "   ", '{"index": "logs-1"}', "[1, 2", '[{"index": "logs-']:
+            with self.assertRaises(ValueError, msg=text):
+                read_array(text, 4)
+
+class TestIterCatFile(TestCase):
+    """Test iter_cat_file()"""
+    def test_formats(self):
+        """A JSON array, after any whitespace, and NDJSON, with blank lines, are both read"""
+        with TemporaryDirectory() as tmpdir:
+            array = os.path.join(tmpdir, "cat.json")
+            with open(array, "w", encoding="utf-8") as fileobj:
+                fileobj.write("\n  " + json.dumps(ITEMS[:3], indent=2))
+            ndjson = os.path.join(tmpdir, "cat.ndjson")
+            with open(ndjson, "w", encoding="utf-8") as fileobj:
+                fileobj.write("\n".join(json.dumps(item) for item in ITEMS[:3]) + "\n\n")
+            self.assertEqual(ITEMS[:3], list(ingest_cat_file.iter_cat_file(array)))
+            self.assertEqual(ITEMS[:3], list(ingest_cat_file.iter_cat_file(ndjson)))
+
+class TestBulkload(TestCase):
+    """Test bulkload()"""
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()  # pylint: disable=consider-using-with
+    def tearDown(self):
+        self.tmpdir.cleanup()
+    def rollup_ids(self, filename):
+        """Return the rollup _ids of filename, read as ingest_cat_doc does with one file"""
+        rollups = cat_rollup.Rollups(["*"], "cat-rollups")
+        documents = ingest_cat_file.cat_documents(ingest_cat_file.iter_cat_file(filename))
+        actions = ingest_cat_file.bulkload(
+            "cat", documents, None, rollups,
+            rollup_timestamp=ingest_cat_file.file_timestamp(filename))
+        return [action["_id"] for action in actions if action["_index"] == "cat-rollups"]
+    def test_rollups_reload(self):
+        """Loading the same file again gives its rollups the same _id, so they are overwritten"""
+        filename = os.path.join(self.tmpdir.name, "cat.json")
+        with open(filename, "w", encoding="utf-8") as fileobj:
+            json.dump([dict(ITEM)], fileobj)
+        os.utime(filename, (1673740800, 1673740800))
+        self.assertEqual(["*-1673740800"], self.rollup_ids(filename))
+        self.assertEqual(["*-1673740800"], self.rollup_ids(filename))
+    def test_rollup_timestamp(self):
+        """Rollups take the rollup timestamp, while documents keep the index uuid as their _id"""
+        rollups = cat_rollup.Rollups(["*"], "cat-rollups")
+        stamp = ingest_cat_file.file_timestamp("cat-2023-01-15.json")
+        documents = ingest_cat_file.cat_documents([dict(ITEM)])
+        actions = list(ingest_cat_file.bulkload("cat", documents, None, rollups, stamp))
+        self.assertEqual(["abc", "*-1673740800"], [action["_id"] for action in actions])
+        self.assertEqual("2023-01-15T00:00:00+00:00", actions[1]["_source"]["@timestamp"])
+
+class TestFileTimestamp(TestCase):
+    """Test file_timestamp()"""
+    def test_file_name(self):
+        """The date, and time, if any, in the file name is the time of the snapshot, in UTC"""
+        expected = {
+            "cat-2023-01-15.json": datetime(2023, 1, 15, tzinfo=timezone.utc),
+            "archive/2022/cat_20230115T0600.ndjson": datetime(
+                2023, 1, 15, 6, 0, tzinfo=timezone.utc),
+            "cat.2023.01.15-06.30.45.json": datetime(2023, 1, 15, 6, 30, 45, tzinfo=timezone.utc),
+            "cat-2023-01-15 0630.json": datetime(2023, 1, 15, 6, 30, tzinfo=timezone.utc),
+        }
+        for filename, stamp in expected.items():
+            self.assertEqual(stamp, ingest_cat_file.file_timestamp(filename), filename)
+    def test_modified(self):
+        """Without a valid date in its name, a file's time is when it was last modified"""
+        with TemporaryDirectory() as tmpdir:
+            for name in ["cat.json", "cat-2023-13-45.json"]:
+                filename = os.path.join(tmpdir, name)
+                with open(filename, "w", encoding="utf-8") as fileobj:
+                    fileobj.write("[]")
+                os.utime(filename, (1673740800.5, 1673740800.5))
+                self.assertEqual(
+                    datetime(2023, 1, 15, tzinfo=timezone.utc),
+                    ingest_cat_file.file_timestamp(filename), name)
+
+class Interrupted(Exception):
+    """Raised by FakeSend to stop a run part way through"""
+
+class FakeSend:
+    """
+    Stand in for cat_bulk.send(), indexing each action in turn, as the bulk helpers report them,
+    and failing after limit actions, if given
+    """
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.sent = []
+
+    def __call__(self, client, actions, progress=None, **kwargs):
+        stats = cat_bulk.BulkStats()
+        for action in actions:
+            if self.limit is not None and len(self.sent) >= self.limit:
+                raise Interrupted("Interrupted after {0} documents".format(self.limit))
+            self.sent.append(action["_id"])
+            stats.total += 1
+            stats.successes += 1
+            progress.update(1)
+        return stats
+
+class TestCheckpoint(TestCase):
+    """Test resuming a backfill with --checkpoint"""
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.checkpoint = os.path.join(self.tmpdir.name, "backfill.done")
+        self.files = []
+        for day in range(1, 4):
+            filename = os.path.join(self.tmpdir.name, "cat-2023-01-{0:02}.json".format(day))
+            items = [dict(ITEM, uuid="{0}-{1}".format(day, num)) for num in range(2)]
+            with open(filename, "w", encoding="utf-8") as fileobj:
+                json.dump(items, fileobj)
+            self.files.append(filename)
+    def tearDown(self):
+        self.tmpdir.cleanup()
+    def run_backfill(self, send):
+        """Run ingest_cat_file.py on the directory, with the checkpoint, and return the result"""
+        args = [
+            "--index", "cat", "--es_url", "http://127.0.0.1:9200", "--username", "elastic",
+            "--password", "secret", "--checkpoint", self.checkpoint, self.tmpdir.name,
+        ]
+        with patch.object(ingest_cat_file, "Elasticsearch", MagicMock()), \
+                patch.object(cat_bulk, "send", send):
+            return CliRunner().invoke(ingest_cat_file.ingest_cat_doc, args)
+    def done(self):
+        """Return the files recorded in the checkpoint file"""
+        with open(self.checkpoint, encoding="utf-8") as fileobj:
+            return fileobj.read().splitlines()
+    def test_resume(self):
+        """Only files whose documents were all indexed are recorded, and skipped when resumed"""
+        # Interrupted part of the way through the second file
+        send = FakeSend(limit=3)
+        result = self.run_backfill(send)
+        self.assertIsInstance(result.exception, Interrupted)
+        self.assertIn("Reading 3 files, 0 already done", result.output)
+        self.assertEqual(self.files[:1], self.done())
+        # The second file is sent again, in full
+        send = FakeSend()
+        result = self.run_backfill(send)
+        self.assertEqual(0, result.exit_code, result.output)
+        self.assertIn("Reading 2 files, 1 already done", result.output)
+        # Each _id is the index uuid and the time of the file
+        self.assertEqual(["2-0", "2-1", "3-0", "3-1"], [_id.rsplit("-", 1)[0] for _id in send.sent])
+        self.assertEqual(self.files, self.done())
+        # Nothing is left to do
+        send = FakeSend()
+        result = self.run_backfill(send)
+        self.assertIn("Reading 0 files, 3 already done", result.output)
+        self.assertEqual([], send.sent)
+    def test_record_in_order(self):
+        """A file is only recorded once the documents of every file before it are indexed too"""
+        progress = MagicMock()
+        checkpoint = ingest_cat_file.Checkpoint(self.checkpoint, progress=progress)
+        first = list(checkpoint.track("first", iter(range(2))))
+        second = list(checkpoint.track("second", iter(range(1))))
+        self.assertEqual(([0, 1], [0]), (first, second))
+        checkpoint.update(1)
+        self.assertEqual(set(), checkpoint.done)
+        checkpoint.update(2)
+        self.assertEqual({"first", "second"}, checkpoint.done)
+        checkpoint.close()
+        self.assertEqual(["first", "second"], self.done())
+        self.assertEqual(3, sum(call.args[0] for call in progress.update.call_args_list))
+        resumed = ingest_cat_file.Checkpoint(self.checkpoint)
+        resumed.close()
+        self.assertEqual({"first", "second"}, resumed.done)